@@ -0,0 +1,77 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Throughput benchmark of the evaluation predictions.
+
+Compares the DMatrix path evaluate.py used to take with in-place prediction
+on float32 blocks, with one and several worker threads, on synthetic rows
+shaped like the preprocessed abalone data.
+
+    PYTHONPATH=./src python benchmarks/bench_evaluate.py
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import xgboost
+
+from evaluate import InplacePredictor
+
+def make_data(rng, rows):
+    X = rng.random((rows, 10))
+    X[:, 7:] = np.eye(3)[rng.integers(0, 3, rows)]
+    y = rng.integers(1, 29, rows).astype(float)
+    return X, y
+
+def measure(fn, X, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(X)
+        timings.append(time.perf_counter() - start)
+    return len(X) / min(timings)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 1000000])
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--nthread", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    X, y = make_data(rng, 10000)
+    model = xgboost.train(
+        {"objective": "reg:squarederror", "max_depth": 5},
+        xgboost.DMatrix(X, label=y),
+        num_boost_round=args.rounds,
+    )
+
+    paths = {
+        "dmatrix": lambda X: model.predict(xgboost.DMatrix(X)),
+        "inplace": InplacePredictor(model.copy(), args.nthread).predict,
+        "inplace x4": InplacePredictor(model.copy(), args.nthread, workers=4).predict,
+    }
+
+    print(f"{'rows':>9} {'path':>12} {'rows/s':>14}")
+    for rows in args.rows:
+        X, _ = make_data(rng, rows)
+        for name, fn in paths.items():
+            throughput = measure(fn, X, args.repeats)
+            print(f"{rows:>9} {name:>12} {throughput:>14,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Microbenchmark of the CSV request parsing in transform.input_fn.
+
+Compares the per-request latency of the fast parser with the pandas parser
+for single-row and small-batch payloads, including the transform by a
+preprocessing model fitted on synthetic data.
+
+    PYTHONPATH=./src python benchmarks/bench_input_fn.py
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from preprocess import DataProcessor, feature_columns_names, label_column
+from transform import model_fn, parse_csv, predict_fn, read_csv_frame
+
+def make_payload(rng, rows):
+    sex = rng.choice(["M", "F", "I"], rows)
+    values = rng.random((rows, 7)).round(4)
+    return "\n".join(
+        ",".join([s] + [str(v) for v in row]) for s, row in zip(sex, values)
+    )
+
+def fit_model(rng):
+    df = pd.DataFrame(rng.random((1000, 8)), columns=feature_columns_names[1:] + [label_column])
+    df.insert(0, "sex", rng.choice(["M", "F", "I"], 1000))
+    model_dir = tempfile.mkdtemp()
+    DataProcessor(df).save_model(model_dir)
+    return model_fn(model_dir)
+
+def measure(fn, payload, iterations):
+    latencies = np.empty(iterations)
+    for index in range(iterations):
+        start = time.perf_counter()
+        fn(payload)
+        latencies[index] = time.perf_counter() - start
+    return np.percentile(latencies, [50, 99]) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 10, 100])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    model = fit_model(rng)
+    paths = {
+        "fast": parse_csv,
+        "pandas": read_csv_frame,
+        "fast+predict": lambda payload: predict_fn(parse_csv(payload), model),
+        "pandas+predict": lambda payload: predict_fn(read_csv_frame(payload), model),
+    }
+
+    print(f"{'rows':>6} {'path':>16} {'p50 us':>10} {'p99 us':>10}")
+    for rows in args.rows:
+        payload = make_payload(rng, rows)
+        for name, fn in paths.items():
+            p50, p99 = measure(fn, payload, args.iterations)
+            print(f"{rows:>6} {name:>16} {p50:>10.1f} {p99:>10.1f}")
+
+if __name__ == "__main__":
+    main()
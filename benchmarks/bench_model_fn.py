@@ -0,0 +1,116 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Cold start benchmark of transform.model_fn.
+
+Every measurement runs in a fresh interpreter, like a new serving worker,
+and reports the time to import the serving code, to load the model and to
+answer the first request. Compares the plain joblib load and sklearn
+transform the container used to do, the memory mapped joblib artifact and
+the flat kernel arrays.
+
+    PYTHONPATH=./src python benchmarks/bench_model_fn.py
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from preprocess import DataProcessor, feature_columns_names, label_column
+
+ROW = "M,0.455,0.365,0.095,0.514,0.2245,0.101,0.15"
+
+# Each snippet prints the import, load and first request times in seconds.
+SNIPPETS = {
+    "joblib (before)": """
+import time
+start = time.perf_counter()
+from io import StringIO
+import joblib, pandas as pd
+imported = time.perf_counter()
+model = joblib.load("{model_dir}/model.joblib")
+loaded = time.perf_counter()
+df = pd.read_csv(StringIO("{row}"), header=None)
+df.columns = {columns}
+model.transform(df)
+done = time.perf_counter()
+print(imported - start, loaded - imported, done - loaded)
+""",
+    "joblib mmap + compile": """
+import time
+start = time.perf_counter()
+import transform
+imported = time.perf_counter()
+model = transform.model_fn("{joblib_dir}")
+loaded = time.perf_counter()
+transform.predict_fn(transform.input_fn("{row}", "text/csv"), model)
+done = time.perf_counter()
+print(imported - start, loaded - imported, done - loaded)
+""",
+    "kernel arrays": """
+import time
+start = time.perf_counter()
+import transform
+imported = time.perf_counter()
+model = transform.model_fn("{model_dir}")
+loaded = time.perf_counter()
+transform.predict_fn(transform.input_fn("{row}", "text/csv"), model)
+done = time.perf_counter()
+print(imported - start, loaded - imported, done - loaded)
+""",
+}
+
+def make_model_dirs():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.random((1000, 8)), columns=feature_columns_names[1:] + [label_column])
+    df.insert(0, "sex", rng.choice(["M", "F", "I"], 1000))
+    model_dir = tempfile.mkdtemp()
+    DataProcessor(df).save_model(model_dir)
+    joblib_dir = tempfile.mkdtemp()
+    shutil.copy(os.path.join(model_dir, "model.joblib"), joblib_dir)
+    return model_dir, joblib_dir
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-warmup", action="store_true")
+    args = parser.parse_args()
+
+    model_dir, joblib_dir = make_model_dirs()
+    env = dict(os.environ, TRANSFORM_WARMUP="false" if args.no_warmup else "true")
+
+    print(f"{'variant':>24} {'import ms':>10} {'load ms':>10} {'first request ms':>17}")
+    for name, snippet in SNIPPETS.items():
+        code = snippet.format(
+            model_dir=model_dir,
+            joblib_dir=joblib_dir,
+            row=ROW,
+            columns=json.dumps(feature_columns_names),
+        )
+        timings = [
+            [float(value) for value in subprocess.check_output([sys.executable, "-c", code], env=env).split()]
+            for _ in range(args.repeats)
+        ]
+        imported, loaded, first = np.median(timings, axis=0) * 1e3
+        print(f"{name:>24} {imported:>10.1f} {loaded:>10.1f} {first:>17.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Benchmark of the CSV encoding in transform.output_fn.
+
+Compares the toolkit's csv module encoder with the vectorized encoder,
+both building the whole response and streaming it in chunks, over
+prediction matrices of abalone shape. Reports the time of an untraced run
+and the peak memory allocated during a second, traced run.
+
+    PYTHONPATH=./src python benchmarks/bench_output_fn.py
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from transform import array_to_csv, encode_csv_chunks
+
+def consume(chunks):
+    nbytes = 0
+    for chunk in chunks:
+        nbytes += len(chunk)
+    return nbytes
+
+ENCODERS = {
+    "toolkit csv": lambda prediction: array_to_csv(prediction),
+    "vectorized": lambda prediction: "".join(encode_csv_chunks(prediction)),
+    "vectorized streamed": lambda prediction: consume(encode_csv_chunks(prediction)),
+}
+
+def measure(fn, prediction):
+    start = time.perf_counter()
+    fn(prediction)
+    elapsed = time.perf_counter() - start
+
+    # Tracing every allocation slows the encoders down, so it is a separate run.
+    tracemalloc.start()
+    fn(prediction)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'rows':>9} {'encoder':>20} {'seconds':>9} {'peak MB':>9}")
+    for rows in args.rows:
+        prediction = rng.normal(size=(rows, 11))
+        for name, fn in ENCODERS.items():
+            elapsed, peak = measure(fn, prediction)
+            print(f"{rows:>9} {name:>20} {elapsed:>9.3f} {peak / 2 ** 20:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Benchmark of the fused single container against the two-container pipeline.
+
+Serves CSV requests of a few sizes with serve.py, and with the transform
+container followed by the CSV decoding and prediction of the XGBoost
+container, chained in process as load_test.py does. Reports the best and
+the median latency of each. The HTTP hop between the two containers is
+not included, so the saving of the fused container is a lower bound.
+
+    PYTHONPATH=./src:./benchmarks python benchmarks/bench_serve.py
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from load_test import FusedPipeline, Pipeline
+from suite import fit_artifacts
+from synthetic import make_abalone, to_csv_payload
+from transform import model_fn
+
+def measure(pipeline, payload, repeats):
+    pipeline("text/csv", payload)
+    latencies = np.empty(repeats)
+    for index in range(repeats):
+        start = time.perf_counter()
+        pipeline("text/csv", payload)
+        latencies[index] = time.perf_counter() - start
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 100, 1_000])
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model_dir = tempfile.mkdtemp()
+    booster = fit_artifacts(args.seed, model_dir)
+    preprocessor = model_fn(model_dir)
+    pipelines = {
+        "two containers": Pipeline(preprocessor, booster),
+        "fused": FusedPipeline(preprocessor, booster),
+    }
+    df = make_abalone(max(args.rows), args.seed, missing_rate=0.0).drop(columns="rings")
+
+    print(f"{'rows':>6} {'pipeline':>15} {'best ms':>9} {'p50 ms':>9}")
+    for rows in args.rows:
+        payload = to_csv_payload(df.head(rows))
+        for name, pipeline in pipelines.items():
+            latencies = measure(pipeline, payload, args.repeats) * 1e3
+            print(f"{rows:>6} {name:>15} {latencies.min():>9.3f} {np.median(latencies):>9.3f}")
+
+if __name__ == "__main__":
+    main()
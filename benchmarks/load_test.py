@@ -0,0 +1,387 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Load generator for the two-container inference pipeline, run in process.
+
+Every request goes through transform.input_fn, predict_fn and output_fn, the
+way the SKLearnTransform container serves it, and then through the CSV
+decoding, tree prediction and encoding of the XGBoost container. Requests
+are drawn from a mix of content types and batch sizes, and are driven
+either by a pool of threads that each send the next request as soon as the
+previous one returns (``--mode threads``), or by an asyncio loop that sends
+them at a fixed arrival rate to a pool of workers (``--mode asyncio``), so
+that the latency includes the time spent queueing. The report has the
+p50/p95/p99 latency of each stage, the requests per second a single worker
+sustains in the stage, and the requests and rows per second achieved.
+
+    PYTHONPATH=./src:./benchmarks python benchmarks/load_test.py \
+        --concurrency 4 --requests 20000 --batch-rows 1 10 100 \
+        --mix text/csv=0.9 application/jsonlines=0.1
+
+The models are fitted on synthetic data unless --model-dir and
+--xgboost-model point at the artifacts of a pipeline run.
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import serve
+from evaluate import load_model
+from suite import environment, fit_artifacts
+from synthetic import make_abalone, to_csv_payload
+from transform import input_fn, model_fn, output_fn, predict_fn
+
+TRANSFORM_STAGES = ["input_fn", "predict_fn", "output_fn"]
+XGBOOST_STAGES = ["xgb_input", "xgb_predict", "xgb_output"]
+
+def encode_jsonlines(df):
+    return "".join(json.dumps(row) + "\n" for row in df.to_numpy().tolist())
+
+def encode_npy(df):
+    buffer = io.BytesIO()
+    np.save(buffer, df.to_records(index=False, column_dtypes={"sex": "U1"}), allow_pickle=False)
+    return buffer.getvalue()
+
+def encode_parquet(df):
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+# Request encoders of the content types transform.input_fn accepts.
+payload_encoders = {
+    "text/csv": to_csv_payload,
+    "application/jsonlines": encode_jsonlines,
+    "application/x-npy": encode_npy,
+    "application/x-parquet": encode_parquet,
+}
+
+def parse_mix(mix):
+    """Parses ``content-type=weight`` pairs into content types and probabilities."""
+    content_types, weights = [], []
+    for entry in mix:
+        content_type, _, weight = entry.partition("=")
+        if content_type not in payload_encoders:
+            raise ValueError(f"{content_type} is not one of {', '.join(payload_encoders)}.")
+        content_types.append(content_type)
+        weights.append(float(weight or 1))
+    weights = np.array(weights)
+    return content_types, weights / weights.sum()
+
+def make_requests(count, content_types, weights, batch_rows, seed):
+    """Encodes ``count`` distinct requests of unlabelled rows.
+
+    Requests are encoded up front, so that the load generator does not
+    compete with the pipeline for the CPU.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = rng.choice(batch_rows, count)
+    df = make_abalone(int(sizes.sum()), seed, missing_rate=0.0).drop(columns="rings")
+    requests = []
+    start = 0
+    for size, content_type in zip(sizes, rng.choice(content_types, count, p=weights)):
+        rows = df.iloc[start:start + size].reset_index(drop=True)
+        requests.append((content_type, payload_encoders[content_type](rows), int(size)))
+        start += size
+    return requests
+
+def decode_xgboost_csv(body):
+    """Reads the features sent to the XGBoost container into a float32 matrix."""
+    # in-place prediction of xgboost 1.2 only takes row-major arrays
+    return np.ascontiguousarray(pd.read_csv(io.StringIO(body), header=None, dtype=np.float32).to_numpy())
+
+class Pipeline:
+    """The transform and XGBoost containers, chained in process."""
+
+    def __init__(self, preprocessor, booster, nthread=None) -> None:
+        self.preprocessor = preprocessor
+        self.booster = booster
+        if nthread:
+            self.booster.set_param({"nthread": nthread})
+
+    def __call__(self, content_type, payload):
+        """Serves a request, returning the response and the seconds of each stage."""
+        timings = {}
+        clock = time.perf_counter()
+
+        def lap(stage):
+            nonlocal clock
+            now = time.perf_counter()
+            timings[stage] = now - clock
+            clock = now
+
+        data = input_fn(payload, content_type)
+        lap("input_fn")
+        features = predict_fn(data, self.preprocessor)
+        lap("predict_fn")
+        body, accept = output_fn(features, "text/csv")
+        if not isinstance(body, (str, bytes)):
+            body = "".join(body)
+        lap("output_fn")
+
+        if accept != "text/csv":
+            raise ValueError(f"The XGBoost container does not read {accept}.")
+        matrix = decode_xgboost_csv(body)
+        lap("xgb_input")
+        predictions = self.booster.inplace_predict(matrix)
+        lap("xgb_predict")
+        response = "\n".join(map(repr, predictions.tolist()))
+        lap("xgb_output")
+        return response, timings
+
+class FusedPipeline(Pipeline):
+    """The single container of serve.py, serving the fused artifact."""
+
+    def __init__(self, preprocessor, booster, nthread=None) -> None:
+        super().__init__(preprocessor, booster, nthread)
+        self.model = serve.FusedModel(preprocessor, booster)
+
+    def __call__(self, content_type, payload):
+        timings = {}
+        start = time.perf_counter()
+        data = input_fn(payload, content_type)
+        parsed = time.perf_counter()
+        predictions = serve.predict_fn(data, self.model)
+        predicted = time.perf_counter()
+        response, _ = serve.output_fn(predictions, "text/csv")
+        timings["input_fn"] = parsed - start
+        timings["predict_fn"] = predicted - parsed
+        timings["output_fn"] = time.perf_counter() - predicted
+        return response, timings
+
+class Recorder:
+    """Collects the stage timings of the completed requests."""
+
+    def __init__(self) -> None:
+        self.timings = []
+        self.rows = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, timings, rows):
+        with self._lock:
+            self.timings.append(timings)
+            self.rows += rows
+
+    def fail(self):
+        with self._lock:
+            self.errors += 1
+
+def send(pipeline, recorder, request, queued=None):
+    content_type, payload, rows = request
+    start = time.perf_counter()
+    try:
+        _, timings = pipeline(content_type, payload)
+    except Exception:
+        # failed requests are counted, and make the run exit with an error
+        recorder.fail()
+        return
+    end = time.perf_counter()
+    if queued is not None:
+        timings["queue"] = start - queued
+        timings["total"] = end - queued
+    else:
+        timings["total"] = end - start
+    recorder.record(timings, rows)
+
+def run_threads(pipeline, requests, args):
+    """Closed loop: every thread sends its next request when the last returns."""
+    recorder = Recorder()
+    schedule = iter(itertools.islice(itertools.cycle(requests), args.requests))
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration if args.duration else None
+
+    def worker():
+        while deadline is None or time.perf_counter() < deadline:
+            with lock:
+                request = next(schedule, None)
+            if request is None:
+                return
+            send(pipeline, recorder, request)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(args.concurrency)]:
+            future.result()
+    return recorder, time.perf_counter() - start
+
+def run_asyncio(pipeline, requests, args):
+    """Open loop: requests arrive at ``--rate`` per second and queue for the workers.
+
+    Arrivals are Poisson distributed. Without a rate, the loop keeps
+    ``--concurrency`` requests in flight.
+    """
+    recorder = Recorder()
+    rng = np.random.default_rng(args.seed)
+
+    async def drive():
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(args.concurrency)
+        in_flight = asyncio.Semaphore(args.concurrency)
+        tasks = []
+        start = time.perf_counter()
+        arrival = start
+        for request in itertools.islice(itertools.cycle(requests), args.requests):
+            if args.duration and time.perf_counter() - start >= args.duration:
+                break
+            if args.rate:
+                arrival += rng.exponential(1 / args.rate)
+                await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+                queued = arrival
+            else:
+                await in_flight.acquire()
+                queued = time.perf_counter()
+            task = loop.run_in_executor(executor, send, pipeline, recorder, request, queued)
+            if not args.rate:
+                task.add_done_callback(lambda _: in_flight.release())
+            tasks.append(task)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        executor.shutdown()
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(drive())
+    return recorder, elapsed
+
+runners = {
+    "threads": run_threads,
+    "asyncio": run_asyncio,
+}
+
+def summarize(recorder, elapsed, model_fn_seconds):
+    """Returns the latency percentiles and requests per second of every stage."""
+    stages = {}
+    names = ["queue"] + TRANSFORM_STAGES + XGBOOST_STAGES + ["total"]
+    for name in names:
+        seconds = np.array([timings[name] for timings in recorder.timings if name in timings])
+        if not len(seconds):
+            continue
+        stage = {"count": len(seconds), "mean_ms": float(seconds.mean() * 1e3)}
+        for percentile in [50, 95, 99]:
+            stage[f"p{percentile}_ms"] = float(np.percentile(seconds, percentile) * 1e3)
+        if name not in ("queue", "total"):
+            # requests per second a single worker sustains in this stage
+            stage["worker_rps"] = float(len(seconds) / max(seconds.sum(), 1e-12))
+        stages[name] = stage
+    return {
+        "model_fn_ms": model_fn_seconds * 1e3,
+        "elapsed_seconds": elapsed,
+        "requests": len(recorder.timings),
+        "errors": recorder.errors,
+        "requests_per_second": len(recorder.timings) / elapsed,
+        "rows_per_second": recorder.rows / elapsed,
+        "stages": stages,
+    }
+
+def print_report(report):
+    print(f"\n{'stage':>12} {'count':>8} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'worker rps':>11}")
+    for name, stage in report["stages"].items():
+        worker_rps = f"{stage['worker_rps']:>11,.0f}" if "worker_rps" in stage else f"{'':>11}"
+        print(
+            f"{name:>12} {stage['count']:>8} {stage['mean_ms']:>9.3f} {stage['p50_ms']:>9.3f} "
+            f"{stage['p95_ms']:>9.3f} {stage['p99_ms']:>9.3f} {worker_rps}"
+        )
+    print(
+        f"\nmodel_fn took {report['model_fn_ms']:.1f} ms. {report['requests']} requests "
+        f"and {report['errors']} errors in {report['elapsed_seconds']:.2f}s: "
+        f"{report['requests_per_second']:,.0f} requests/s, {report['rows_per_second']:,.0f} rows/s."
+    )
+
+def load_models(args):
+    """Loads the pipeline artifacts, or fits models on synthetic data.
+
+    Returns the preprocessor, the booster and the seconds model_fn took.
+    """
+    if args.model_dir is None:
+        model_dir = tempfile.mkdtemp()
+        booster = fit_artifacts(args.seed, model_dir)
+    else:
+        model_dir = args.model_dir
+        booster = load_model(args.xgboost_model, tempfile.mkdtemp())
+    start = time.perf_counter()
+    preprocessor = model_fn(model_dir)
+    return preprocessor, booster, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser("Drives the inference pipeline in process and reports its latency.")
+    parser.add_argument("--mode", choices=list(runners), default="threads")
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count())
+    parser.add_argument("--requests", type=int, default=10000, help="Number of requests sent.")
+    parser.add_argument("--duration", type=float, default=None, help="Stop sending after this many seconds.")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Requests per second sent in asyncio mode. Unset keeps --concurrency requests in flight.",
+    )
+    parser.add_argument("--batch-rows", type=int, nargs="+", default=[1], help="Rows per request, drawn uniformly.")
+    parser.add_argument(
+        "--mix",
+        nargs="+",
+        default=["text/csv=1"],
+        help="Content types of the requests with their weights, as content-type=weight.",
+    )
+    parser.add_argument("--distinct-requests", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model-dir", default=None, help="Directory of the preprocessing model.")
+    parser.add_argument("--xgboost-model", default=None, help="model.tar.gz of the XGBoost model.")
+    parser.add_argument("--xgboost-nthread", type=int, default=None)
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="Serve with the single container of serve.py instead of the two containers.",
+    )
+    parser.add_argument("--output", default=None, help="Path of a JSON file for the report.")
+    args = parser.parse_args()
+    if (args.model_dir is None) != (args.xgboost_model is None):
+        parser.error("--model-dir and --xgboost-model go together.")
+
+    content_types, weights = parse_mix(args.mix)
+    preprocessor, booster, model_fn_seconds = load_models(args)
+    pipeline = (FusedPipeline if args.fused else Pipeline)(preprocessor, booster, args.xgboost_nthread)
+    requests = make_requests(args.distinct_requests, content_types, weights, args.batch_rows, args.seed)
+    # the first request of each content type pays for its cold code paths
+    for content_type in content_types:
+        pipeline(*next(request for request in requests if request[0] == content_type)[:2])
+
+    recorder, elapsed = runners[args.mode](pipeline, requests, args)
+    report = summarize(recorder, elapsed, model_fn_seconds)
+    report["settings"] = {
+        "mode": args.mode,
+        "fused": args.fused,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "batch_rows": args.batch_rows,
+        "mix": dict(zip(content_types, weights.tolist())),
+    }
+    report["environment"] = environment()
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if recorder.errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
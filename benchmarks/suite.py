@@ -0,0 +1,274 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Benchmark suite of the preprocessing, serving and evaluation hot paths.
+
+Runs every hot path over seeded synthetic abalone data of each size and
+reports its throughput, the latency percentiles of its calls and the peak
+memory allocated, which tracemalloc measures in a second, untimed run. The
+results are saved as JSON and compared with a stored baseline; the suite
+fails when a path lost more throughput or needs more memory than the
+tolerance allows.
+
+    PYTHONPATH=./src:./benchmarks python benchmarks/suite.py \
+        --sizes 1000 100000 1000000 --baseline benchmarks/baseline.json
+
+The default sizes go up to 10 million rows, which takes about half an hour
+and 4 GB of memory on one core.
+
+The hot paths are:
+
+* preprocess: DataProcessor.process on the raw rows.
+* serving: transform.input_fn, predict_fn and output_fn on CSV requests of
+  --batch-rows rows each.
+* evaluate: in-place prediction and the streamed metrics with bootstrap
+  intervals over blocks of the preprocessed rows, as evaluate.py runs them.
+
+Machines differ, so a baseline is only meaningful on the machine it was
+recorded on; record one with --save-baseline before comparing changes. The
+baseline stores the machine and the versions of the libraries it was
+recorded with, and the comparison warns about every difference. The stored
+baseline was recorded with the versions pinned in tests/requirements.txt.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import sklearn
+import xgboost
+
+from evaluate import (
+    DEFAULT_PREDICT_BLOCK_ROWS,
+    BootstrapMetrics,
+    InplacePredictor,
+    RegressionMetrics,
+    evaluate,
+)
+from preprocess import DataProcessor
+from synthetic import make_abalone, to_csv_payload
+from transform import input_fn, model_fn, output_fn, predict_fn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "ml_pipeline"))
+
+from pipeline_config import XGB_HYPERPARAMETERS, training_params  # noqa: E402
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+
+# Hyperparameters of the training step in ml_pipeline/pipeline.py.
+XGB_PARAMS, XGB_ROUNDS = training_params(XGB_HYPERPARAMETERS)
+
+def fit_artifacts(seed, model_dir):
+    """Fits the preprocessing model on synthetic data and saves it to ``model_dir``.
+
+    Returns an XGBoost model trained on the preprocessed data.
+    """
+    df = make_abalone(10_000, seed)
+    data_processor = DataProcessor(df.copy())
+    data = data_processor.process()
+    data_processor.save_model(model_dir)
+    return xgboost.train(
+        XGB_PARAMS, xgboost.DMatrix(data[:, 1:], label=data[:, 0]), XGB_ROUNDS
+    )
+
+def fit_models(seed):
+    """Fits the preprocessing model and an XGBoost model on synthetic data."""
+    model_dir = tempfile.mkdtemp()
+    booster = fit_artifacts(seed, model_dir)
+    return model_fn(model_dir), booster
+
+def preprocess_calls(rows, seed, models, args):
+    df = make_abalone(rows, seed)
+
+    def prepare():
+        # fitting pops the label, so every call gets its own copy
+        frame = df.copy()
+        return lambda: DataProcessor(frame).process()
+
+    for _ in range(repeats(rows, args)):
+        yield rows, prepare
+
+def serving_calls(rows, seed, models, args):
+    preprocessor, _ = models
+    # real-time requests rarely miss values, which would select the slower parser
+    df = make_abalone(rows, seed, missing_rate=0.0).drop(columns="rings")
+
+    def request(payload):
+        body, _ = output_fn(predict_fn(input_fn(payload, "text/csv"), preprocessor), "text/csv")
+        if not isinstance(body, (str, bytes)):
+            body = "".join(body)
+        return body
+
+    payloads = [
+        to_csv_payload(df.iloc[start:start + args.batch_rows]) for start in range(0, rows, args.batch_rows)
+    ]
+    request(payloads[0])
+    for _ in range(repeats(rows, args)):
+        for payload in payloads:
+            yield payload.count("\n"), lambda payload=payload: lambda: request(payload)
+
+def evaluate_calls(rows, seed, models, args):
+    _, booster = models
+    data = DataProcessor(make_abalone(rows, seed)).process()
+    predictor = InplacePredictor(booster)
+    blocks = [
+        (data[start:start + DEFAULT_PREDICT_BLOCK_ROWS, 0], data[start:start + DEFAULT_PREDICT_BLOCK_ROWS, 1:])
+        for start in range(0, rows, DEFAULT_PREDICT_BLOCK_ROWS)
+    ]
+
+    def make_metrics():
+        return RegressionMetrics(BootstrapMetrics(args.bootstrap_resamples))
+
+    for _ in range(repeats(rows, args)):
+        yield rows, lambda: lambda: evaluate(predictor, iter(blocks), make_metrics)
+
+HOT_PATHS = {
+    "preprocess": preprocess_calls,
+    "serving": serving_calls,
+    "evaluate": evaluate_calls,
+}
+
+def repeats(rows, args):
+    """Repeats the smaller sizes to steady their timings."""
+    return max(1, min(args.repeats, 1_000_000 // rows))
+
+def run_path(path, rows, models, args):
+    """Times the calls of a hot path, each made by a function that prepares it."""
+    calls = list(HOT_PATHS[path](rows, args.seed, models, args))
+    latencies = np.empty(len(calls))
+    processed = 0
+    for index, (call_rows, prepare) in enumerate(calls):
+        call = prepare()
+        start = time.perf_counter()
+        call()
+        latencies[index] = time.perf_counter() - start
+        processed += call_rows
+
+    result = {
+        "path": path,
+        "rows": rows,
+        "calls": len(calls),
+        "throughput_rows_per_s": processed / latencies.sum(),
+    }
+    for percentile in [50, 95, 99]:
+        result[f"p{percentile}_ms"] = float(np.percentile(latencies, percentile) * 1e3)
+
+    if not args.no_memory:
+        # Tracing every allocation slows the paths down, so it is a separate run.
+        prepared = [prepare() for _, prepare in calls]
+        tracemalloc.start()
+        for call in prepared:
+            call()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_mb"] = peak / 2 ** 20
+    return result
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scikit-learn": sklearn.__version__,
+        "xgboost": xgboost.__version__,
+    }
+
+def compare(results, baseline, tolerance):
+    """Prints the changes against the baseline and returns the regressions."""
+    recorded = baseline.get("environment", {})
+    for name, value in environment().items():
+        if recorded.get(name) != value:
+            print(f"WARNING: the baseline was recorded with {name} {recorded.get(name)}, not {value}")
+
+    previous = {(result["path"], result["rows"]): result for result in baseline["results"]}
+    regressions = []
+    print(f"\n{'path':>10} {'rows':>9} {'throughput':>11} {'peak MB':>9}")
+    for result in results:
+        key = (result["path"], result["rows"])
+        if key not in previous:
+            continue
+        before = previous[key]
+        throughput = result["throughput_rows_per_s"] / before["throughput_rows_per_s"]
+        line = f"{key[0]:>10} {key[1]:>9} {throughput:>10.2f}x"
+        if throughput < 1 - tolerance:
+            regressions.append(f"{key[0]} at {key[1]} rows is {1 - throughput:.0%} slower")
+        if "peak_mb" in result and "peak_mb" in before:
+            memory = result["peak_mb"] / max(before["peak_mb"], 1e-9)
+            line += f" {memory:>8.2f}x"
+            # ignore the noise of small allocations
+            if memory > 1 + tolerance and result["peak_mb"] - before["peak_mb"] > 1:
+                regressions.append(f"{key[0]} at {key[1]} rows needs {memory - 1:.0%} more memory")
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--paths", nargs="+", default=list(HOT_PATHS), choices=list(HOT_PATHS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--batch-rows", type=int, default=100, help="Rows per serving request.")
+    parser.add_argument("--bootstrap-resamples", type=int, default=1000)
+    parser.add_argument("--no-memory", action="store_true", help="Skip the peak memory runs.")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the baseline.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative loss of throughput or growth of peak memory reported as a regression.",
+    )
+    args = parser.parse_args()
+
+    models = fit_models(args.seed)
+    results = []
+    print(f"{'path':>10} {'rows':>9} {'rows/s':>12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak MB':>9}")
+    for rows in args.sizes:
+        for path in args.paths:
+            result = run_path(path, rows, models, args)
+            results.append(result)
+            print(
+                f"{path:>10} {rows:>9} {result['throughput_rows_per_s']:>12,.0f} "
+                f"{result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                f"{result.get('peak_mb', float('nan')):>9.1f}"
+            )
+
+    report = {"environment": environment(), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
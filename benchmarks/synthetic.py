@@ -0,0 +1,55 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Seeded generator of synthetic abalone data for the benchmarks.
+
+The columns follow the shape of the UCI abalone data: the dimensions grow
+with the length, the weights with its cube, and the rings with the shell
+weight. A small share of the numeric values is missing, so that the imputers
+are exercised too.
+"""
+import numpy as np
+import pandas as pd
+
+from preprocess import feature_columns_names, label_column
+
+def make_abalone(rows, seed=0, missing_rate=0.01):
+    """Returns a raw abalone frame of ``rows`` rows, the label last."""
+    rng = np.random.default_rng(seed)
+    length = rng.uniform(0.075, 0.815, rows)
+    noise = lambda scale: rng.normal(1, scale, rows)  # noqa: E731
+    whole_weight = 4.2 * length ** 3 * noise(0.1)
+    shell_weight = 0.29 * whole_weight * noise(0.1)
+    df = pd.DataFrame(
+        {
+            "sex": rng.choice(["M", "F", "I"], rows),
+            "length": length,
+            "diameter": 0.8 * length * noise(0.03),
+            "height": 0.34 * length * noise(0.1),
+            "whole_weight": whole_weight,
+            "shucked_weight": 0.43 * whole_weight * noise(0.1),
+            "viscera_weight": 0.22 * whole_weight * noise(0.1),
+            "shell_weight": shell_weight,
+        },
+        columns=feature_columns_names,
+    )
+    numeric = df.columns[1:]
+    df[numeric] = df[numeric].round(4).mask(rng.random((rows, len(numeric))) < missing_rate)
+    df[label_column] = np.clip(np.round(5 + 14 * shell_weight + rng.normal(0, 2, rows)), 1, 29)
+    return df
+
+def to_csv_payload(df):
+    """Formats raw rows as a headerless CSV request body."""
+    return df.to_csv(header=False, index=False)
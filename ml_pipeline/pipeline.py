@@ -15,14 +15,19 @@
 
 """Example workflow pipeline script for abalone pipeline.
 
-                                               . -RegisterModel
-                                              .
-    Process-> Train -> Evaluate -> Condition .
-                                              .
-                                               . -(stop)
+                                                               . -RegisterModel
+                                                              .
+    [Statistics ->] Process -> Train -> Evaluate -> Condition .
+                                                              .
+                                                               . -(stop)
+
+The Statistics step is only added when the preprocessing is sharded across
+several processing instances.
 
 Implements a get_pipeline(**kwargs) method.
 """
+import hashlib
+import json
 import os
 
 import boto3
@@ -42,8 +47,12 @@ from sagemaker.processing import (
 )
 from sagemaker.sklearn import SKLearnModel
 from sagemaker.sklearn.processing import SKLearnProcessor
+from sagemaker.xgboost import XGBoostModel
 from sagemaker.workflow.functions import Join
-from sagemaker.workflow.conditions import ConditionLessThanOrEqualTo
+from sagemaker.workflow.conditions import (
+    ConditionGreaterThanOrEqualTo,
+    ConditionLessThanOrEqualTo,
+)
 from sagemaker.workflow.condition_step import (
     ConditionStep,
     JsonGet,
@@ -55,6 +64,7 @@ from sagemaker.workflow.parameters import (
 from sagemaker.workflow.pipeline import Pipeline
 from sagemaker.workflow.properties import PropertyFile
 from sagemaker.workflow.steps import (
+    CacheConfig,
     ProcessingStep,
     TrainingStep
 )
@@ -62,8 +72,41 @@ from sagemaker.model import Model
 from sagemaker.pipeline import PipelineModel
 from sagemaker.workflow.step_collections import RegisterModel
 
+from pipeline_config import MSE_THRESHOLD, XGB_HYPERPARAMETERS, fused_source_dir
+
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 
+# Content types of the preprocessing output formats understood by the
+# built-in XGBoost algorithm. The npy format is only meant for custom
+# consumers, so it cannot be used to feed the training step.
+TRAINING_CONTENT_TYPES = {
+    "csv": "text/csv",
+    "libsvm": "text/libsvm",
+    "parquet": "application/x-parquet",
+}
+
+# How long the results of an unchanged step are reused by later executions.
+CACHE_EXPIRE_AFTER = "P30D"
+
+def content_hash(*parts):
+    """Hashes the contents of files, strings and JSON serializable values.
+
+    The hash is passed to a step as its CACHE_KEY environment variable, so
+    that the step arguments SageMaker derives its cache key from change
+    exactly when the step's code, data manifest or parameters do.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str) and os.path.isfile(part):
+            with open(part, "rb") as f:
+                data = f.read()
+        elif isinstance(part, str):
+            data = part.encode("utf-8")
+        else:
+            data = json.dumps(part, sort_keys=True).encode("utf-8")
+        digest.update(hashlib.sha256(data).digest())
+    return digest.hexdigest()
+
 def get_session(region, default_bucket):
     """Gets the sagemaker session based on the region.
 
@@ -93,6 +136,13 @@ def get_pipeline(
     model_package_group_name="AbaloneModelPackageGroup",
     pipeline_name="AbalonePipeline",
     base_job_prefix="Abalone",
+    output_format="csv",
+    champion_model_data=None,
+    gate_on_upper_bound=False,
+    progressive_evaluation=False,
+    enable_caching=True,
+    fused_inference=False,
+    processing_instances=1,
 ):
     """Gets a SageMaker ML Pipeline instance working with on abalone data.
 
@@ -100,16 +150,45 @@ def get_pipeline(
         region: AWS region to create and run the pipeline.
         role: IAM role to create and run steps and pipeline.
         default_bucket: the bucket to use for storing the artifacts
+        output_format: the file format of the preprocessed datasets
+        champion_model_data: S3 URI of the model.tar.gz of the currently approved
+            model; when set the new model is only registered if it does at least
+            as well on the test data
+        gate_on_upper_bound: register the model only if the upper bound of the
+            bootstrap confidence interval of its MSE meets the threshold,
+            rather than the MSE itself
+        progressive_evaluation: score the test data in growing random samples and
+            stop as soon as the model is clearly above the MSE threshold
+        enable_caching: skip the processing, training and evaluation steps whose
+            code, data manifest and parameters did not change since a previous
+            execution, reusing its outputs
+        fused_inference: register a single container model that preprocesses and
+            predicts in one process, packaged from both models by a PackageModel
+            step, instead of the pipeline model of the SKLearn and XGBoost
+            containers
+        processing_instances: the default of the ProcessingInstanceCount
+            parameter; above one the preprocessing is sharded into a
+            ComputeStatistics and a PreprocessData step, otherwise a single
+            PreprocessData step fits and transforms the whole manifest.
+            Raising ProcessingInstanceCount on an execution does not shard
+            the preprocessing of a pipeline defined with one instance; its
+            PreprocessData step fails on start-up instead.
 
     Returns:
         an instance of a pipeline
     """
+    if output_format not in TRAINING_CONTENT_TYPES:
+        raise ValueError(f"Output format {output_format} cannot be used for training.")
+    training_content_type = TRAINING_CONTENT_TYPES[output_format]
+
     sagemaker_session = get_session(region, default_bucket)
     if role is None:
         role = sagemaker.session.get_execution_role(sagemaker_session)
 
     # parameters for pipeline execution
-    processing_instance_count = ParameterInteger(name="ProcessingInstanceCount", default_value=1)
+    processing_instance_count = ParameterInteger(
+        name="ProcessingInstanceCount", default_value=processing_instances
+    )
     processing_instance_type = ParameterString(
         name="ProcessingInstanceType", default_value="ml.t3.medium"
     )
@@ -120,7 +199,38 @@ def get_pipeline(
         name="ModelApprovalStatus", default_value="Approved"
     )
 
-    # processing step for feature engineering
+    cache_config = CacheConfig(enable_caching=enable_caching, expire_after=CACHE_EXPIRE_AFTER)
+
+    # statistics of the manifest entries seen by previous runs, so that the
+    # preprocessing model is only refitted over the new entries
+    state_uri = (
+        f"s3://{sagemaker_session.default_bucket()}/{base_job_prefix}/PreprocessState/statistics.joblib"
+    )
+
+    manifest_path = os.path.join(BASE_DIR, "..", "dataManifest.json")
+    preprocess_code = os.path.join(BASE_DIR, "..", "src", "preprocess.py")
+    # the manifest is delivered as a processing input rather than a job
+    # argument, which limits its size; every host reads its own shard of it
+    manifest_input = ProcessingInput(
+        source=manifest_path,
+        destination="/opt/ml/processing/manifest",
+    )
+    preprocess_arguments = [
+        "--data-manifest-file",
+        "/opt/ml/processing/manifest/dataManifest.json",
+        "--output-format",
+        output_format,
+        "--state-uri",
+        state_uri,
+    ]
+    preprocess_cache_key = content_hash(manifest_path, preprocess_code, preprocess_arguments)
+
+    preprocess_outputs = [
+        ProcessingOutput(output_name="train", source="/opt/ml/processing/train"),
+        ProcessingOutput(output_name="validation", source="/opt/ml/processing/validation"),
+        ProcessingOutput(output_name="test", source="/opt/ml/processing/test"),
+        ProcessingOutput(output_name="model", source="/opt/ml/processing/model"),
+    ]
     sklearn_processor = SKLearnProcessor(
         framework_version="1.2-1",
         instance_type=processing_instance_type,
@@ -128,23 +238,66 @@ def get_pipeline(
         base_job_name=f"{base_job_prefix}/sklearn-preprocess",
         sagemaker_session=sagemaker_session,
         role=role,
+        env={"CACHE_KEY": preprocess_cache_key},
     )
 
-    f = open(os.path.join(BASE_DIR, "..", "dataManifest.json"))
-    step_process = ProcessingStep(
-        name="PreprocessData",
-        processor=sklearn_processor,
-        outputs=[
-            ProcessingOutput(output_name="train", source="/opt/ml/processing/train"),
-            ProcessingOutput(output_name="validation", source="/opt/ml/processing/validation"),
-            ProcessingOutput(output_name="test", source="/opt/ml/processing/test"),
-            ProcessingOutput(output_name="model", source="/opt/ml/processing/model"),
-        ],
-        code=os.path.join(BASE_DIR, "..", "src", "preprocess.py"),
-        job_arguments=["--data-manifest", f.read()],
-    )
+    if processing_instances > 1:
+        # processing step for the partial statistics of each manifest shard
+        statistics_processor = SKLearnProcessor(
+            framework_version="1.2-1",
+            instance_type=processing_instance_type,
+            instance_count=processing_instance_count,
+            base_job_name=f"{base_job_prefix}/sklearn-statistics",
+            sagemaker_session=sagemaker_session,
+            role=role,
+            env={"CACHE_KEY": preprocess_cache_key},
+        )
+        step_statistics = ProcessingStep(
+            name="ComputeStatistics",
+            processor=statistics_processor,
+            inputs=[manifest_input],
+            outputs=[
+                ProcessingOutput(output_name="statistics", source="/opt/ml/processing/statistics"),
+            ],
+            code=preprocess_code,
+            job_arguments=preprocess_arguments + ["--mode", "statistics"],
+            cache_config=cache_config,
+        )
 
-    f.close()
+        # processing step for feature engineering, each host merging the partial
+        # statistics and transforming its own manifest shard
+        step_process = ProcessingStep(
+            name="PreprocessData",
+            processor=sklearn_processor,
+            inputs=[
+                manifest_input,
+                ProcessingInput(
+                    source=step_statistics.properties.ProcessingOutputConfig.Outputs[
+                        "statistics"
+                    ].S3Output.S3Uri,
+                    destination="/opt/ml/processing/statistics",
+                ),
+            ],
+            outputs=preprocess_outputs,
+            code=preprocess_code,
+            job_arguments=preprocess_arguments + ["--mode", "transform"],
+            cache_config=cache_config,
+        )
+        preprocess_steps = [step_statistics, step_process]
+    else:
+        # processing step for feature engineering, fitting and transforming
+        # the whole manifest in one job, which downloads it only once; the
+        # all mode fails fast when it is given more than one host
+        step_process = ProcessingStep(
+            name="PreprocessData",
+            processor=sklearn_processor,
+            inputs=[manifest_input],
+            outputs=preprocess_outputs,
+            code=preprocess_code,
+            job_arguments=preprocess_arguments + ["--mode", "all"],
+            cache_config=cache_config,
+        )
+        preprocess_steps = [step_process]
 
     # training step for generating model artifacts
     model_path = f"s3://{sagemaker_session.default_bucket()}/{base_job_prefix}/Train"
@@ -163,17 +316,9 @@ def get_pipeline(
         base_job_name=f"{base_job_prefix}/train",
         sagemaker_session=sagemaker_session,
         role=role,
+        environment={"CACHE_KEY": content_hash(preprocess_cache_key, XGB_HYPERPARAMETERS)},
     )
-    xgb_train.set_hyperparameters(
-        objective="reg:linear",
-        num_round=50,
-        max_depth=5,
-        eta=0.2,
-        gamma=4,
-        min_child_weight=6,
-        subsample=0.7,
-        verbosity=1,
-    )
+    xgb_train.set_hyperparameters(**XGB_HYPERPARAMETERS)
     step_train = TrainingStep(
         name="TrainModel",
         estimator=xgb_train,
@@ -182,18 +327,21 @@ def get_pipeline(
                 s3_data=step_process.properties.ProcessingOutputConfig.Outputs[
                     "train"
                 ].S3Output.S3Uri,
-                content_type="text/csv",
+                content_type=training_content_type,
             ),
             "validation": TrainingInput(
                 s3_data=step_process.properties.ProcessingOutputConfig.Outputs[
                     "validation"
                 ].S3Output.S3Uri,
-                content_type="text/csv",
+                content_type=training_content_type,
             ),
         },
+        cache_config=cache_config,
     )
 
     # processing step for evaluation
+    evaluate_code = os.path.join(BASE_DIR, "..", "src", "evaluate.py")
+    evaluate_arguments = ["--mse-threshold", str(MSE_THRESHOLD)] if progressive_evaluation else None
     script_eval = ScriptProcessor(
         image_uri=image_uri,
         command=["python3"],
@@ -202,7 +350,31 @@ def get_pipeline(
         base_job_name=f"{base_job_prefix}/script-eval",
         sagemaker_session=sagemaker_session,
         role=role,
+        env={
+            "CACHE_KEY": content_hash(
+                evaluate_code, evaluate_arguments, preprocess_cache_key, XGB_HYPERPARAMETERS
+            )
+        },
     )
+    eval_inputs = [
+        ProcessingInput(
+            source=step_train.properties.ModelArtifacts.S3ModelArtifacts,
+            destination="/opt/ml/processing/model",
+        ),
+        ProcessingInput(
+            source=step_process.properties.ProcessingOutputConfig.Outputs[
+                "test"
+            ].S3Output.S3Uri,
+            destination="/opt/ml/processing/test",
+        ),
+    ]
+    if champion_model_data is not None:
+        eval_inputs.append(
+            ProcessingInput(
+                source=champion_model_data,
+                destination="/opt/ml/processing/champion",
+            )
+        )
     evaluation_report = PropertyFile(
         name="EvaluationReport",
         output_name="evaluation",
@@ -211,23 +383,14 @@ def get_pipeline(
     step_eval = ProcessingStep(
         name="EvaluateModel",
         processor=script_eval,
-        inputs=[
-            ProcessingInput(
-                source=step_train.properties.ModelArtifacts.S3ModelArtifacts,
-                destination="/opt/ml/processing/model",
-            ),
-            ProcessingInput(
-                source=step_process.properties.ProcessingOutputConfig.Outputs[
-                    "test"
-                ].S3Output.S3Uri,
-                destination="/opt/ml/processing/test",
-            ),
-        ],
+        inputs=eval_inputs,
         outputs=[
             ProcessingOutput(output_name="evaluation", source="/opt/ml/processing/evaluation"),
         ],
-        code=os.path.join(BASE_DIR, "..", "src", "evaluate.py"),
+        code=evaluate_code,
+        job_arguments=evaluate_arguments,
         property_files=[evaluation_report],
+        cache_config=cache_config,
     )
 
     # register model step that will be conditionally executed
@@ -240,42 +403,97 @@ def get_pipeline(
         )
     )
     
-    sklearn_model = SKLearnModel(
-        name='SKLearnTransform',
-        entry_point=os.path.join(BASE_DIR, "..", "src", "transform.py"),
-        role=role,
-        framework_version="1.2-1",
-        py_version="py3",
-        sagemaker_session=sagemaker_session,
-        model_data=Join(on='/', values=[step_process.properties.ProcessingOutputConfig.Outputs[
-                    "model"
-                ].S3Output.S3Uri, "model.tar.gz"]),
-    )
-
-    inference_model = Model(
-        image_uri=sagemaker.image_uris.retrieve(
-            framework="xgboost",
-            region=region,
-            version="1.2-1",
+    if fused_inference:
+        package_code = os.path.join(BASE_DIR, "..", "src", "package_model.py")
+        script_package = ScriptProcessor(
+            image_uri=image_uri,
+            command=["python3"],
+            instance_type=processing_instance_type,
+            instance_count=1,
+            base_job_name=f"{base_job_prefix}/script-package",
+            sagemaker_session=sagemaker_session,
+            role=role,
+            env={
+                "CACHE_KEY": content_hash(package_code, preprocess_cache_key, XGB_HYPERPARAMETERS)
+            },
+        )
+        step_package = ProcessingStep(
+            name="PackageModel",
+            processor=script_package,
+            inputs=[
+                ProcessingInput(
+                    source=step_process.properties.ProcessingOutputConfig.Outputs[
+                        "model"
+                    ].S3Output.S3Uri,
+                    destination="/opt/ml/processing/preprocess",
+                ),
+                ProcessingInput(
+                    source=step_train.properties.ModelArtifacts.S3ModelArtifacts,
+                    destination="/opt/ml/processing/model",
+                ),
+            ],
+            outputs=[
+                ProcessingOutput(output_name="fused", source="/opt/ml/processing/fused"),
+            ],
+            code=package_code,
+            cache_config=cache_config,
+        )
+        # serve.py imports the request decoding and the preprocessing kernel
+        # from transform.py, so both are shipped, without src/requirements.txt
+        model = XGBoostModel(
+            name="FusedModel",
+            entry_point="serve.py",
+            source_dir=fused_source_dir(),
+            role=role,
+            framework_version="1.2-1",
             py_version="py3",
-            instance_type="ml.t2.medium",
-        ),
-        model_data=step_train.properties.ModelArtifacts.S3ModelArtifacts
-    )
+            sagemaker_session=sagemaker_session,
+            model_data=Join(on='/', values=[step_package.properties.ProcessingOutputConfig.Outputs[
+                        "fused"
+                    ].S3Output.S3Uri, "model.tar.gz"]),
+        )
+    else:
+        sklearn_model = SKLearnModel(
+            name='SKLearnTransform',
+            entry_point=os.path.join(BASE_DIR, "..", "src", "transform.py"),
+            role=role,
+            framework_version="1.2-1",
+            py_version="py3",
+            sagemaker_session=sagemaker_session,
+            model_data=Join(on='/', values=[step_process.properties.ProcessingOutputConfig.Outputs[
+                        "model"
+                    ].S3Output.S3Uri, "model.tar.gz"]),
+        )
+
+        inference_model = Model(
+            image_uri=sagemaker.image_uris.retrieve(
+                framework="xgboost",
+                region=region,
+                version="1.2-1",
+                py_version="py3",
+                instance_type="ml.t2.medium",
+            ),
+            model_data=step_train.properties.ModelArtifacts.S3ModelArtifacts
+        )
+
+        model = PipelineModel(
+            name='PipelineModel', 
+            role=role, 
+            models=[
+                sklearn_model,
+                inference_model
+            ]
+        )
 
-    model = PipelineModel(
-        name='PipelineModel', 
-        role=role, 
-        models=[
-            sklearn_model,
-            inference_model
-        ]
-    )
-    
     step_register_inference_model = RegisterModel(
         name="RegisterModel",
         estimator=xgb_train,
-        content_types=["text/csv"],
+        content_types=[
+            "text/csv",
+            "application/x-npy",
+            "application/x-parquet",
+            "application/jsonlines",
+        ],
         response_types=["text/csv"],
         inference_instances=["ml.t2.medium", "ml.m5.large"],
         transform_instances=["ml.m5.large"],
@@ -286,18 +504,38 @@ def get_pipeline(
     )
 
     # condition step for evaluating model quality and branching execution
+    if gate_on_upper_bound:
+        mse_json_path = "regression_metrics.mse.confidence_interval.upper"
+    else:
+        mse_json_path = "regression_metrics.mse.value"
     cond_lte = ConditionLessThanOrEqualTo(
         left=JsonGet(
             step=step_eval,
             property_file=evaluation_report,
-            json_path="regression_metrics.mse.value",
+            json_path=mse_json_path,
         ),
-        right=6.0,
+        right=MSE_THRESHOLD,
     )
+    conditions = [cond_lte]
+    if champion_model_data is not None:
+        conditions.append(
+            ConditionGreaterThanOrEqualTo(
+                left=JsonGet(
+                    step=step_eval,
+                    property_file=evaluation_report,
+                    json_path="champion_comparison.mse_improvement.value",
+                ),
+                right=0.0,
+            )
+        )
+    # the fused artifact is only packaged for a model that gets registered
+    if_steps = [step_register_inference_model]
+    if fused_inference:
+        if_steps.insert(0, step_package)
     step_cond = ConditionStep(
         name="CheckMSEEvaluation",
-        conditions=[cond_lte],
-        if_steps=[step_register_inference_model],
+        conditions=conditions,
+        if_steps=if_steps,
         else_steps=[],
     )
 
@@ -310,7 +548,7 @@ def get_pipeline(
             training_instance_type,
             model_approval_status
         ],
-        steps=[step_process, step_train, step_eval, step_cond],
+        steps=preprocess_steps + [step_train, step_eval, step_cond],
         sagemaker_session=sagemaker_session,
     )
     return pipeline
@@ -0,0 +1,66 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Settings of the pipeline steps that are shared with run_local.py and the benchmarks.
+
+Kept apart from pipeline.py, which needs the SageMaker SDK, so that the
+local runner and the benchmarks only need the dependencies of the steps
+themselves.
+"""
+import os
+import shutil
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src")
+
+# Hyperparameters of the built-in XGBoost training job.
+XGB_HYPERPARAMETERS = {
+    "objective": "reg:linear",
+    "num_round": 50,
+    "max_depth": 5,
+    "eta": 0.2,
+    "gamma": 4,
+    "min_child_weight": 6,
+    "subsample": 0.7,
+    "verbosity": 1,
+}
+
+# Highest test MSE of a model that gets registered.
+MSE_THRESHOLD = 6.0
+
+# Objectives of the XGBoost 1.2 container that later versions renamed.
+LEGACY_OBJECTIVES = {"reg:linear": "reg:squarederror"}
+
+def training_params(hyperparameters):
+    """Maps the built-in algorithm hyperparameters to xgboost.train arguments."""
+    params = dict(hyperparameters)
+    num_round = int(params.pop("num_round"))
+    params["objective"] = LEGACY_OBJECTIVES.get(params["objective"], params["objective"])
+    return params, num_round
+
+# Modules of the fused single container model. The XGBoost container pip
+# installs a requirements.txt found in the source directory, and the one in
+# src/ pins versions its Python cannot install, so they are shipped alone.
+FUSED_SOURCE_FILES = ["serve.py", "transform.py"]
+
+def fused_source_dir(target_dir=None):
+    """Copies the modules of the fused model into a source directory of their own.
+
+    Returns the directory, a new temporary one unless ``target_dir`` is given.
+    """
+    target_dir = target_dir or tempfile.mkdtemp(prefix="fused-source-")
+    for name in FUSED_SOURCE_FILES:
+        shutil.copy(os.path.join(SRC_DIR, name), target_dir)
+    return target_dir
@@ -0,0 +1,279 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""A CLI to run the pipeline steps locally, in process.
+
+Runs PreprocessData, preceded by ComputeStatistics when it is sharded,
+TrainModel, EvaluateModel and CheckMSEEvaluation the way the pipeline from
+pipeline.py does, with every step reading and writing under its own
+directory of a local work directory instead of /opt/ml. The
+data comes either from the S3 objects of a data manifest, or from local CSV
+files that are served from an in-process S3 stand-in.
+
+    cd ml_pipeline
+    python run_local.py --data ../abalone.csv --work-dir /tmp/abalone
+"""
+from __future__ import absolute_import
+
+import argparse
+import contextlib
+import json
+import os
+import pickle
+import sys
+import tarfile
+import time
+
+import boto3
+import xgboost
+
+from pipeline_config import MSE_THRESHOLD, XGB_HYPERPARAMETERS, training_params
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "src"))
+
+import evaluate  # noqa: E402
+import package_model  # noqa: E402
+import preprocess  # noqa: E402
+
+LOCAL_BUCKET = "local-pipeline-data"
+
+@contextlib.contextmanager
+def local_s3(paths):
+    """Serves local files from an in-process S3 stand-in.
+
+    Yields the data manifest of the uploaded objects.
+    """
+    from moto import mock_aws
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=LOCAL_BUCKET)
+        entries = []
+        for path in paths:
+            key = os.path.basename(path)
+            s3_client.upload_file(path, LOCAL_BUCKET, key)
+            entries.append({"bucketName": LOCAL_BUCKET, "objectKey": key})
+        yield json.dumps({"data": entries})
+
+class StepTimer:
+    """Records the wall clock time of every step."""
+
+    def __init__(self) -> None:
+        self.timings = []
+
+    @contextlib.contextmanager
+    def step(self, name):
+        print(f"###### Running {name}")
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        self.timings.append((name, elapsed))
+        print(f"###### {name} took {elapsed:.2f}s")
+
+    def report(self):
+        print(f"\n{'step':<22} {'seconds':>10}")
+        for name, elapsed in self.timings:
+            print(f"{name:<22} {elapsed:>10.2f}")
+        print(f"{'total':<22} {sum(elapsed for _, elapsed in self.timings):>10.2f}")
+
+def preprocess_data(work_dir, data_manifest, output_format, mode, hosts=1, cache_dir=None):
+    """Runs the preprocessing, or a stage of it when sharded, for every host in turn.
+
+    The hosts share one directory, as their outputs share an S3 prefix. With a
+    ``cache_dir``, objects of the manifest that did not change since an earlier
+    run are read from the local cache instead of S3.
+    """
+    base_dir = os.path.join(work_dir, "PreprocessData")
+    state_dir = os.path.join(work_dir, "PreprocessState")
+    # SageMaker creates the directories of the processing outputs
+    os.makedirs(os.path.join(base_dir, "model"), exist_ok=True)
+    os.makedirs(state_dir, exist_ok=True)
+    cache_args = ["--cache-dir", cache_dir] if cache_dir else []
+    for rank in range(hosts):
+        preprocess.run_main(
+            cache_args
+            + [
+                "--data-manifest",
+                data_manifest,
+                "--base-dir",
+                base_dir,
+                "--output-format",
+                output_format,
+                "--state-uri",
+                os.path.join(state_dir, "statistics.joblib"),
+                "--mode",
+                mode,
+                "--host-rank",
+                str(rank),
+                "--host-count",
+                str(hosts),
+            ]
+        )
+    return base_dir
+
+def train_model(work_dir, process_dir, hyperparameters):
+    """Trains like the built-in algorithm and packs its model.tar.gz."""
+    params, num_round = training_params(hyperparameters)
+    y_train, X_train = evaluate.read_split(f"{process_dir}/train", "train")
+    y_validation, X_validation = evaluate.read_split(f"{process_dir}/validation", "validation")
+    train = xgboost.DMatrix(X_train, label=y_train)
+    validation = xgboost.DMatrix(X_validation, label=y_validation)
+    booster = xgboost.train(
+        params,
+        train,
+        num_round,
+        evals=[(train, "train"), (validation, "validation")],
+        verbose_eval=False,
+    )
+
+    model_dir = os.path.join(work_dir, "TrainModel")
+    os.makedirs(model_dir, exist_ok=True)
+    model_path = os.path.join(model_dir, "xgboost-model")
+    with open(model_path, "wb") as f:
+        pickle.dump(booster, f)
+    with tarfile.open(os.path.join(model_dir, "model.tar.gz"), "w:gz") as tar:
+        tar.add(model_path, arcname="xgboost-model")
+    return model_dir
+
+def link_inputs(base_dir, inputs):
+    """Links the sources of the inputs in place of the processing inputs."""
+    for name, source in inputs.items():
+        destination = os.path.join(base_dir, name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if os.path.lexists(destination):
+            os.unlink(destination)
+        os.symlink(os.path.abspath(source), destination)
+
+def evaluate_model(work_dir, process_dir, model_dir, champion_model=None, progressive=False):
+    """Runs evaluate.py over the inputs linked in like the processing inputs."""
+    base_dir = os.path.join(work_dir, "EvaluateModel")
+    inputs = {"model": model_dir, "test": os.path.join(process_dir, "test")}
+    if champion_model is not None:
+        inputs[os.path.join("champion", "model.tar.gz")] = champion_model
+    link_inputs(base_dir, inputs)
+
+    argv = ["--base-dir", base_dir]
+    if progressive:
+        argv += ["--mse-threshold", str(MSE_THRESHOLD)]
+    evaluate.run_main(argv)
+    with open(os.path.join(base_dir, "evaluation", "evaluation.json")) as f:
+        return json.load(f)
+
+def package_fused_model(work_dir, process_dir, model_dir):
+    """Runs package_model.py, returning the path of the fused model.tar.gz."""
+    base_dir = os.path.join(work_dir, "PackageModel")
+    link_inputs(base_dir, {"preprocess": os.path.join(process_dir, "model"), "model": model_dir})
+    package_model.run_main(["--base-dir", base_dir])
+    return os.path.join(base_dir, "fused", "model.tar.gz")
+
+def check_mse(report, gate_on_upper_bound=False):
+    """Evaluates the conditions of CheckMSEEvaluation on the report."""
+    mse = report["regression_metrics"]["mse"]
+    mse = mse["confidence_interval"]["upper"] if gate_on_upper_bound else mse["value"]
+    passed = mse <= MSE_THRESHOLD
+    print(f"MSE {mse:.4f} <= {MSE_THRESHOLD}: {passed}")
+    if "champion_comparison" in report:
+        improvement = report["champion_comparison"]["mse_improvement"]["value"]
+        print(f"MSE improvement over the champion {improvement:.4f} >= 0: {improvement >= 0}")
+        passed = passed and improvement >= 0
+    return passed
+
+def main():  # pragma: no cover
+    """Runs the pipeline steps locally and prints the time of each step."""
+    parser = argparse.ArgumentParser("Runs the pipeline steps locally, in process.")
+    data = parser.add_mutually_exclusive_group(required=True)
+    data.add_argument(
+        "--data",
+        nargs="+",
+        help="Local CSV files of raw abalone data, served from an in-process S3 stand-in.",
+    )
+    data.add_argument(
+        "--data-manifest",
+        help="Path of a data manifest JSON file whose objects are read from S3.",
+    )
+    parser.add_argument("--work-dir", default="local_pipeline")
+    parser.add_argument("--output-format", default="csv")
+    parser.add_argument(
+        "--processing-instances",
+        type=int,
+        default=1,
+        help="Number of hosts the preprocessing is sharded across, run one after another.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Local directory caching the manifest objects across runs, keyed by their ETag.",
+    )
+    parser.add_argument(
+        "--champion-model",
+        default=None,
+        help="Local model.tar.gz of the currently approved model.",
+    )
+    parser.add_argument("--gate-on-upper-bound", action="store_true")
+    parser.add_argument("--progressive-evaluation", action="store_true")
+    parser.add_argument(
+        "--fused-inference",
+        action="store_true",
+        help="Package the single container model of a model that would be registered.",
+    )
+    args = parser.parse_args()
+
+    timer = StepTimer()
+    if args.data:
+        source = local_s3(args.data)
+    else:
+        with open(args.data_manifest) as f:
+            source = contextlib.nullcontext(f.read())
+
+    steps = [("PreprocessData", "all")]
+    if args.processing_instances > 1:
+        steps = [("ComputeStatistics", "statistics"), ("PreprocessData", "transform")]
+    with source as data_manifest:
+        for step, mode in steps:
+            with timer.step(step):
+                process_dir = preprocess_data(
+                    args.work_dir,
+                    data_manifest,
+                    args.output_format,
+                    mode,
+                    args.processing_instances,
+                    args.cache_dir,
+                )
+
+    with timer.step("TrainModel"):
+        model_dir = train_model(args.work_dir, process_dir, XGB_HYPERPARAMETERS)
+
+    with timer.step("EvaluateModel"):
+        report = evaluate_model(
+            args.work_dir,
+            process_dir,
+            model_dir,
+            args.champion_model,
+            args.progressive_evaluation,
+        )
+
+    with timer.step("CheckMSEEvaluation"):
+        passed = check_mse(report, args.gate_on_upper_bound)
+    if passed and args.fused_inference:
+        with timer.step("PackageModel"):
+            print(f"Fused model: {package_fused_model(args.work_dir, process_dir, model_dir)}")
+    print("RegisterModel would run." if passed else "The model would not be registered.")
+
+    timer.report()
+
+if __name__ == "__main__":
+    main()
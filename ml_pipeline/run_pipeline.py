@@ -27,6 +27,21 @@ def get_model_package_name(pipeline_steps):
         if step["StepName"] == "RegisterModel-RegisterModel":
             return step["Metadata"]["RegisterModel"]["Arn"]
 
+def format_step_report(pipeline_steps):
+    """Formats the status of every step and whether it was a cache hit.
+
+    A step whose code, data manifest and parameters did not change reuses the
+    outputs of an earlier execution, which is reported as its cache source.
+    """
+    lines = [f"{'step':<40} {'status':<12} {'cache hit':<10} source execution"]
+    for step in pipeline_steps:
+        source = step.get("CacheHitResult", {}).get("SourcePipelineExecutionArn")
+        lines.append(
+            f"{step['StepName']:<40} {step.get('StepStatus', ''):<12} "
+            f"{'yes' if source else 'no':<10} {source or ''}"
+        )
+    return "\n".join(lines)
+
 def main():  # pragma: no cover
     """The main harness that creates or updates and runs the pipeline.
 
@@ -99,7 +114,7 @@ def main():  # pragma: no cover
         print("\n#####Execution completed. Execution step details:")
 
         pipeline_steps = execution.list_steps()
-        print(pipeline_steps)
+        print(format_step_report(pipeline_steps))
 
         model_package_name = get_model_package_name(pipeline_steps)
         out_file = open("pipelineExecutionArn", "w")
@@ -0,0 +1,198 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Batch scoring script for raw abalone CSV and Parquet files.
+
+Scores the rows with the fused artifact written by package_model.py, which
+holds the preprocessor and the booster, and writes one prediction per line
+in the order of the input rows.
+
+The inputs are split into chunks: byte ranges of whole CSV lines, and the
+row groups of Parquet files. A pool of worker processes, each loading the
+model once, reads, preprocesses and predicts a chunk at a time, so that the
+parsing is spread across the cores as well. The main process only finds
+the chunk boundaries and writes the predictions, and keeps at most a few
+chunks per worker in flight, so memory does not grow with the input size.
+
+    python batch_score.py --model model.tar.gz --input abalone.csv --output predictions.csv
+"""
+import argparse
+import collections
+import logging
+import multiprocessing
+import os
+import tarfile
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import serve
+import transform
+from package_model import safe_extract
+
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+
+# Chunks queued per worker, so that a worker does not wait for the next one.
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+Chunk = collections.namedtuple("Chunk", ["path", "start", "length", "row_group"])
+
+def csv_chunks(path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Splits a CSV file into byte ranges that end at a line end."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            yield Chunk(path, start, end - start, None)
+            start = end
+
+def parquet_chunks(path):
+    """Splits a Parquet file into its row groups.
+
+    Requires pyarrow, which is only imported when a Parquet file is scored.
+    """
+    import pyarrow.parquet as pq
+
+    for row_group in range(pq.ParquetFile(path).num_row_groups):
+        yield Chunk(path, None, None, row_group)
+
+def input_chunks(paths, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    for path in paths:
+        if path.endswith(".parquet"):
+            yield from parquet_chunks(path)
+        else:
+            yield from csv_chunks(path, chunk_bytes)
+
+def read_chunk(chunk):
+    """Reads the raw rows of a chunk as transform.input_fn decodes a request."""
+    if chunk.row_group is not None:
+        import pyarrow.parquet as pq
+
+        table = pq.ParquetFile(chunk.path).read_row_group(chunk.row_group)
+        return transform.name_columns(table.to_pandas())
+
+    with open(chunk.path, "rb") as f:
+        f.seek(chunk.start)
+        payload = f.read(chunk.length)
+    if not payload.strip():
+        return None
+    return transform.input_fn.__wrapped__(payload, "text/csv")
+
+def load_model(model_path, extract_dir):
+    """Returns the directory of the fused model, extracting a model.tar.gz."""
+    if os.path.isdir(model_path):
+        return model_path
+    with tarfile.open(model_path) as tar:
+        safe_extract(tar, path=extract_dir)
+    return extract_dir
+
+def encode_predictions(predictions):
+    return "".join(f"{value}\n" for value in np.asarray(predictions).tolist())
+
+# The model of a worker process, loaded once by its initializer.
+_model = None
+
+def init_worker(model_dir, nthread=None):
+    global _model
+    _model = serve.model_fn(model_dir)
+    if nthread:
+        _model.booster.set_param({"nthread": nthread})
+
+def score_chunk(chunk):
+    """Returns the number of rows of a chunk and their encoded predictions."""
+    data = read_chunk(chunk)
+    if data is None:
+        return 0, ""
+    predictions = serve.predict_fn.__wrapped__(data, _model)
+    return len(predictions), encode_predictions(predictions)
+
+def score(paths, model_dir, output, workers=None, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Scores the rows of the input files, writing their predictions to ``output`` in order.
+
+    Returns the number of rows scored.
+    """
+    workers = workers or os.cpu_count()
+    chunks = input_chunks(paths, chunk_bytes)
+    rows = 0
+    if workers == 1:
+        init_worker(model_dir)
+        for chunk in chunks:
+            count, predictions = score_chunk(chunk)
+            output.write(predictions)
+            rows += count
+        return rows
+
+    # xgboost and the BLAS libraries are not safe to fork once their
+    # thread pools are running, so the workers start afresh. The cores are
+    # shared between the workers rather than by each prediction.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, context, init_worker, (model_dir, 1)) as executor:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(executor.submit(score_chunk, chunk))
+            if len(pending) >= workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+                count, predictions = pending.popleft().result()
+                output.write(predictions)
+                rows += count
+        while pending:
+            count, predictions = pending.popleft().result()
+            output.write(predictions)
+            rows += count
+    return rows
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+
+def run_main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model",
+        required=True,
+        help="Fused model.tar.gz written by package_model.py, or the directory it was extracted to.",
+    )
+    parser.add_argument(
+        "--input",
+        nargs="+",
+        required=True,
+        help="Raw abalone CSV files without a header, or Parquet files.",
+    )
+    parser.add_argument("--output", required=True, help="Path of the CSV file of the predictions.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes, one per core by default.",
+    )
+    parser.add_argument(
+        "--chunk-bytes",
+        type=int,
+        default=DEFAULT_CHUNK_BYTES,
+        help="Approximate size of the CSV chunks scored at a time.",
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as extract_dir, open(args.output, "w") as output:
+        model_dir = load_model(args.model, extract_dir)
+        rows = score(args.input, model_dir, output, args.workers, args.chunk_bytes)
+    logger.info("Wrote the predictions of %d rows to %s.", rows, args.output)
+
+if __name__ == "__main__":
+    run_main()
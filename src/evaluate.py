@@ -14,18 +14,35 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
 
 """Evaluation script for measuring mean squared error."""
+import argparse
+import glob
+import io
+import itertools
+import math
 import json
 import logging
 import pathlib
 import pickle
 import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
 import os
-import xgboost
+import scipy.sparse
 
-from sklearn.metrics import mean_squared_error
+from sklearn.datasets import load_svmlight_file
+
+DEFAULT_SKETCH_SIZE = 2048
+DEFAULT_PREDICT_BLOCK_ROWS = 65536
+DEFAULT_BOOTSTRAP_RESAMPLES = 1000
+DEFAULT_BOOTSTRAP_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_EARLY_STOP_CONFIDENCE = 0.99
+DEFAULT_STAGES = [0.05, 0.25, 1.0]
+
+residual_quantiles = [0.05, 0.25, 0.5, 0.75, 0.95]
 
 def is_within_directory(directory, target):         
     abs_directory = os.path.abspath(directory)
@@ -42,44 +59,624 @@ def safe_extract(tar, path="."):
             raise Exception("Attempted Path Traversal in Tar File")
     tar.extractall(path) 
 
+def read_csv_split(path):
+    df = pd.read_csv(path, header=None)
+    y = df.iloc[:, 0].to_numpy()
+    df.drop(df.columns[0], axis=1, inplace=True)
+    return y, df.values
+
+def read_parquet_split(path):
+    data = pd.read_parquet(path).to_numpy()
+    return data[:, 0], data[:, 1:]
+
+def read_npy_split(path):
+    data = np.load(path, mmap_mode="r")
+    return np.asarray(data[:, 0]), data[:, 1:]
+
+def read_libsvm_split(path):
+    X, y = load_svmlight_file(path, zero_based=True)
+    return y, X
+
+split_readers = {
+    "csv": read_csv_split,
+    "parquet": read_parquet_split,
+    "npy": read_npy_split,
+    "libsvm": read_libsvm_split,
+}
+
+def split_paths(split_dir, name="test"):
+    """Finds the files of a split written by preprocess.py in any of its output formats.
+
+    A split is either a single ``{name}.{format}`` file or the
+    ``{name}-{part}.{format}`` shards written by the hosts of a sharded job.
+    Returns the format and the non-empty files.
+    """
+    for extension in split_readers:
+        paths = glob.glob(os.path.join(split_dir, f"{name}.{extension}"))
+        paths += sorted(glob.glob(os.path.join(split_dir, f"{name}-*.{extension}")))
+        paths = [path for path in paths if os.path.getsize(path)]
+        if paths:
+            return extension, paths
+    raise FileNotFoundError(f"No {name} split found in {split_dir}")
+
+def read_split(split_dir, name="test"):
+    """Reads a split written by preprocess.py in any of its output formats.
+
+    Returns the labels and the feature matrix.
+    """
+    extension, paths = split_paths(split_dir, name)
+    logger.debug("Reading %s data from %s.", extension, paths)
+    parts = [split_readers[extension](path) for path in paths]
+    parts = [part for part in parts if len(part[0])] or parts[:1]
+    if len(parts) == 1:
+        return parts[0]
+
+    y = np.concatenate([part_y for part_y, _ in parts])
+    matrices = [part_X for _, part_X in parts]
+    if not scipy.sparse.issparse(matrices[0]):
+        return y, np.concatenate(matrices)
+    # a libsvm file only spans the columns it has entries in
+    columns = max(X.shape[1] for X in matrices)
+    for X in matrices:
+        X.resize((X.shape[0], columns))
+    return y, scipy.sparse.vstack(matrices).tocsr()
+
+def iter_csv_split(path, block_rows):
+    for chunk in pd.read_csv(path, header=None, chunksize=block_rows):
+        data = chunk.to_numpy(dtype=np.float64)
+        yield data[:, 0], data[:, 1:]
+
+def iter_parquet_split(path, block_rows):
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=block_rows):
+        data = np.column_stack([column.to_numpy() for column in batch.columns])
+        yield data[:, 0], data[:, 1:]
+
+def iter_npy_split(path, block_rows):
+    data = np.load(path, mmap_mode="r")
+    for start in range(0, len(data), block_rows):
+        block = np.asarray(data[start:start + block_rows])
+        yield block[:, 0], block[:, 1:]
+
+def iter_libsvm_split(path, block_rows):
+    with open(path, "rb") as f:
+        while True:
+            lines = [line for _, line in zip(range(block_rows), f)]
+            if not lines:
+                return
+            X, y = load_svmlight_file(io.BytesIO(b"".join(lines)), zero_based=True)
+            yield y, X
+
+split_block_readers = {
+    "csv": iter_csv_split,
+    "parquet": iter_parquet_split,
+    "npy": iter_npy_split,
+    "libsvm": iter_libsvm_split,
+}
+
+def iter_split(split_dir, block_rows, name="test"):
+    """Reads a split in blocks of at most ``block_rows`` rows.
+
+    Yields the labels and the feature matrix of every block.
+    """
+    extension, paths = split_paths(split_dir, name)
+    logger.debug("Reading %s data from %s in blocks of %d rows.", extension, paths, block_rows)
+    reader = split_block_readers[extension]
+    return itertools.chain.from_iterable(reader(path, block_rows) for path in paths)
+
+class QuantileSketch:
+    """Mergeable approximate quantile sketch, as in preprocess.py.
+
+    Values are kept exactly until the buffer exceeds twice the sketch size,
+    after which they are compressed into ``size`` weighted centroids of equal
+    rank width.
+    """
+
+    def __init__(self, size=DEFAULT_SKETCH_SIZE) -> None:
+        self._size = size
+        self._values = np.empty(0)
+        self._weights = np.empty(0)
+        self._exact = True
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self._values = np.concatenate((self._values, values))
+        self._weights = np.concatenate((self._weights, np.ones(len(values))))
+        if len(self._values) > 2 * self._size:
+            self._compress()
+
+    def quantile(self, q):
+        if not len(self._values):
+            return np.nan
+        if self._exact:
+            return float(np.quantile(self._values, q))
+
+        order = np.argsort(self._values, kind="stable")
+        values = self._values[order]
+        weights = self._weights[order]
+        positions = np.cumsum(weights) - weights / 2
+        return float(np.interp(q * weights.sum(), positions, values))
+
+    def _compress(self):
+        order = np.argsort(self._values, kind="stable")
+        values = self._values[order]
+        weights = self._weights[order]
+        ranks = np.cumsum(weights) - weights / 2
+        bins = np.minimum((ranks / weights.sum() * self._size).astype(np.int64), self._size - 1)
+
+        bin_weights = np.bincount(bins, weights=weights, minlength=self._size)
+        bin_sums = np.bincount(bins, weights=values * weights, minlength=self._size)
+        keep = bin_weights > 0
+        self._values = bin_sums[keep] / bin_weights[keep]
+        self._weights = bin_weights[keep]
+        self._exact = False
+
+class BootstrapMetrics:
+    """Bootstrap distribution of the MSE, MAE and R2 over blocks of residuals.
+
+    Uses the double-or-nothing bootstrap: every resample keeps each row with
+    probability one half and doubles its weight, which has the same mean and
+    variance as a Poisson(1) resample count. The weights of a batch of
+    resamples are unpacked from random bytes and applied to the per-row
+    statistics with a single matrix product, so there is no Python loop over
+    rows or resamples, and blocks can be folded in as they are predicted.
+
+    Batches are sized so the weight matrices of all ``threads`` stay below
+    ``max_bytes``. Every block reads its weights from one random stream
+    spawned from ``seed``, the bits of each resample following those of the
+    previous one, and a batch draws all of its bits in a single call after
+    advancing the stream to its first resample. The resamples therefore
+    depend neither on the memory cap nor on the number of threads, and two
+    models scored on the same blocks get the same resamples.
+    """
+
+    # per row: weight, squared residual, absolute residual, centred label,
+    # squared centred label
+    _columns = 5
+
+    def __init__(
+        self,
+        resamples=DEFAULT_BOOTSTRAP_RESAMPLES,
+        seed=0,
+        max_bytes=DEFAULT_BOOTSTRAP_MAX_BYTES,
+        threads=1,
+    ) -> None:
+        self.resamples = resamples
+        self.seed = seed
+        self.max_bytes = max_bytes
+        self.threads = max(1, threads)
+        self.sums = np.zeros((resamples, self._columns))
+        self._seed_sequence = np.random.SeedSequence(seed)
+        self._center = None
+
+    def update(self, y, residuals):
+        if self._center is None:
+            # labels are centred so their float32 sums of squares stay accurate
+            self._center = float(np.mean(y))
+        centred = y - self._center
+        stats = np.column_stack(
+            (np.ones_like(y), residuals ** 2, np.abs(residuals), centred, centred ** 2)
+        ).astype(np.float32)
+
+        # bytes per resample: packed bits, unpacked bits and float32 weights
+        row_bytes = len(y) * 5 + len(y) // 8 + 1
+        batch = int(max(1, min(self.resamples, self.max_bytes // (row_bytes * self.threads))))
+        starts = range(0, self.resamples, batch)
+        # 64 bit words of random bits per resample
+        words = (len(y) + 63) // 64
+        seed = self._seed_sequence.spawn(1)[0]
+
+        def resample(start):
+            stop = min(start + batch, self.resamples)
+            bit_generator = np.random.PCG64(seed)
+            bit_generator.advance(start * words)
+            packed = bit_generator.random_raw((stop - start) * words).view(np.uint8)
+            weights = np.unpackbits(
+                packed.reshape(stop - start, words * 8), axis=1, count=len(y)
+            ).astype(np.float32)
+            self.sums[start:stop] += weights @ stats
+
+        if self.threads > 1:
+            with ThreadPoolExecutor(self.threads) as pool:
+                list(pool.map(resample, starts))
+        else:
+            for start in starts:
+                resample(start)
+
+    def distributions(self):
+        """Returns the MSE, MAE and R2 of every resample."""
+        weight, squared, absolute, label, label_squared = self.sums.T
+        weight = np.maximum(weight, 1)
+        total = label_squared - label ** 2 / weight
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r2 = np.where(total > 0, 1 - squared / total, np.where(squared == 0, 1.0, 0.0))
+        return {"mse": squared / weight, "mae": absolute / weight, "r2": r2}
+
+def confidence_interval(values, confidence=DEFAULT_CONFIDENCE):
+    """Percentile interval of a bootstrap distribution."""
+    tail = (1 - confidence) / 2
+    lower, upper = np.quantile(values, [tail, 1 - tail])
+    return {"lower": float(lower), "upper": float(upper), "confidence": confidence}
+
+class RegressionMetrics:
+    """Single pass regression metrics over blocks of labels and predictions.
+
+    Means and squared deviations are merged block by block with Chan's
+    parallel update, which stays accurate over many blocks, and the residual
+    quantiles come from a mergeable sketch. When given a ``bootstrap``, the
+    report also carries confidence intervals of the metrics.
+    """
+
+    def __init__(self, bootstrap=None, confidence=DEFAULT_CONFIDENCE) -> None:
+        self.count = 0
+        # running means of the squared and absolute residuals
+        self.mean_squared = 0.0
+        self.mean_absolute = 0.0
+        # running mean and sum of squared deviations of residuals and labels
+        self.residual_mean = 0.0
+        self.residual_m2 = 0.0
+        self.label_mean = 0.0
+        self.label_m2 = 0.0
+        self.sketch = QuantileSketch()
+        self.bootstrap = bootstrap
+        self.confidence = confidence
+
+    def update(self, y, predictions):
+        y = np.asarray(y, dtype=np.float64)
+        residuals = y - np.asarray(predictions, dtype=np.float64)
+        count = len(y)
+        if not count:
+            return
+
+        total = self.count + count
+        weight = count / total
+        self.mean_squared += (np.mean(residuals ** 2) - self.mean_squared) * weight
+        self.mean_absolute += (np.mean(np.abs(residuals)) - self.mean_absolute) * weight
+        self.residual_mean, self.residual_m2 = self._merge(
+            self.residual_mean, self.residual_m2, residuals, total
+        )
+        self.label_mean, self.label_m2 = self._merge(self.label_mean, self.label_m2, y, total)
+        self.sketch.update(residuals)
+        if self.bootstrap is not None:
+            self.bootstrap.update(y, residuals)
+        self.count = total
+
+    def _merge(self, mean, m2, values, total):
+        block_mean = np.mean(values)
+        block_m2 = np.sum((values - block_mean) ** 2)
+        delta = block_mean - mean
+        count = len(values)
+        return (
+            mean + delta * count / total,
+            m2 + block_m2 + delta ** 2 * (total - count) * count / total,
+        )
+
+    def r2(self):
+        # Matches sklearn's r2_score for a constant label.
+        sum_squared = self.mean_squared * self.count
+        if self.label_m2 == 0:
+            return 1.0 if sum_squared == 0 else 0.0
+        return 1 - sum_squared / self.label_m2
+
+    def report(self):
+        """Returns the metrics of the evaluated rows.
+
+        Raises ValueError when no rows were evaluated, which happens when the
+        test split of a small manifest is empty.
+        """
+        if not self.count:
+            raise ValueError("no rows evaluated")
+
+        report = {
+            "regression_metrics": {
+                "mse": {
+                    "value": self.mean_squared,
+                    "standard_deviation": float(np.sqrt(self.residual_m2 / self.count)),
+                },
+                "mae": {"value": self.mean_absolute},
+                "r2": {"value": self.r2()},
+            },
+            "residual_quantiles": {
+                f"p{int(q * 100):02d}": self.sketch.quantile(q) for q in residual_quantiles
+            },
+            "test_rows": self.count,
+        }
+        if self.bootstrap is not None:
+            regression = report["regression_metrics"]
+            for name, values in self.bootstrap.distributions().items():
+                regression[name]["confidence_interval"] = confidence_interval(values, self.confidence)
+            report["bootstrap"] = {"resamples": self.bootstrap.resamples, "seed": self.bootstrap.seed}
+        return report
+
+def num_features(booster):
+    """Returns the number of features the booster was trained on.
+
+    The xgboost 1.2 of the container has no Booster.num_features, so the
+    count is read from the model configuration.
+    """
+    config = json.loads(booster.save_config())
+    return int(config["learner"]["learner_model_param"]["num_feature"])
+
+class InplacePredictor:
+    """Predicts with XGBoost in-place prediction instead of a DMatrix.
+
+    Dense inputs are converted once to a contiguous float32 array, which
+    XGBoost reads without copying. Inputs larger than ``block_rows`` are cut
+    into row blocks that a pool of ``workers`` threads predicts concurrently;
+    the booster's ``nthread`` is split between them so the instance's cores
+    are used without oversubscribing.
+    """
+
+    def __init__(self, booster, nthread=None, workers=1, block_rows=DEFAULT_PREDICT_BLOCK_ROWS) -> None:
+        self.booster = booster
+        self.nthread = nthread or os.cpu_count()
+        self.workers = max(1, workers)
+        self.block_rows = block_rows
+        self.num_features = num_features(booster)
+        self.booster.set_param({"nthread": max(1, self.nthread // self.workers)})
+        self._pool = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+
+    def predict(self, X):
+        if hasattr(X, "tocsr"):
+            if X.shape[1] < self.num_features:
+                # a libsvm block only spans the columns it has entries in
+                X.resize((X.shape[0], self.num_features))
+            return self.booster.inplace_predict(X.tocsr())
+
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if self._pool is None or len(X) <= self.block_rows:
+            return self.booster.inplace_predict(X)
+
+        blocks = math.ceil(len(X) / self.block_rows)
+        starts = [index * self.block_rows for index in range(blocks)]
+        predictions = self._pool.map(
+            lambda start: self.booster.inplace_predict(X[start:start + self.block_rows]),
+            starts,
+        )
+        return np.concatenate(list(predictions))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+def evaluate(predictor, blocks, make_metrics=RegressionMetrics):
+    """Predicts every block of the test split and accumulates the metrics."""
+    metrics = make_metrics()
+    for y, X in blocks:
+        metrics.update(y, predictor.predict(X))
+    return metrics
+
+def evaluate_models(predictors, blocks, make_metrics=RegressionMetrics, metrics=None):
+    """Scores several models against the same blocks of the test split.
+
+    Each block is parsed once and shared by all the models, which predict it
+    concurrently. Returns the metrics of every model by name, accumulated
+    into ``metrics`` when given.
+    """
+    if metrics is None:
+        metrics = {name: make_metrics() for name in predictors}
+    with ThreadPoolExecutor(len(predictors)) as pool:
+        for y, X in blocks:
+            if not hasattr(X, "tocsr"):
+                X = np.ascontiguousarray(X, dtype=np.float32)
+            predictions = pool.map(lambda predictor: predictor.predict(X), predictors.values())
+            for name, prediction in zip(predictors, predictions):
+                metrics[name].update(y, prediction)
+    return metrics
+
+def iter_sampled_split(split_dir, block_rows, low, high, seed=0, name="test"):
+    """Reads the rows of a split whose random draw falls in ``[low, high)``.
+
+    Every row gets a uniform draw from a generator spawned per block from
+    ``seed``, so the disjoint ranges of successive reads add up to a random
+    sample of the split that grows with ``high``.
+    """
+    seed_sequence = np.random.SeedSequence(seed)
+    for y, X in iter_split(split_dir, block_rows, name):
+        draws = np.random.default_rng(seed_sequence.spawn(1)[0]).random(len(y))
+        keep = (draws >= low) & (draws < high)
+        if keep.any():
+            yield y[keep], X[keep]
+
+def evaluate_progressively(
+    predictors,
+    split_dir,
+    block_rows,
+    make_metrics,
+    mse_threshold,
+    stages=DEFAULT_STAGES,
+    confidence=DEFAULT_EARLY_STOP_CONFIDENCE,
+    seed=0,
+    challenger="challenger",
+):
+    """Scores growing random samples of the split, stopping on a clear failure.
+
+    After every stage but the last, the evaluation stops when the lower
+    bound of the bootstrap interval of the challenger MSE is above
+    ``mse_threshold``, as the model would not be registered anyway. Each
+    stage reads the split again but only predicts the rows it adds to the
+    sample. Returns the metrics and the fraction of the split scored.
+    """
+    metrics = {name: make_metrics() for name in predictors}
+    low = 0.0
+    for high in stages:
+        blocks = iter_sampled_split(split_dir, block_rows, low, high, seed)
+        evaluate_models(predictors, blocks, metrics=metrics)
+        low = high
+        if high >= 1.0 or not metrics[challenger].count:
+            continue
+        mse = metrics[challenger].bootstrap.distributions()["mse"]
+        lower = confidence_interval(mse, confidence)["lower"]
+        logger.info("MSE lower bound after scoring %.0f%% of the test data: %f", high * 100, lower)
+        if lower > mse_threshold:
+            return metrics, high
+    return metrics, 1.0
+
+def compare_models(metrics, challenger="challenger", champion="champion"):
+    """Builds the evaluation report of the challenger model.
+
+    The report keeps the challenger metrics at the top level, adds the
+    metrics of every model under ``models`` and, when a champion was scored,
+    the improvement of the challenger over it. A positive improvement means
+    the challenger has the lower error.
+    """
+    report = metrics[challenger].report()
+    report["models"] = {name: model_metrics.report() for name, model_metrics in metrics.items()}
+    if champion in metrics:
+        champion_mse = metrics[champion].mean_squared
+        improvement = champion_mse - metrics[challenger].mean_squared
+        report["champion_comparison"] = {
+            "mse_improvement": {"value": improvement},
+            "relative_mse_improvement": {
+                "value": improvement / champion_mse if champion_mse else 0.0
+            },
+        }
+        if metrics[challenger].bootstrap is not None:
+            # both models saw the same resamples, so the difference is paired
+            improvements = (
+                metrics[champion].bootstrap.distributions()["mse"]
+                - metrics[challenger].bootstrap.distributions()["mse"]
+            )
+            report["champion_comparison"]["mse_improvement"]["confidence_interval"] = (
+                confidence_interval(improvements, metrics[challenger].confidence)
+            )
+    return report
+
+def load_model(model_path, extract_dir):
+    """Extracts a model.tar.gz artifact and loads the xgboost model in it."""
+    with tarfile.open(model_path) as tar:
+        safe_extract(tar, path=extract_dir)
+    return pickle.load(open(os.path.join(extract_dir, "xgboost-model"), "rb"))
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
-if __name__ == "__main__":
+def run_main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--base-dir",
+        type=str,
+        default="/opt/ml/processing",
+        help="Directory holding the model and test inputs and the evaluation output.",
+    )
+    parser.add_argument(
+        "--block-rows",
+        type=int,
+        default=100000,
+        help="Number of test rows read and predicted at a time.",
+    )
+    parser.add_argument(
+        "--nthread",
+        type=int,
+        default=os.cpu_count(),
+        help="Total number of threads XGBoost predicts with.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of row blocks predicted concurrently, sharing --nthread.",
+    )
+    parser.add_argument(
+        "--champion-dir",
+        type=str,
+        default=None,
+        help="Directory of the model.tar.gz of the current champion model, if any. "
+        "Defaults to the champion directory under --base-dir.",
+    )
+    parser.add_argument(
+        "--bootstrap-resamples",
+        type=int,
+        default=DEFAULT_BOOTSTRAP_RESAMPLES,
+        help="Number of bootstrap resamples of the confidence intervals, 0 to skip them.",
+    )
+    parser.add_argument("--bootstrap-seed", type=int, default=0)
+    parser.add_argument(
+        "--bootstrap-max-bytes",
+        type=int,
+        default=DEFAULT_BOOTSTRAP_MAX_BYTES,
+        help="Upper bound of the memory used by the bootstrap resampling weights.",
+    )
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE)
+    parser.add_argument(
+        "--mse-threshold",
+        type=float,
+        default=None,
+        help="Registration threshold of the MSE; when set the test data is scored in "
+        "growing random samples and scoring stops once the MSE is clearly above it.",
+    )
+    parser.add_argument(
+        "--stages",
+        type=float,
+        nargs="+",
+        default=DEFAULT_STAGES,
+        help="Fractions of the test data scored by the progressive evaluation.",
+    )
+    parser.add_argument(
+        "--early-stop-confidence",
+        type=float,
+        default=DEFAULT_EARLY_STOP_CONFIDENCE,
+    )
+    args = parser.parse_args(argv)
+    if args.mse_threshold is not None and not args.bootstrap_resamples:
+        parser.error("--mse-threshold needs --bootstrap-resamples for the early stop bound")
+
     logger.debug("Starting evaluation.")
-    model_path = "/opt/ml/processing/model/model.tar.gz"
-    with tarfile.open(model_path) as tar: 
-        safe_extract(tar, path=".")
+    base_dir = args.base_dir
+    model_paths = {"challenger": f"{base_dir}/model/model.tar.gz"}
+    champion_dir = args.champion_dir or f"{base_dir}/champion"
+    champion_path = os.path.join(champion_dir, "model.tar.gz")
+    if os.path.exists(champion_path):
+        model_paths["champion"] = champion_path
 
-    logger.debug("Loading xgboost model.")
-    model = pickle.load(open("xgboost-model", "rb"))
+    logger.debug("Loading xgboost models %s.", list(model_paths))
+    # the models predict concurrently and share the threads between them
+    nthread = max(1, args.nthread // len(model_paths))
+    predictors = {
+        name: InplacePredictor(load_model(path, tempfile.mkdtemp(prefix=name)), nthread, args.workers)
+        for name, path in model_paths.items()
+    }
 
-    logger.debug("Reading test data.")
-    test_path = "/opt/ml/processing/test/test.csv"
-    df = pd.read_csv(test_path, header=None)
-
-    logger.debug("Reading test data.")
-    y_test = df.iloc[:, 0].to_numpy()
-    df.drop(df.columns[0], axis=1, inplace=True)
-    X_test = xgboost.DMatrix(df.values)
+    def make_metrics():
+        if not args.bootstrap_resamples:
+            return RegressionMetrics()
+        bootstrap = BootstrapMetrics(
+            args.bootstrap_resamples, args.bootstrap_seed, args.bootstrap_max_bytes, nthread
+        )
+        return RegressionMetrics(bootstrap, args.confidence)
 
     logger.info("Performing predictions against test data.")
-    predictions = model.predict(X_test)
-
-    logger.debug("Calculating mean squared error.")
-    mse = mean_squared_error(y_test, predictions)
-    std = np.std(y_test - predictions)
-    report_dict = {
-        "regression_metrics": {
-            "mse": {"value": mse, "standard_deviation": std},
-        },
-    }
+    test_dir = f"{base_dir}/test"
+    if args.mse_threshold is None:
+        metrics = evaluate_models(predictors, iter_split(test_dir, args.block_rows), make_metrics)
+        fraction = 1.0
+    else:
+        metrics, fraction = evaluate_progressively(
+            predictors,
+            test_dir,
+            args.block_rows,
+            make_metrics,
+            args.mse_threshold,
+            sorted(set(args.stages) | {1.0}),
+            args.early_stop_confidence,
+            args.bootstrap_seed,
+        )
+    for predictor in predictors.values():
+        predictor.close()
+    report_dict = compare_models(metrics)
+    report_dict["early_stopped"] = fraction < 1.0
+    report_dict["evaluated_fraction"] = fraction
+    mse = metrics["challenger"].mean_squared
 
-    output_dir = "/opt/ml/processing/evaluation"
+    output_dir = f"{base_dir}/evaluation"
     pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
 
     logger.info("Writing out evaluation report with mse: %f", mse)
     evaluation_path = f"{output_dir}/evaluation.json"
     with open(evaluation_path, "w") as f:
         f.write(json.dumps(report_dict))
+
+if __name__ == "__main__":
+    run_main()
@@ -0,0 +1,128 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Packaging script for the fused inference artifact.
+
+Combines the preprocessing model.tar.gz written by preprocess.py and the
+model.tar.gz of the training job into a single model.tar.gz, served by
+serve.py in one container:
+
+    model.joblib      the fitted preprocessor, used when the kernel is missing
+    kernel/*.npy      the flat arrays of the preprocessing kernel
+    xgboost-model     the trained booster
+"""
+import argparse
+import json
+import logging
+import os
+import pickle
+import tarfile
+import tempfile
+
+import numpy as np
+
+KERNEL_ARRAYS = ["medians", "means", "scales", "categories", "fill_value"]
+
+def is_within_directory(directory, target):
+    abs_directory = os.path.abspath(directory)
+    abs_target = os.path.abspath(target)
+
+    prefix = os.path.commonprefix([abs_directory, abs_target])
+
+    return prefix == abs_directory
+
+def safe_extract(tar, path="."):
+    for member in tar.getmembers():
+        member_path = os.path.join(path, member.name)
+        if not is_within_directory(path, member_path):
+            raise Exception("Attempted Path Traversal in Tar File")
+    tar.extractall(path)
+
+def kernel_width(kernel_dir):
+    """Returns the number of features the preprocessing kernel produces."""
+    medians = np.load(os.path.join(kernel_dir, "medians.npy"))
+    categories = np.load(os.path.join(kernel_dir, "categories.npy"))
+    return len(medians) + len(categories)
+
+def num_features(booster):
+    """Returns the number of features the booster was trained on.
+
+    The xgboost 1.2 of the container has no Booster.num_features, so the
+    count is read from the model configuration.
+    """
+    config = json.loads(booster.save_config())
+    return int(config["learner"]["learner_model_param"]["num_feature"])
+
+def package_model(preprocess_model_path, xgboost_model_path, output_path):
+    """Writes the fused model.tar.gz to ``output_path``.
+
+    Raises ValueError when the preprocessing artifact has no kernel arrays,
+    or when the booster was not trained on the features the kernel produces.
+    """
+    with tempfile.TemporaryDirectory() as preprocess_dir, tempfile.TemporaryDirectory() as xgboost_dir:
+        with tarfile.open(preprocess_model_path) as tar:
+            safe_extract(tar, path=preprocess_dir)
+        with tarfile.open(xgboost_model_path) as tar:
+            safe_extract(tar, path=xgboost_dir)
+
+        kernel_dir = os.path.join(preprocess_dir, "kernel")
+        missing = [
+            name for name in KERNEL_ARRAYS if not os.path.isfile(os.path.join(kernel_dir, f"{name}.npy"))
+        ]
+        if missing:
+            raise ValueError(f"The preprocessing model has no kernel arrays {', '.join(missing)}.")
+
+        booster_path = os.path.join(xgboost_dir, "xgboost-model")
+        with open(booster_path, "rb") as f:
+            booster = pickle.load(f)
+        width = kernel_width(kernel_dir)
+        features = num_features(booster)
+        if features != width:
+            raise ValueError(f"The model takes {features} features, the preprocessor produces {width}.")
+
+        with tarfile.open(output_path, "w:gz") as tar:
+            joblib_path = os.path.join(preprocess_dir, "model.joblib")
+            if os.path.isfile(joblib_path):
+                tar.add(joblib_path, arcname="model.joblib")
+            tar.add(kernel_dir, arcname="kernel")
+            tar.add(booster_path, arcname="xgboost-model")
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+
+def run_main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--base-dir",
+        type=str,
+        default="/opt/ml/processing",
+        help="Directory holding the preprocessing and training models and the packaged output.",
+    )
+    args = parser.parse_args(argv)
+
+    output_dir = os.path.join(args.base_dir, "fused")
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info("Packaging the preprocessing and training models.")
+    package_model(
+        os.path.join(args.base_dir, "preprocess", "model.tar.gz"),
+        os.path.join(args.base_dir, "model", "model.tar.gz"),
+        os.path.join(output_dir, "model.tar.gz"),
+    )
+    logger.info("Wrote %s.", os.path.join(output_dir, "model.tar.gz"))
+
+if __name__ == "__main__":
+    run_main()
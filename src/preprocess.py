@@ -15,16 +15,26 @@
 
 """Feature engineers the abalone dataset."""
 import argparse
+import hashlib
+import io
 import logging
 import os
 import pathlib
 import json
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 import boto3
 import numpy as np
 import pandas as pd
+import scipy.sparse
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 from sklearn.compose import ColumnTransformer
+from sklearn.datasets import dump_svmlight_file
 from sklearn.impute import SimpleImputer
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
@@ -58,24 +68,301 @@ feature_columns_dtype = {
 
 label_column_dtype = {"rings": np.float64}
 
+numeric_features = [name for name in feature_columns_names if name != "sex"]
+
+categorical_features = ["sex"]
+
+missing_category = "missing"
+
+DEFAULT_MAX_WORKERS = 16
+
+DEFAULT_SKETCH_SIZE = 2048
+
+DEFAULT_CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+DEFAULT_SPLIT_SEED = 0
+
+DEFAULT_SPLIT_BLOCK_ROWS = 65536
+
+DEFAULT_SHARD_CHUNK_SIZE = 1000000
+
+RESOURCE_CONFIG_PATH = "/opt/ml/config/resourceconfig.json"
+
+class QuantileSketch:
+    """Mergeable approximate quantile sketch.
+
+    Values are kept exactly until the buffer exceeds twice the sketch size,
+    after which they are compressed into ``size`` weighted centroids of equal
+    rank width. The rank error after compression is roughly ``1 / size``.
+    """
+
+    def __init__(self, size=DEFAULT_SKETCH_SIZE) -> None:
+        self._size = size
+        self._values = np.empty(0)
+        self._weights = np.empty(0)
+        self._exact = True
+
+    @property
+    def count(self):
+        return float(self._weights.sum())
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self._append(values, np.ones(len(values)))
+
+    def merge(self, other):
+        self._exact = self._exact and other._exact
+        self._append(other._values, other._weights)
+
+    def quantile(self, q):
+        if not len(self._values):
+            return np.nan
+        if self._exact:
+            return float(np.quantile(self._values, q))
+
+        order = np.argsort(self._values, kind="stable")
+        values = self._values[order]
+        weights = self._weights[order]
+        positions = np.cumsum(weights) - weights / 2
+        return float(np.interp(q * weights.sum(), positions, values))
+
+    def to_dict(self):
+        return {
+            "size": self._size,
+            "values": self._values,
+            "weights": self._weights,
+            "exact": self._exact,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["size"])
+        sketch._values = np.asarray(data["values"], dtype=np.float64)
+        sketch._weights = np.asarray(data["weights"], dtype=np.float64)
+        sketch._exact = bool(data["exact"])
+        return sketch
+
+    def _append(self, values, weights):
+        self._values = np.concatenate((self._values, values))
+        self._weights = np.concatenate((self._weights, weights))
+        if len(self._values) > 2 * self._size:
+            self._compress()
+
+    def _compress(self):
+        order = np.argsort(self._values, kind="stable")
+        values = self._values[order]
+        weights = self._weights[order]
+        ranks = np.cumsum(weights) - weights / 2
+        bins = np.minimum((ranks / weights.sum() * self._size).astype(np.int64), self._size - 1)
+
+        bin_weights = np.bincount(bins, weights=weights, minlength=self._size)
+        bin_sums = np.bincount(bins, weights=values * weights, minlength=self._size)
+        keep = bin_weights > 0
+        self._values = bin_sums[keep] / bin_weights[keep]
+        self._weights = bin_weights[keep]
+        self._exact = False
+
+class FeatureStatistics:
+    """Mergeable sufficient statistics for fitting the preprocessing model.
+
+    Tracks per numeric column the count, mean and sum of squared deviations of
+    the observed values (merged with Chan's parallel update), a quantile
+    sketch for the imputation median, and the category counts of ``sex``.
+    Statistics built over disjoint chunks can be merged in any order.
+    """
+
+    def __init__(self, sketch_size=DEFAULT_SKETCH_SIZE) -> None:
+        self.rows = 0
+        self.count = np.zeros(len(numeric_features))
+        self.mean = np.zeros(len(numeric_features))
+        self.m2 = np.zeros(len(numeric_features))
+        self.sketches = [QuantileSketch(sketch_size) for _ in numeric_features]
+        self.category_counts = {}
+
+    def update(self, df):
+        """Folds a raw input chunk into the statistics."""
+        if not len(df):
+            return
+
+        values = df[numeric_features].to_numpy(dtype=np.float64)
+        observed = ~np.isnan(values)
+        count = observed.sum(axis=0).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, np.nansum(values, axis=0) / count, 0.0)
+        m2 = np.nansum((values - mean) ** 2, axis=0)
+        self._merge_moments(count, mean, m2)
+
+        for index, sketch in enumerate(self.sketches):
+            sketch.update(values[observed[:, index], index])
+
+        categories = df[categorical_features[0]].fillna(missing_category).value_counts()
+        for category, category_count in categories.items():
+            self.category_counts[category] = self.category_counts.get(category, 0) + int(category_count)
+
+        self.rows += len(df)
+
+    def merge(self, other):
+        """Folds another set of statistics into this one."""
+        self._merge_moments(other.count, other.mean, other.m2)
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+        for category, category_count in other.category_counts.items():
+            self.category_counts[category] = self.category_counts.get(category, 0) + category_count
+        self.rows += other.rows
+        return self
+
+    def medians(self):
+        return np.array([sketch.quantile(0.5) for sketch in self.sketches])
+
+    def to_dict(self):
+        """Returns the statistics as plain Python and numpy values."""
+        return {
+            "rows": self.rows,
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "sketches": [sketch.to_dict() for sketch in self.sketches],
+            "category_counts": dict(self.category_counts),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        statistics = cls()
+        statistics.rows = int(data["rows"])
+        statistics.count = np.asarray(data["count"], dtype=np.float64)
+        statistics.mean = np.asarray(data["mean"], dtype=np.float64)
+        statistics.m2 = np.asarray(data["m2"], dtype=np.float64)
+        statistics.sketches = [QuantileSketch.from_dict(sketch) for sketch in data["sketches"]]
+        statistics.category_counts = dict(data["category_counts"])
+        return statistics
+
+    def imputed_moments(self):
+        """Returns the mean and variance after median imputation.
+
+        The scaler is fitted on imputed values, so the missing values of each
+        column are folded in as ``rows - count`` copies of its median.
+        """
+        medians = self.medians()
+        missing = self.rows - self.count
+        total = self.count + missing
+        delta = medians - self.mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(missing > 0, self.mean + delta * missing / total, self.mean)
+            m2 = np.where(missing > 0, self.m2 + delta ** 2 * self.count * missing / total, self.m2)
+        return mean, m2 / self.rows
+
+    def _merge_moments(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0.0)
+            self.m2 = np.where(
+                total > 0, self.m2 + m2 + delta ** 2 * self.count * count / total, 0.0
+            )
+        self.count = total
+
+class PreprocessingState:
+    """Statistics persisted next to the preprocessing model between runs.
+
+    Records which manifest entries, identified by bucket, key and ETag, have
+    already been folded into the statistics, so that a new run only reads
+    the entries it has not seen. The state is stored as plain values so it
+    can be loaded whether this file runs as a script or is imported.
+    """
+
+    file_name = "statistics.joblib"
+
+    @property
+    def _logger(self):
+        return logging.getLogger(__name__)
+
+    def __init__(self, statistics=None, entries=None) -> None:
+        self.statistics = statistics if statistics is not None else FeatureStatistics()
+        self.entries = dict(entries or {})
+
+    def unseen(self, entries):
+        """Returns the indices of the entries that still need to be folded in.
+
+        ``entries`` holds a ``(bucket, key, etag)`` tuple per manifest entry.
+        Statistics cannot be subtracted, so None is returned when a folded
+        entry changed or left the manifest and the state has to be rebuilt.
+        """
+        current = {(bucket, key): etag for bucket, key, etag in entries}
+        for location, etag in self.entries.items():
+            if current.get(location) != etag:
+                self._logger.info("Entry %s changed since the last run.", location)
+                return None
+
+        return [
+            index
+            for index, (bucket, key, _) in enumerate(entries)
+            if (bucket, key) not in self.entries
+        ]
+
+    def fold(self, entry, frames):
+        """Folds the frames of a manifest entry into the statistics."""
+        bucket, key, etag = entry
+        for df in frames:
+            self.statistics.update(df)
+        self.entries[(bucket, key)] = etag
+
+    def save(self, path, s3_client=None):
+        data = {
+            "statistics": self.statistics.to_dict(),
+            "entries": [[bucket, key, etag] for (bucket, key), etag in self.entries.items()],
+        }
+        buffer = io.BytesIO()
+        joblib.dump(data, buffer)
+        if path.startswith("s3://"):
+            bucket, key = _parse_s3_uri(path)
+            s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+        else:
+            with open(path, "wb") as f:
+                f.write(buffer.getvalue())
+
+    @classmethod
+    def load(cls, path, s3_client=None):
+        """Loads the state from a local path or S3 URI, or returns None."""
+        try:
+            if path.startswith("s3://"):
+                bucket, key = _parse_s3_uri(path)
+                body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+            else:
+                with open(path, "rb") as f:
+                    body = f.read()
+        except FileNotFoundError:
+            return None
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+
+        data = joblib.load(io.BytesIO(body))
+        return cls(
+            FeatureStatistics.from_dict(data["statistics"]),
+            {(bucket, key): etag for bucket, key, etag in data["entries"]},
+        )
+
+def _parse_s3_uri(uri):
+    parsed = urlparse(uri)
+    return parsed.netloc, parsed.path.lstrip("/")
+
 class DataProcessor:
     @property
     def _logger(self):
         return logging.getLogger(__name__)
 
-    def __init__(self, input_data) -> None:
+    def __init__(self, input_data=None, statistics=None) -> None:
         self._input_data = input_data
         self._logger.debug("Defining transformers.")
-        numeric_features = list(feature_columns_names)
-        numeric_features.remove("sex")
         numeric_transformer = Pipeline(
             steps=[("imputer", SimpleImputer(strategy="median")), ("scaler", StandardScaler())]
         )
 
-        categorical_features = ["sex"]
         categorical_transformer = Pipeline(
             steps=[
-                ("imputer", SimpleImputer(strategy="constant", fill_value="missing")),
+                ("imputer", SimpleImputer(strategy="constant", fill_value=missing_category)),
                 ("onehot", OneHotEncoder(handle_unknown="ignore")),
             ]
         )
@@ -87,18 +374,78 @@ class DataProcessor:
             ]
         )
 
-        self._logger.debug("Fitting transforms.")
-        self._input_data_y = self._input_data.pop("rings")
-        self._preprocess.fit(self._input_data)
+        if statistics is not None:
+            self._logger.debug("Fitting transforms from statistics over %d rows.", statistics.rows)
+            self._fit_statistics(statistics)
+        else:
+            self._logger.debug("Fitting transforms.")
+            self._input_data_y = self._input_data.pop("rings")
+            self._preprocess.fit(self._input_data)
+
+    def _fit_statistics(self, statistics):
+        """Fits the transformers from streamed statistics.
+
+        The column transformer is first fitted on a seed frame holding one row
+        per observed category, which sets up the encoder and the output
+        layout, and the numeric parameters are then replaced by the ones
+        derived from the statistics.
+        """
+        if not statistics.rows:
+            raise ValueError("Cannot fit the preprocessing model without any rows.")
+
+        categories = sorted(statistics.category_counts)
+        medians = statistics.medians()
+        seed = pd.DataFrame(
+            np.tile(medians, (len(categories), 1)), columns=numeric_features
+        )
+        seed.insert(0, categorical_features[0], categories)
+        self._preprocess.fit(seed)
+
+        mean, var = statistics.imputed_moments()
+        numeric_transformer = self._preprocess.named_transformers_["num"]
+        numeric_transformer.named_steps["imputer"].statistics_ = medians
+        scaler = numeric_transformer.named_steps["scaler"]
+        scaler.mean_ = mean
+        scaler.var_ = var
+        # Mirrors the scaler's own test for constant features.
+        eps = np.finfo(np.float64).eps
+        constant = var <= statistics.rows * eps * var + (statistics.rows * mean * eps) ** 2
+        scaler.scale_ = np.where(constant, 1.0, np.sqrt(var))
+        scaler.n_samples_seen_ = statistics.rows
 
     def save_model(self, model_path):
+        """Saves the fitted preprocessor and packages it as model.tar.gz.
+
+        Next to model.joblib, the parameters used by the serving kernel are
+        saved as flat arrays under ``kernel/``. Serving can memory map them
+        without unpickling the scikit-learn objects.
+        """
         model_joblib_path = os.path.join(model_path, "model.joblib")
+        model_kernel_path = os.path.join(model_path, "kernel")
         model_tar_path = os.path.join(model_path, "model.tar.gz")
         joblib.dump(self._preprocess, model_joblib_path)
+        self.save_kernel(model_kernel_path)
         tar = tarfile.open(model_tar_path, "w:gz")
         tar.add(model_joblib_path, arcname="model.joblib")
+        tar.add(model_kernel_path, arcname="kernel")
         tar.close()
 
+    def save_kernel(self, kernel_path):
+        """Saves the imputation, scaling and encoding parameters as ``.npy`` files."""
+        pathlib.Path(kernel_path).mkdir(parents=True, exist_ok=True)
+        numeric_transformer = self._preprocess.named_transformers_["num"]
+        categorical_transformer = self._preprocess.named_transformers_["cat"]
+        scaler = numeric_transformer.named_steps["scaler"]
+        arrays = {
+            "medians": numeric_transformer.named_steps["imputer"].statistics_,
+            "means": scaler.mean_,
+            "scales": scaler.scale_,
+            "categories": categorical_transformer.named_steps["onehot"].categories_[0].astype(str),
+            "fill_value": np.array(categorical_transformer.named_steps["imputer"].fill_value),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(kernel_path, f"{name}.npy"), array, allow_pickle=False)
+
     def process(self):
         self._logger.debug("Applying transforms.")
         x_pre = self._preprocess.transform(self._input_data)
@@ -106,13 +453,199 @@ class DataProcessor:
 
         return np.concatenate((y_pre, x_pre), axis=1)
 
+    def transform(self, df):
+        """Transforms a raw chunk, returning the label followed by the features."""
+        x_pre = self._preprocess.transform(df)
+        y_pre = df[label_column].to_numpy().reshape(len(df), 1)
+
+        return np.concatenate((y_pre, x_pre), axis=1)
+
+    @property
+    def output_columns(self):
+        """The number of columns of a transformed row, the label included."""
+        onehot = self._preprocess.named_transformers_["cat"].named_steps["onehot"]
+        return 1 + len(numeric_features) + len(onehot.categories_[0])
+
     def merge_two_dicts(x, y):
         """Merges two dicts, returning a new copy."""
         z = x.copy()
         z.update(y)
         return z
 
-class DataBuilder: 
+def _mix64(h):
+    """Applies the splitmix64 finalizer to an array of uint64 values."""
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xBF58476D1CE4E5B9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+def _hash_string(value):
+    digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+class SplitAssigner:
+    """Assigns rows to the train, validation and test splits.
+
+    Each row is hashed from its raw values together with the seed, and the
+    hash is mapped to a split by the cumulative ``boundaries``. The split of a
+    row therefore only depends on its content and the seed: it is the same
+    across reruns, between the in-memory and the chunked mode and when more
+    data is added to the manifest. Duplicate rows always land in the same
+    split, which keeps them from leaking from train into test.
+    """
+
+    def __init__(self, seed=DEFAULT_SPLIT_SEED, boundaries=(0.7, 0.85)) -> None:
+        self._seed = seed
+        self._boundaries = np.asarray(boundaries)
+
+    def assign(self, df):
+        """Returns the split index of every row of a raw frame."""
+        h = _mix64(np.full(len(df), self._seed, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15))
+
+        categories, uniques = pd.factorize(df[categorical_features[0]].fillna(missing_category))
+        unique_hashes = np.array([_hash_string(value) for value in uniques], dtype=np.uint64)
+        h = _mix64(h ^ unique_hashes[categories])
+
+        # Adding zero turns -0.0 into 0.0, and every NaN gets the same bits.
+        values = df[numeric_features + [label_column]].to_numpy(dtype=np.float64) + 0.0
+        values[np.isnan(values)] = np.nan
+        bits = np.ascontiguousarray(values).view(np.uint64)
+        for column in range(bits.shape[1]):
+            h = _mix64(h ^ _mix64(bits[:, column]))
+
+        draws = (h >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+        return np.searchsorted(self._boundaries, draws, side="right")
+
+class ManifestCache:
+    """Local cache of manifest objects keyed by bucket, key and ETag.
+
+    Frame entries hold the typed columns in an uncompressed ``.npz`` archive,
+    loaded with ``allow_pickle=False`` so a tampered entry cannot execute
+    code, and a hit skips both the download and the CSV parse. String
+    columns are stored as unicode arrays next to a mask of their missing
+    values. File entries hold the raw object, for the
+    chunked modes that read the downloaded files several times, so a hit
+    skips the download. The cache is capped at ``max_bytes`` and the least
+    recently used entries are evicted first, using the file modification
+    time as the access time.
+    """
+
+    extensions = (".npz", ".csv")
+
+    @property
+    def _logger(self):
+        return logging.getLogger(__name__)
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_MAX_BYTES) -> None:
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+    def get(self, bucket, key, etag):
+        path = self._path(bucket, key, etag)
+        try:
+            df = self._load_frame(path)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:  # pylint: disable=W0703
+            self._logger.warning("Discarding unreadable cache entry %s", path)
+            self._remove(path)
+            return None
+
+        self._logger.info("Cache hit for bucket: %s, key: %s", bucket, key)
+        return df
+
+    def put(self, bucket, key, etag, df):
+        path = self._path(bucket, key, etag)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            self._save_frame(f, df)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    @staticmethod
+    def _save_frame(f, df):
+        arrays = {"columns": np.asarray(df.columns, dtype=str)}
+        for i, name in enumerate(df.columns):
+            column = df[name]
+            if column.dtype.kind in "biuf":
+                arrays[f"values_{i}"] = column.to_numpy()
+            else:
+                missing = column.isna().to_numpy()
+                arrays[f"values_{i}"] = np.where(missing, "", column.to_numpy()).astype(str)
+                arrays[f"missing_{i}"] = missing
+            arrays[f"dtype_{i}"] = np.asarray(str(column.dtype))
+        np.savez(f, **arrays)
+
+    @staticmethod
+    def _load_frame(path):
+        with np.load(path, allow_pickle=False) as data:
+            columns = {}
+            for i, name in enumerate(data["columns"]):
+                values = data[f"values_{i}"]
+                if f"missing_{i}" in data:
+                    values = values.astype(object)
+                    values[data[f"missing_{i}"]] = np.nan
+                columns[str(name)] = pd.Series(values).astype(str(data[f"dtype_{i}"]))
+        return pd.DataFrame(columns)
+
+    def get_file(self, bucket, key, etag, fn):
+        """Copies the cached raw object to ``fn``, returning whether it was cached."""
+        path = self._path(bucket, key, etag, "csv")
+        try:
+            self._link(path, fn)
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+
+        self._logger.info("Cache hit for bucket: %s, key: %s", bucket, key)
+        return True
+
+    def put_file(self, bucket, key, etag, fn):
+        self._link(fn, self._path(bucket, key, etag, "csv"))
+        self._evict()
+
+    def _path(self, bucket, key, etag, extension="npz"):
+        digest = hashlib.sha256(f"{bucket}/{key}/{etag}".encode("utf-8")).hexdigest()
+        return os.path.join(self._cache_dir, f"{digest}.{extension}")
+
+    def _link(self, src, dst):
+        """Hard links ``src`` to ``dst``, or copies it across file systems."""
+        tmp_path = f"{dst}.{threading.get_ident()}.tmp"
+        try:
+            os.link(src, tmp_path)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self._cache_dir):
+                if entry.name.endswith(self.extensions):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self._max_bytes:
+                    break
+                self._logger.debug("Evicting cache entry %s", path)
+                self._remove(path)
+                total -= size
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+class DataBuilder:
     @property
     def _logger(self):
         return logging.getLogger(__name__)
@@ -121,75 +654,656 @@ class DataBuilder:
     def data_manifest(self):
         return self._data_manifest
 
-    def __init__(self, base_dir, data_manifest) -> None:
+    def __init__(
+        self, base_dir, data_manifest, max_workers=DEFAULT_MAX_WORKERS, s3_client=None, cache=None
+    ) -> None:
         self._base_dir = base_dir
         self._data_manifest = json.loads(data_manifest)
+        self._max_workers = max(1, max_workers)
+        self._s3_client = s3_client
+        self._cache = cache
+
+    @property
+    def s3_client(self):
+        """A single S3 client shared by all download threads.
+
+        boto3 clients are thread safe, so the connection pool is sized to the
+        number of workers rather than creating a new resource per object.
+        """
+        if self._s3_client is None:
+            self._s3_client = boto3.session.Session().client(
+                "s3", config=Config(max_pool_connections=self._max_workers)
+            )
+        return self._s3_client
 
     def build(self):
+        df_array = self.build_frames()
+
+        if len(df_array):
+            return pd.concat(df_array)
+
+    def build_frames(self):
+        """Returns the parsed frame of every manifest entry, in manifest order."""
         self._logger.info("Loading data from data manifest %s", self._data_manifest)
+        return self._map_entries(self._download_file, self._data_manifest.get("data"))
+
+    def entries(self):
+        """Returns a ``(bucket, key, etag)`` tuple per manifest entry."""
         data_paths = self._data_manifest.get("data")
+        etags = self._map_entries(self._head_object, data_paths)
+        return [
+            (value["bucketName"], value["objectKey"], etag)
+            for value, etag in zip(data_paths, etags)
+        ]
 
-        df_array = []
-        for index, value in enumerate(data_paths):
-            df = self._download_file(index, value["bucketName"], value["objectKey"])
-            df_array.append(df)
+    def download(self, indices=None):
+        """Downloads the manifest objects without parsing them.
 
-        if len(df_array):
-            return pd.concat(df_array)
+        Returns the local file paths in manifest order, or in the order of
+        ``indices`` when only some of the entries are needed. The files are
+        kept on disk so that they can be read several times in chunks.
+        """
+        self._logger.info("Downloading data from data manifest %s", self._data_manifest)
+        data_paths = self._data_manifest.get("data")
+        if indices is None:
+            return self._map_entries(self._download_object, data_paths)
+        paths = self._map_entries(self._download_object, [data_paths[index] for index in indices])
+        return dict(zip(indices, paths))
 
-    def _download_file(self, index, bucket, key):
+    def iter_chunks(self, paths, chunk_size):
+        """Yields the raw rows of the downloaded files in chunks."""
+        for fn in paths:
+            for chunk in self._read_file(fn, chunksize=chunk_size):
+                yield chunk
+
+    def _map_entries(self, fn, data_paths):
+        """Runs ``fn`` over the manifest entries concurrently.
+
+        Each worker downloads and parses its own object, so downloads overlap
+        with CSV parsing. The results are returned in manifest order.
+        """
         pathlib.Path(f"{self._base_dir}/data").mkdir(parents=True, exist_ok=True)
 
+        # Create the shared client before fanning out to the worker threads.
+        s3_client = self.s3_client
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            futures = [
+                executor.submit(fn, index, value["bucketName"], value["objectKey"], s3_client)
+                for index, value in enumerate(data_paths)
+            ]
+            return [future.result() for future in futures]
+
+    def _head_object(self, index, bucket, key, s3_client):
+        return s3_client.head_object(Bucket=bucket, Key=key)["ETag"]
+
+    def _download_object(self, index, bucket, key, s3_client):
+        if self._cache is None:
+            return self._fetch_object(index, bucket, key, s3_client)
+
+        fn = f"{self._base_dir}/data/{index}.csv"
+        etag = s3_client.head_object(Bucket=bucket, Key=key)["ETag"]
+        if not self._cache.get_file(bucket, key, etag, fn):
+            _, etag = self._get_object(index, bucket, key, s3_client)
+            self._cache.put_file(bucket, key, etag, fn)
+        return fn
+
+    def _fetch_object(self, index, bucket, key, s3_client):
         self._logger.info("Downloading data from bucket: %s, key: %s", bucket, key)
         fn = f"{self._base_dir}/data/{index}.csv"
-        s3 = boto3.resource("s3")
-        s3.Bucket(bucket).download_file(key, fn)
+        s3_client.download_file(bucket, key, fn)
+        return fn
+
+    def _get_object(self, index, bucket, key, s3_client):
+        """Downloads an object with a single GET, returning its file and ETag.
+
+        The ETag comes from the same response as the body, so the cache entry
+        is keyed by the version that was actually downloaded even if the
+        object changes in the meantime.
+        """
+        self._logger.info("Downloading data from bucket: %s, key: %s", bucket, key)
+        fn = f"{self._base_dir}/data/{index}.csv"
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        with open(fn, "wb") as f:
+            shutil.copyfileobj(response["Body"], f)
+        return fn, response["ETag"]
+
+    def _download_file(self, index, bucket, key, s3_client):
+        if self._cache is None:
+            return self._parse_object(index, bucket, key, s3_client)
+
+        etag = s3_client.head_object(Bucket=bucket, Key=key)["ETag"]
+        df = self._cache.get(bucket, key, etag)
+        if df is None:
+            fn, etag = self._get_object(index, bucket, key, s3_client)
+            df = self._read_object(fn)
+            self._cache.put(bucket, key, etag, df)
+        return df
+
+    def _parse_object(self, index, bucket, key, s3_client):
+        return self._read_object(self._fetch_object(index, bucket, key, s3_client))
 
+    def _read_object(self, fn):
         self._logger.debug("Reading raw input data.")
-        df = pd.read_csv(
+        df = self._read_file(fn)
+        os.unlink(fn)
+        return df
+
+    def _read_file(self, fn, chunksize=None):
+        return pd.read_csv(
             fn,
             header=None,
             names=feature_columns_names + [label_column],
             dtype=DataProcessor.merge_two_dicts(feature_columns_dtype, label_column_dtype),
+            chunksize=chunksize,
         )
-        os.unlink(fn)   
-        return df
 
-def run_main():
+class CsvSplitWriter:
+    """Writes split rows as headerless CSV, the label in the first column."""
+
+    extension = "csv"
+
+    def __init__(self, path, columns=0) -> None:
+        self._f = open(path, "w")
+
+    def write(self, block):
+        pd.DataFrame(block).to_csv(self._f, header=False, index=False)
+
+    def close(self):
+        self._f.close()
+
+class ParquetSplitWriter:
+    """Writes split rows as a float32 Parquet file, the label in the first column.
+
+    An empty split still gets a file with the schema of ``columns`` columns.
+    Requires pyarrow, which is only imported when this format is selected.
+    """
+
+    extension = "parquet"
+
+    def __init__(self, path, columns=0) -> None:
+        import pyarrow.parquet as pq
+
+        self._pq = pq
+        self._path = path
+        self._columns = columns
+        self._writer = None
+
+    def write(self, block):
+        import pyarrow as pa
+
+        block = np.asarray(block, dtype=np.float32)
+        table = pa.Table.from_arrays(
+            [pa.array(block[:, index]) for index in range(block.shape[1])],
+            names=[str(index) for index in range(block.shape[1])],
+        )
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self._path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is None:
+            self.write(np.empty((0, self._columns), dtype=np.float32))
+        self._writer.close()
+
+class NpySplitWriter:
+    """Writes split rows as a float32 ``.npy`` array, the label in the first column.
+
+    The number of rows is only known once all blocks are written, so the rows
+    are staged in a raw file and copied behind the array header on close. An
+    empty split is saved with a shape of ``(0, columns)``.
+    """
+
+    extension = "npy"
+
+    def __init__(self, path, columns=0) -> None:
+        self._path = path
+        self._raw = open(f"{path}.raw", "wb")
+        self._rows = 0
+        self._columns = columns
+
+    def write(self, block):
+        block = np.ascontiguousarray(block, dtype=np.float32)
+        self._raw.write(block.tobytes())
+        self._rows += block.shape[0]
+        self._columns = block.shape[1]
+
+    def close(self):
+        self._raw.close()
+        header = {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+            "fortran_order": False,
+            "shape": (self._rows, self._columns),
+        }
+        with open(self._path, "wb") as f, open(f"{self._path}.raw", "rb") as raw:
+            np.lib.format.write_array_header_1_0(f, header)
+            shutil.copyfileobj(raw, f)
+        os.unlink(f"{self._path}.raw")
+
+class LibSvmSplitWriter:
+    """Writes split rows in zero based libsvm format, zero entries included.
+
+    XGBoost reads absent entries as missing values rather than zeros, so
+    only missing values are left out. Otherwise a model trained on this
+    format would route the zeros differently than the dense rows it is
+    served.
+    """
+
+    extension = "libsvm"
+
+    def __init__(self, path, columns=0) -> None:
+        self._f = open(path, "wb")
+
+    def write(self, block):
+        if len(block):
+            X = block[:, 1:]
+            present = ~np.isnan(X)
+            indptr = np.concatenate([[0], np.cumsum(present.sum(axis=1))])
+            # built from its arrays, a CSR matrix keeps the explicit zeros
+            X = scipy.sparse.csr_matrix((X[present], np.nonzero(present)[1], indptr), shape=X.shape)
+            dump_svmlight_file(X, block[:, 0], self._f, zero_based=True)
+
+    def close(self):
+        self._f.close()
+
+split_writers = {
+    writer.extension: writer
+    for writer in [CsvSplitWriter, ParquetSplitWriter, NpySplitWriter, LibSvmSplitWriter]
+}
+
+split_names = ["train", "validation", "test"]
+
+def open_split_writers(base_dir, output_format="csv", part=None, columns=0):
+    """Opens a writer per split under ``{base_dir}/{split}/{split}.{format}``.
+
+    With a ``part``, the files are named ``{split}-{part}.{format}`` so that
+    the shards written by several hosts can share a split directory. The
+    formats that record a width write empty splits with ``columns`` columns.
+    """
+    writer = split_writers[output_format]
+    writers = []
+    for name in split_names:
+        pathlib.Path(f"{base_dir}/{name}").mkdir(parents=True, exist_ok=True)
+        file_name = name if part is None else f"{name}-{part}"
+        writers.append(writer(f"{base_dir}/{name}/{file_name}.{writer.extension}", columns))
+    return writers
+
+def fold_manifest(state, entries, read_entry):
+    """Folds the manifest entries missing from ``state`` into it.
+
+    ``read_entry`` returns the frames of the entry at a manifest index. The
+    state is rebuilt from every entry when it cannot be updated in place.
+    """
+    logger = logging.getLogger()
+    unseen = state.unseen(entries)
+    if unseen is None:
+        logger.info("Rebuilding the statistics from all %d manifest entries.", len(entries))
+        state = PreprocessingState()
+        unseen = range(len(entries))
+    else:
+        logger.info("Folding %d of %d manifest entries into the statistics.", len(unseen), len(entries))
+
+    for index in unseen:
+        state.fold(entries[index], read_entry(index))
+    return state
+
+def run_streaming(
+    data_builder,
+    base_dir,
+    chunk_size,
+    output_format="csv",
+    split_seed=DEFAULT_SPLIT_SEED,
+    state=None,
+):
+    """Preprocesses the manifest out of core, one chunk at a time.
+
+    The objects are downloaded to local disk once and then read twice: a
+    first pass accumulates the statistics used to fit the transformers, and a
+    second pass transforms each chunk and appends it to its split. Peak memory
+    is bounded by the chunk size rather than by the size of the dataset. When
+    a ``state`` from a previous run is given, the first pass only reads the
+    entries that were not folded into it yet.
+
+    Returns the fitted data processor and the updated state.
+    """
+    logger = logging.getLogger()
+    paths = data_builder.download()
+
+    logger.info("Accumulating statistics in chunks of %d rows.", chunk_size)
+    if state is None:
+        statistics = FeatureStatistics()
+        for chunk in data_builder.iter_chunks(paths, chunk_size):
+            statistics.update(chunk)
+    else:
+        state = fold_manifest(
+            state,
+            data_builder.entries(),
+            lambda index: data_builder.iter_chunks([paths[index]], chunk_size),
+        )
+        statistics = state.statistics
+
+    data_processor = DataProcessor(statistics=statistics)
+
+    logger.info("Writing out %s datasets to %s.", output_format, base_dir)
+    write_chunks(
+        data_builder.iter_chunks(paths, chunk_size),
+        data_processor,
+        open_split_writers(base_dir, output_format, columns=data_processor.output_columns),
+        split_seed,
+    )
+
+    for fn in paths:
+        os.unlink(fn)
+
+    return data_processor, state
+
+def write_chunks(chunks, data_processor, writers, split_seed=DEFAULT_SPLIT_SEED):
+    """Transforms raw chunks and appends each row to the writer of its split."""
+    split_assigner = SplitAssigner(split_seed)
+    try:
+        for chunk in chunks:
+            assignments = split_assigner.assign(chunk)
+            data_output = data_processor.transform(chunk)
+            for index, writer in enumerate(writers):
+                writer.write(data_output[assignments == index])
+    finally:
+        for writer in writers:
+            writer.close()
+
+def host_rank(config_path=RESOURCE_CONFIG_PATH):
+    """Returns the rank of this host and the number of hosts of the job.
+
+    SageMaker describes the hosts of a processing job in its resource config;
+    outside of a job there is a single host.
+    """
+    try:
+        with open(config_path) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return 0, 1
+    hosts = sorted(config["hosts"])
+    return hosts.index(config["current_host"]), len(hosts)
+
+def resolve_host_rank(args):
+    """Returns the rank and host count given as arguments, or else those of the job."""
+    if args.host_rank is not None:
+        return args.host_rank, args.host_count
+    return host_rank()
+
+def shard_manifest(data_manifest, rank, hosts):
+    """Returns the JSON manifest of the entries handled by host ``rank``."""
+    manifest = json.loads(data_manifest)
+    manifest["data"] = manifest.get("data", [])[rank::hosts]
+    return json.dumps(manifest)
+
+def fit_partial_state(manifest_builder, shard_builder, rank, chunk_size, state=None):
+    """Folds the entries of a manifest shard into partial statistics.
+
+    Without a ``state`` from a previous run every entry of the shard is read.
+    Otherwise only the shard entries missing from it are read, and the host
+    of rank 0 also carries the statistics of the previous run, so that the
+    partial states of all hosts add up to the state of the whole manifest.
+    The state is rebuilt from scratch on every host when it is stale, which
+    all hosts agree on since they check it against the whole manifest.
+    """
+    logger = logging.getLogger()
+    entries = shard_builder.entries()
+    partial = PreprocessingState()
+    indices = range(len(entries))
+    if state is not None and state.unseen(manifest_builder.entries()) is not None:
+        indices = [
+            index for index, (bucket, key, _) in enumerate(entries) if (bucket, key) not in state.entries
+        ]
+        if rank == 0:
+            partial = state
+    logger.info("Folding %d of %d shard entries into the statistics.", len(indices), len(entries))
+
+    paths = shard_builder.download(indices)
+    for index, fn in paths.items():
+        partial.fold(entries[index], shard_builder.iter_chunks([fn], chunk_size))
+        os.unlink(fn)
+    return partial
+
+def merge_states(states):
+    """Merges the partial states written by the hosts of a sharded job."""
+    merged = PreprocessingState()
+    for state in states:
+        merged.statistics.merge(state.statistics)
+        merged.entries.update(state.entries)
+    return merged
+
+def load_partial_states(statistics_dir):
+    paths = sorted(pathlib.Path(statistics_dir).glob("statistics-*.joblib"))
+    return [PreprocessingState.load(str(path)) for path in paths]
+
+def write_splits(
+    data_output, assignments, writers, seed=DEFAULT_SPLIT_SEED, block_rows=DEFAULT_SPLIT_BLOCK_ROWS
+):
+    """Writes each split straight from its row indices.
+
+    The rows of a split are shuffled by a seeded permutation of their
+    indices and gathered one block at a time, so no full copy of the data
+    matrix is made.
+    """
+    rng = np.random.default_rng(seed)
+    for index, writer in enumerate(writers):
+        rows = rng.permutation(np.flatnonzero(assignments == index))
+        for start in range(0, len(rows), block_rows):
+            writer.write(data_output[rows[start:start + block_rows]])
+        writer.close()
+
+def run_sharded(args, data_manifest, cache=None):
+    """Runs one stage of the preprocessing sharded across the hosts of a job.
+
+    Every host handles the manifest entries of its rank. In the statistics
+    mode it writes the partial statistics of its shard to
+    ``statistics/statistics-{rank}.joblib``. In the transform mode it merges
+    the partial statistics of all hosts into the fitted preprocessor, and
+    writes its shard of the splits to ``{split}/{split}-{rank}.{format}``;
+    the host of rank 0 also saves the model and the state. With a ``cache``
+    the objects of the shard are only downloaded when they changed.
+    """
+    logger = logging.getLogger()
+    base_dir = args.base_dir
+    rank, hosts = resolve_host_rank(args)
+    logger.info("Running the %s stage on host %d of %d.", args.mode, rank + 1, hosts)
+
+    manifest_builder = DataBuilder(base_dir, data_manifest, max_workers=args.max_workers)
+    shard_builder = DataBuilder(
+        base_dir,
+        shard_manifest(data_manifest, rank, hosts),
+        max_workers=args.max_workers,
+        s3_client=manifest_builder.s3_client,
+        cache=cache,
+    )
+    chunk_size = args.chunk_size or DEFAULT_SHARD_CHUNK_SIZE
+
+    if args.mode == "statistics":
+        state = None
+        if args.state_uri:
+            state = PreprocessingState.load(args.state_uri, manifest_builder.s3_client)
+        partial = fit_partial_state(manifest_builder, shard_builder, rank, chunk_size, state)
+        pathlib.Path(f"{base_dir}/statistics").mkdir(parents=True, exist_ok=True)
+        partial.save(f"{base_dir}/statistics/statistics-{rank}.joblib")
+        return
+
+    statistics_dir = args.statistics_dir or f"{base_dir}/statistics"
+    state = merge_states(load_partial_states(statistics_dir))
+    data_processor = DataProcessor(statistics=state.statistics)
+
+    logger.info("Writing out %s datasets to %s.", args.output_format, base_dir)
+    paths = shard_builder.download()
+    write_chunks(
+        shard_builder.iter_chunks(paths, chunk_size),
+        data_processor,
+        open_split_writers(
+            base_dir, args.output_format, part=rank, columns=data_processor.output_columns
+        ),
+        args.split_seed,
+    )
+    for fn in paths:
+        os.unlink(fn)
+
+    if rank == 0:
+        logger.info("Saving the preprocessing model to %s", base_dir)
+        data_processor.save_model(os.path.join(base_dir, "model"))
+        if args.state_uri:
+            logger.info("Saving the statistics to %s", args.state_uri)
+            state.save(os.path.join(base_dir, "model", PreprocessingState.file_name))
+            state.save(args.state_uri, manifest_builder.s3_client)
+
+def run_main(argv=None):
     logger = logging.getLogger()
     logger.setLevel(logging.DEBUG)
-    logger.addHandler(logging.StreamHandler())
+    if not logger.handlers:
+        # run_main can be called several times in one process
+        logger.addHandler(logging.StreamHandler())
     logger.debug("Starting preprocessing.")
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("--data-manifest", type=str, required=True)
-    args = parser.parse_args()
+    manifest = parser.add_mutually_exclusive_group(required=True)
+    manifest.add_argument("--data-manifest", type=str, help="The data manifest as JSON.")
+    manifest.add_argument(
+        "--data-manifest-file",
+        type=str,
+        help="Path of the data manifest, such as a file delivered as a processing input.",
+    )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        default="all",
+        choices=["all", "statistics", "transform"],
+        help="Preprocess the whole manifest on a single host, or run one of the two stages "
+        "of sharded preprocessing: each host writes the partial statistics of its manifest "
+        "shard, then each host merges them and transforms its shard.",
+    )
+    parser.add_argument(
+        "--statistics-dir",
+        type=str,
+        default=None,
+        help="Directory of the partial statistics of all hosts, read by the transform "
+        "mode. Defaults to the statistics directory under --base-dir.",
+    )
+    parser.add_argument(
+        "--host-rank",
+        type=int,
+        default=None,
+        help="Rank of this host, when not running in a SageMaker processing job.",
+    )
+    parser.add_argument(
+        "--host-count",
+        type=int,
+        default=None,
+        help="Number of hosts, required with --host-rank.",
+    )
+    parser.add_argument(
+        "--base-dir",
+        type=str,
+        default="/opt/ml/processing",
+        help="Directory the data and model outputs are written under.",
+    )
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="Process the data out of core in chunks of this many rows.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Cache the parsed manifest objects in this directory.",
+    )
+    parser.add_argument("--cache-max-bytes", type=int, default=DEFAULT_CACHE_MAX_BYTES)
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        default="csv",
+        choices=sorted(split_writers),
+        help="File format of the train, validation and test splits.",
+    )
+    parser.add_argument("--split-seed", type=int, default=DEFAULT_SPLIT_SEED)
+    parser.add_argument(
+        "--state-uri",
+        type=str,
+        default=None,
+        help="Local path or S3 URI of the statistics kept between runs. Only the "
+        "manifest entries that are not part of them yet are read to fit the model.",
+    )
+    args = parser.parse_args(argv)
+    if (args.host_rank is None) != (args.host_count is None):
+        parser.error("--host-rank and --host-count must be given together.")
+    if args.host_rank is not None and not 0 <= args.host_rank < args.host_count:
+        parser.error("--host-rank must be at least 0 and less than --host-count.")
+
+    _, hosts = resolve_host_rank(args)
+    if args.mode == "all" and hosts > 1:
+        # every host would write the whole manifest to the same outputs
+        raise ValueError(
+            f"The all mode runs on a single host, but the job has {hosts} hosts. "
+            "Run the statistics and then the transform mode to shard the manifest."
+        )
+
+    base_dir = args.base_dir
+    data_manifest = args.data_manifest
+    if args.data_manifest_file:
+        with open(args.data_manifest_file) as f:
+            data_manifest = f.read()
+    cache = ManifestCache(args.cache_dir, args.cache_max_bytes) if args.cache_dir else None
+    if args.mode != "all":
+        run_sharded(args, data_manifest, cache)
+        return
 
     logger.debug("Downloading raw input data")
-    base_dir = "/opt/ml/processing"
-    data_builder = DataBuilder(base_dir, args.data_manifest)
-    df = data_builder.build()
-
-    logger.debug("Preprocessing raw input data")
-    data_processor = DataProcessor(df)
-    data_output = data_processor.process()
-
-    len_data_output = len(data_output)
-    logger.info("Splitting %d rows of data into train, validation, test datasets.", len_data_output)
-    np.random.shuffle(data_output)
-    train, validation, test = np.split(
-        data_output, [int(0.7 * len_data_output), int(0.85 * len_data_output)]
+    data_builder = DataBuilder(
+        base_dir, data_manifest, max_workers=args.max_workers, cache=cache
     )
 
-    logger.info("Writing out datasets to %s.", base_dir)
-    pd.DataFrame(train).to_csv(f"{base_dir}/train/train.csv", header=False, index=False)
-    pd.DataFrame(validation).to_csv(
-        f"{base_dir}/validation/validation.csv", header=False, index=False
-    )
-    pd.DataFrame(test).to_csv(f"{base_dir}/test/test.csv", header=False, index=False)
+    state = None
+    if args.state_uri:
+        state = PreprocessingState.load(args.state_uri, data_builder.s3_client)
+        state = state if state is not None else PreprocessingState()
+
+    if args.chunk_size:
+        data_processor, state = run_streaming(
+            data_builder, base_dir, args.chunk_size, args.output_format, args.split_seed, state
+        )
+    else:
+        frames = data_builder.build_frames()
+        df = pd.concat(frames)
+
+        # Assign the splits first, since fitting pops the label from the frame.
+        assignments = SplitAssigner(args.split_seed).assign(df)
+
+        logger.debug("Preprocessing raw input data")
+        if state is None:
+            data_processor = DataProcessor(df)
+            data_output = data_processor.process()
+        else:
+            state = fold_manifest(state, data_builder.entries(), lambda index: [frames[index]])
+            data_processor = DataProcessor(statistics=state.statistics)
+            data_output = data_processor.transform(df)
+
+        logger.info(
+            "Splitting %d rows of data into train, validation, test datasets.", len(data_output)
+        )
+        logger.info("Writing out %s datasets to %s.", args.output_format, base_dir)
+        write_splits(
+            data_output,
+            assignments,
+            open_split_writers(
+                base_dir, args.output_format, columns=data_processor.output_columns
+            ),
+            seed=args.split_seed,
+        )
 
     logger.info("Saving the preprocessing model to %s", base_dir)
     data_processor.save_model(os.path.join(base_dir, "model"))
 
+    if state is not None:
+        logger.info("Saving the statistics to %s", args.state_uri)
+        state.save(os.path.join(base_dir, "model", PreprocessingState.file_name))
+        state.save(args.state_uri, data_builder.s3_client)
+
 if __name__ == "__main__":
     run_main()
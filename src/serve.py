@@ -0,0 +1,94 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Single container inference for the fused artifact written by package_model.py.
+
+Preprocesses the raw rows and predicts with the booster in one process,
+instead of sending the features as CSV from the transform container to the
+XGBoost container. The requests are decoded by transform.input_fn, and the
+features are passed to the booster as the float64 values the XGBoost
+container would parse from the CSV, so the predictions are the same.
+"""
+import os
+import pickle
+from collections import namedtuple
+
+import numpy as np
+
+import transform
+from transform import RawBatch, input_fn, instrumented, label_column
+
+FusedModel = namedtuple("FusedModel", ["preprocessor", "booster"])
+
+def encode_csv(prediction):
+    """Encodes the predictions like the CSV response of the built-in algorithm."""
+    return ",".join(map(str, np.asarray(prediction).tolist()))
+
+def encode_jsonlines(prediction):
+    return "".join(f"{value}\n" for value in np.asarray(prediction).tolist())
+
+output_encoders = {
+    "text/csv": encode_csv,
+    "application/x-npy": transform.encode_npy,
+    "application/jsonlines": encode_jsonlines,
+}
+
+def features(input_data, preprocessor):
+    """Preprocesses the rows of a request, without their label."""
+    if isinstance(input_data, RawBatch):
+        input_data = input_data._replace(label=None)
+    elif label_column in input_data:
+        input_data = input_data.drop(columns=label_column)
+    return transform.predict_fn.__wrapped__(input_data, preprocessor)
+
+def predict(input_data, model):
+    return model.booster.inplace_predict(features(input_data, model.preprocessor))
+
+@instrumented("predict_fn", lambda args, result: (len(result), 0))
+def predict_fn(input_data, model):
+    """Preprocess input data and predict with the booster
+
+    Labelled rows are accepted, and their label is ignored. When
+    TRANSFORM_PREDICTION_CACHE_ROWS is set, the predictions of rows seen
+    before come from the prediction cache.
+    """
+    if transform.prediction_cache.serves(model):
+        return transform.prediction_cache.transform(lambda rows: predict(rows, model), input_data)
+    return predict(input_data, model)
+
+@instrumented("output_fn", lambda args, result: (len(args[0]), len(result[0])))
+def output_fn(prediction, accept):
+    """Format prediction output.
+
+    Returns the body and its content type. Unknown accept types get CSV,
+    like the built-in algorithm.
+    """
+    content_type = accept if accept in output_encoders else "text/csv"
+    return output_encoders[content_type](prediction), content_type
+
+@instrumented("model_fn")
+def model_fn(model_dir):
+    """Deserialize the preprocessor and the booster of the fused artifact."""
+    preprocessor = transform.model_fn.__wrapped__(model_dir)
+    with open(os.path.join(model_dir, "xgboost-model"), "rb") as f:
+        booster = pickle.load(f)
+    model = FusedModel(preprocessor, booster)
+    # the cache holds the predictions of the fused model, not the features
+    transform.prediction_cache.bind(model)
+
+    if transform.WARMUP:
+        row = ",".join(["M"] + ["0.5"] * len(transform.numeric_feature_names))
+        predict(input_fn.__wrapped__(row, "text/csv"), model)
+    return model
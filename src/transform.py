@@ -15,20 +15,47 @@
 
 import pandas as pd
 import joblib
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
 from io import StringIO
+import csv
+import functools
+import io
+import itertools
+import json
 import os
+import random
+import threading
+import time
 import numpy as np
 import logging
 
-from sagemaker_containers.beta.framework import (
-    encoders, worker)
-
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
 XGBOOST_CONTENT_TYPE='text/csv'
 
+OUTPUT_CONTENT_TYPE = os.environ.get("TRANSFORM_OUTPUT_CONTENT_TYPE", XGBOOST_CONTENT_TYPE)
+
+# Seconds between two metric lines, and the fraction of requests and
+# responses whose payload is logged.
+METRICS_INTERVAL_SECONDS = float(os.environ.get("TRANSFORM_METRICS_INTERVAL_SECONDS", "60"))
+PAYLOAD_LOG_RATE = float(os.environ.get("TRANSFORM_PAYLOAD_LOG_RATE", "0"))
+
+# Responses with more rows than this are streamed in chunks of this many rows.
+CSV_CHUNK_ROWS = int(os.environ.get("TRANSFORM_CSV_CHUNK_ROWS", "10000"))
+
+# Whether model_fn runs a synthetic row through the serving path, so that
+# the first request does not pay for the cold code paths.
+WARMUP = os.environ.get("TRANSFORM_WARMUP", "true").lower() == "true"
+
+# Number of rows whose results are kept by the prediction cache, which is
+# disabled when 0. A hit saves the scikit-learn preprocessor, or the booster
+# of serve.py, most of its time; the compiled kernel computes the features
+# of a row about as fast as the cache looks them up.
+PREDICTION_CACHE_ROWS = int(os.environ.get("TRANSFORM_PREDICTION_CACHE_ROWS", "0"))
+
 feature_columns_names = [
     "sex",
     "length",
@@ -42,39 +69,665 @@ feature_columns_names = [
 
 label_column = "rings"
 
-def input_fn(input_data, content_type):
-    """Parse input data payload
+numeric_feature_names = feature_columns_names[1:]
+
+# Strings that pandas reads as missing values by default. Rows with a missing
+# sex are left to the pandas parser.
+CSV_NA_VALUES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+    "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+
+class LatencyHistogram:
+    """Latency histogram with log spaced buckets from 1us to 100s.
+
+    Percentiles are reported as the upper bound of their bucket, which is
+    within about 25% of the true value.
+    """
+
+    bounds = list(np.logspace(-6, 2, 81))
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        target = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(upper, self.max)
+        return 0.0
+
+class StageMetrics:
+    """In-process latency histograms and row and byte counters per serving stage.
+
+    A JSON metric line per stage is logged every ``interval`` seconds, from
+    the request that crosses the interval, and the counters are then reset.
+    """
+
+    def __init__(self, interval=METRICS_INTERVAL_SECONDS, payload_log_rate=PAYLOAD_LOG_RATE) -> None:
+        self.interval = interval
+        self.payload_log_rate = payload_log_rate
+        self._lock = threading.Lock()
+        self._reset(time.monotonic())
+
+    def _reset(self, now):
+        self.histograms = {}
+        self.rows = {}
+        self.bytes = {}
+        self.errors = {}
+        self._started = now
+
+    def record(self, stage, seconds, rows=0, nbytes=0, error=False):
+        with self._lock:
+            self.histograms.setdefault(stage, LatencyHistogram()).record(seconds)
+            self.rows[stage] = self.rows.get(stage, 0) + rows
+            self.bytes[stage] = self.bytes.get(stage, 0) + nbytes
+            self.errors[stage] = self.errors.get(stage, 0) + int(error)
+        self.maybe_emit()
+
+    def count_bytes(self, stage, nbytes):
+        """Adds the bytes of a streamed response once they have been sent."""
+        with self._lock:
+            self.bytes[stage] = self.bytes.get(stage, 0) + nbytes
+
+    def sample_payload(self):
+        """Returns whether the payload of the current call should be logged."""
+        return self.payload_log_rate > 0 and random.random() < self.payload_log_rate
+
+    def maybe_emit(self, force=False):
+        # The interval is checked and the counters swapped under one lock, so
+        # two requests crossing the interval together emit it only once.
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._started < self.interval:
+                return
+            lines = [self._line(stage, histogram, now) for stage, histogram in self.histograms.items()]
+            self._reset(now)
+        if lines and prediction_cache.max_rows:
+            lines.append(prediction_cache.stats())
+        for line in lines:
+            logger.info("%s", json.dumps(line))
+
+    def _line(self, stage, histogram, now):
+        return {
+            "metric": "transform_stage",
+            "stage": stage,
+            "interval_seconds": round(now - self._started, 3),
+            "count": histogram.count,
+            "errors": self.errors[stage],
+            "rows": self.rows[stage],
+            "bytes": self.bytes[stage],
+            "mean_ms": round(histogram.total / histogram.count * 1e3, 4),
+            "p50_ms": round(histogram.percentile(50) * 1e3, 4),
+            "p90_ms": round(histogram.percentile(90) * 1e3, 4),
+            "p99_ms": round(histogram.percentile(99) * 1e3, 4),
+            "max_ms": round(histogram.max * 1e3, 4),
+        }
+
+metrics = StageMetrics()
+
+def instrumented(stage, measure=None):
+    """Records the latency of a serving stage, and its rows and bytes.
+
+    ``measure`` receives the call arguments and the result, and returns the
+    number of rows and bytes handled by the call.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                metrics.record(stage, time.perf_counter() - start, error=True)
+                raise
+            rows, nbytes = measure(args, result) if measure else (0, 0)
+            metrics.record(stage, time.perf_counter() - start, rows, nbytes)
+            return result
+        return wrapper
+    return decorator
+
+def _rows(data):
+    if isinstance(data, RawBatch):
+        return len(data.sex)
+    return len(data)
+
+def _content_length(response):
+    body = response[0] if isinstance(response, tuple) else response
+    if isinstance(body, (str, bytes)):
+        return len(body)
+    # Streamed bodies count their bytes as they are sent.
+    return 0
+
+class RawBatch(namedtuple("RawBatch", ["sex", "numeric", "label"])):
+    """Raw abalone rows decoded into typed arrays.
+
+    ``sex`` holds the categories, ``numeric`` the float64 measurements in
+    schema order and ``label`` the rings, or None for unlabelled rows.
+    """
+
+    __slots__ = ()
+
+    def to_frame(self):
+        df = pd.DataFrame(self.numeric, columns=numeric_feature_names)
+        df.insert(0, "sex", self.sex)
+        if self.label is not None:
+            df[label_column] = self.label
+        return df
+
+def batch_from_rows(rows):
+    """Decodes rows of raw values into a RawBatch.
+
+    Returns None unless every row has the 8 feature columns, or the 9
+    columns of a labelled row, and the measurements are numeric.
+    """
+    if not rows:
+        return None
+
+    width = len(rows[0])
+    if width not in (len(feature_columns_names), len(feature_columns_names) + 1):
+        return None
+    if any(len(row) != width for row in rows):
+        return None
+
+    try:
+        numeric = np.array([row[1:] for row in rows], dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    sex = np.array([np.nan if row[0] is None else row[0] for row in rows], dtype=object)
+
+    if width == len(feature_columns_names) + 1:
+        # This is a labelled example, includes the ring label
+        return RawBatch(sex, numeric[:, :-1], numeric[:, -1])
+    # This is an unlabelled example.
+    return RawBatch(sex, numeric, None)
+
+def parse_csv(input_data):
+    """Decodes well formed abalone CSV rows straight into typed arrays.
+
+    Only handles payloads where every row has the 8 feature columns, or the
+    9 columns of a labelled row, without quoting or missing values. Returns
+    None for anything else, which is then left to the pandas parser.
+    """
+    if '"' in input_data:
+        return None
+
+    fields = [row.split(",") for row in input_data.splitlines() if row]
+    if any(row[0] in CSV_NA_VALUES for row in fields):
+        return None
+    return batch_from_rows(fields)
+
+class CompiledPreprocessor:
+    """Flat numpy kernel equivalent to the fitted preprocessing ColumnTransformer.
+
+    Holds the imputation medians, the scaler means and scales and a lookup
+    table of the one-hot categories, so that a transform is a handful of
+    vectorized operations instead of the scikit-learn dispatch. The numeric
+    columns go through the same operations as the scaler and the results
+    are identical to ``preprocessor.transform``. Categories that were not
+    seen in fitting encode to all zeros, like ``handle_unknown="ignore"``.
+    """
+
+    def __init__(self, medians, means, scales, categories, fill_value, preprocessor=None) -> None:
+        self.medians = medians
+        self.means = means
+        self.scales = scales
+        self.categories = list(categories)
+        self.fill_value = fill_value
+        self.preprocessor = preprocessor
+        self._lookup = {category: index for index, category in enumerate(self.categories)}
+
+    @classmethod
+    def compile(cls, preprocessor):
+        """Extracts the fitted parameters of the preprocessing model.
+
+        Raises ValueError when the model does not have the layout written by
+        preprocess.py, in which case it has to be used as is.
+        """
+        transformers = {
+            name: (transformer, list(columns))
+            for name, transformer, columns in preprocessor.transformers_
+            if name != "remainder"
+        }
+        if list(transformers) != ["num", "cat"] or getattr(preprocessor, "sparse_output_", False):
+            raise ValueError("Unexpected preprocessing model layout.")
+
+        numeric, numeric_columns = transformers["num"]
+        categorical, categorical_columns = transformers["cat"]
+        if numeric_columns != numeric_feature_names or categorical_columns != ["sex"]:
+            raise ValueError("Unexpected preprocessing model columns.")
+
+        imputer, scaler = numeric.named_steps["imputer"], numeric.named_steps["scaler"]
+        fill, onehot = categorical.named_steps["imputer"], categorical.named_steps["onehot"]
+        if (
+            imputer.strategy != "median"
+            or not (scaler.with_mean and scaler.with_std)
+            or fill.strategy != "constant"
+            or onehot.handle_unknown != "ignore"
+            or onehot.drop is not None
+        ):
+            raise ValueError("Unexpected preprocessing model parameters.")
+
+        return cls(
+            imputer.statistics_,
+            scaler.mean_,
+            scaler.scale_,
+            onehot.categories_[0],
+            fill.fill_value,
+            preprocessor,
+        )
+
+    @classmethod
+    def load(cls, kernel_dir):
+        """Loads the flat arrays written by preprocess.py, memory mapped.
+
+        Worker processes on the same instance share the mapped pages, and
+        neither scikit-learn nor pickle is needed to load them.
+        """
+        arrays = {
+            name: np.load(os.path.join(kernel_dir, f"{name}.npy"), mmap_mode="r")
+            for name in ["medians", "means", "scales", "categories", "fill_value"]
+        }
+        return cls(
+            arrays["medians"],
+            arrays["means"],
+            arrays["scales"],
+            arrays["categories"].tolist(),
+            str(arrays["fill_value"]),
+        )
+
+    def transform(self, input_data):
+        """Transforms a RawBatch or a frame of raw rows."""
+        if isinstance(input_data, RawBatch):
+            sex, numeric = input_data.sex, input_data.numeric
+        else:
+            sex = input_data["sex"].to_numpy(dtype=object)
+            numeric = input_data[numeric_feature_names].to_numpy(dtype=np.float64)
+
+        features = np.zeros((len(sex), len(self.medians) + len(self.categories)))
+        scaled = features[:, :len(self.medians)]
+        np.copyto(scaled, numeric)
+        np.copyto(scaled, self.medians, where=np.isnan(scaled))
+        scaled -= self.means
+        scaled /= self.scales
+
+        lookup = self._lookup
+        fill_value = self.fill_value
+        codes = np.fromiter(
+            (lookup.get(fill_value if pd.isna(value) else value, -1) for value in sex),
+            dtype=np.int64,
+            count=len(sex),
+        )
+        known = codes >= 0
+        features[np.flatnonzero(known), len(self.medians) + codes[known]] = 1.0
+        return features
+
+class PredictionCache:
+    """Bounded LRU cache of the results of a model for raw rows.
+
+    Rows are keyed by the version of the model and their canonical bytes:
+    the sex category, and the float64 measurements with negative zeros and
+    NaN payloads normalized. The results of the rows that hit are gathered
+    from a table of cached rows with one indexing operation, and only the
+    distinct rows that miss are computed. ``bind`` empties the cache and
+    bumps its version, and model_fn calls it for every model it loads.
+    """
+
+    def __init__(self, max_rows=PREDICTION_CACHE_ROWS) -> None:
+        self.max_rows = max_rows
+        self.version = 0
+        self.model = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._slots = OrderedDict()
+        self._table = None
+
+    def bind(self, model):
+        """Caches the features of ``model``, dropping those of the previous model."""
+        with self._lock:
+            self.model = model
+            self.version += 1
+            self._clear()
+
+    def serves(self, model):
+        return self.max_rows > 0 and model is self.model
+
+    def keys(self, sex, numeric):
+        # adding zero turns -0.0 into 0.0, which the kernel scales the same
+        numeric = np.ascontiguousarray(numeric, dtype=np.float64) + 0.0
+        numeric[np.isnan(numeric)] = np.nan
+        rows = numeric.view(np.dtype((np.void, numeric.shape[1] * numeric.itemsize))).ravel().tolist()
+        categories = list(sex)
+        for row in np.flatnonzero(pd.isna(sex)):
+            categories[row] = None
+        return list(zip(itertools.repeat(self.version, len(rows)), categories, rows))
+
+    def transform(self, compute, input_data):
+        """Returns ``compute(input_data)`` for a RawBatch or a frame of raw rows.
+
+        ``compute`` returns a result per row, and is only called on the rows
+        that miss.
+        """
+        if isinstance(input_data, RawBatch):
+            sex, numeric = input_data.sex, input_data.numeric
+        else:
+            sex = input_data["sex"].to_numpy(dtype=object)
+            numeric = input_data[numeric_feature_names].to_numpy(dtype=np.float64)
+        if not len(sex):
+            return compute(input_data)
+        keys = self.keys(sex, numeric)
+
+        hit_rows, hit_slots, miss_rows, repeat_rows, repeat_of = [], [], [], [], []
+        pending = {}
+        with self._lock:
+            get, move_to_end = self._slots.get, self._slots.move_to_end
+            for row, key in enumerate(keys):
+                slot = get(key)
+                if slot is not None:
+                    move_to_end(key)
+                    hit_rows.append(row)
+                    hit_slots.append(slot)
+                elif key in pending:
+                    repeat_rows.append(row)
+                    repeat_of.append(pending[key])
+                else:
+                    pending[key] = len(miss_rows)
+                    miss_rows.append(row)
+            hits = self._table[hit_slots] if hit_rows else None
+            self.hits += len(keys) - len(miss_rows)
+            self.misses += len(miss_rows)
+
+        computed = None
+        if miss_rows:
+            if isinstance(input_data, RawBatch):
+                misses = RawBatch(sex[miss_rows], numeric[miss_rows], None)
+            else:
+                misses = input_data.iloc[miss_rows]
+            computed = compute(misses)
+            if hasattr(computed, "toarray"):
+                computed = computed.toarray()
+            computed = np.asarray(computed)
+
+        sample = hits if hits is not None else computed
+        results = np.empty((len(keys),) + sample.shape[1:], dtype=sample.dtype)
+        if hits is not None:
+            results[hit_rows] = hits
+        if computed is not None:
+            results[miss_rows] = computed
+            results[repeat_rows] = computed[repeat_of]
+            self._insert([keys[row] for row in miss_rows], computed)
+        return results
+
+    def _insert(self, keys, rows):
+        # a batch larger than the cache only leaves its last rows behind
+        keys, rows = keys[-self.max_rows:], rows[-self.max_rows:]
+        with self._lock:
+            if keys[0][0] != self.version:
+                # the model was replaced while these rows were transformed
+                return
+            if self._table is None:
+                self._table = np.empty((self.max_rows,) + rows.shape[1:], dtype=rows.dtype)
+            slots = self._slots
+            assigned = []
+            for key in keys:
+                slot = slots.get(key)
+                if slot is not None:
+                    slots.move_to_end(key)
+                elif len(slots) < self.max_rows:
+                    slot = slots[key] = len(slots)
+                else:
+                    _, slot = slots.popitem(last=False)
+                    slots[key] = slot
+                assigned.append(slot)
+            self._table[assigned] = rows
+
+    def stats(self):
+        return {
+            "metric": "transform_prediction_cache",
+            "version": self.version,
+            "rows": len(self._slots),
+            "max_rows": self.max_rows,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+prediction_cache = PredictionCache()
+
+def read_csv_frame(input_data):
+    """Reads the CSV payload with pandas, for input the fast parser rejects."""
+    df = pd.read_csv(StringIO(input_data),
+                     header=None)
+
+    # A labelled example includes the ring label as a ninth column.
+    return name_columns(df)
+
+def name_columns(df):
+    """Names the columns of a raw frame by position, like read_csv_frame."""
+    if len(df.columns) == len(feature_columns_names) + 1:
+        df.columns = feature_columns_names + [label_column]
+    elif len(df.columns) == len(feature_columns_names):
+        df.columns = feature_columns_names
+    return df
+
+def decode_csv(input_data):
+    if isinstance(input_data, bytes):
+        input_data = input_data.decode("utf-8")
+
+    batch = parse_csv(input_data)
+    if batch is not None:
+        return batch
+
+    # Read the raw input data as CSV.
+    return read_csv_frame(input_data)
+
+def decode_npy(input_data):
+    """Decodes an ``.npy`` payload without copying the array buffer.
+
+    Takes either a structured array with a field per column, or a two
+    dimensional string array with the columns in schema order. Object arrays
+    are rejected, since loading them would unpickle untrusted input.
+    """
+    stream = io.BytesIO(input_data)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if dtype.hasobject:
+        raise ValueError("Object arrays are not supported.")
+
+    array = np.frombuffer(
+        input_data, dtype=dtype, count=int(np.prod(shape)), offset=stream.tell()
+    ).reshape(shape, order="F" if fortran_order else "C")
+
+    if dtype.names is None:
+        batch = batch_from_rows(array.astype(str).tolist())
+        if batch is None:
+            raise ValueError(f"Unexpected array of shape {shape} and type {dtype}.")
+        return batch
+
+    return batch_from_records(array)
+
+def batch_from_records(array):
+    """Builds a RawBatch from a structured array with a field per column.
 
-    We currently only take csv input. Since we need to process both labelled
-    and unlabelled data we first determine whether the label column is present
-    by looking at how many columns were provided.
+    When the measurements are adjacent float64 fields, as written by numpy
+    for a record of the schema, they are viewed in place rather than copied.
     """
-    logger.info(f"input data {input_data} with format {content_type}")
+    sex = array["sex"]
+    if sex.dtype.kind == "S":
+        sex = np.char.decode(sex, "utf-8")
+    sex = sex.astype(object)
 
-    if content_type == 'text/csv':
-        # Read the raw input data as CSV.
-        df = pd.read_csv(StringIO(input_data), 
-                         header=None)
+    fields = [array.dtype.fields[name] for name in numeric_feature_names]
+    start = fields[0][1]
+    if array.ndim == 1 and array.flags.c_contiguous and all(
+        field_dtype == np.dtype(np.float64) and offset == start + 8 * index
+        for index, (field_dtype, offset) in enumerate(fields)
+    ):
+        rows = array.view(np.uint8).reshape(len(array), array.dtype.itemsize)
+        numeric = rows[:, start:start + 8 * len(fields)].view(np.float64)
+    else:
+        numeric = np.column_stack(
+            [array[name].astype(np.float64) for name in numeric_feature_names]
+        )
 
-        if len(df.columns) == len(feature_columns_names) + 1:
-            # This is a labelled example, includes the ring label
-            df.columns = feature_columns_names + [label_column]
-        elif len(df.columns) == len(feature_columns_names):
-            # This is an unlabelled example.
-            df.columns = feature_columns_names
+    label = None
+    if label_column in array.dtype.names:
+        label = array[label_column].astype(np.float64)
+    return RawBatch(sex, numeric, label)
 
+def decode_parquet(input_data):
+    df = pd.read_parquet(io.BytesIO(input_data))
+    if list(df.columns) in (feature_columns_names, feature_columns_names + [label_column]):
         return df
+    return name_columns(df)
+
+def decode_jsonlines(input_data):
+    """Decodes one JSON array, or JSON object keyed by column, per line."""
+    if isinstance(input_data, bytes):
+        input_data = input_data.decode("utf-8")
+
+    records = [json.loads(line) for line in input_data.splitlines() if line.strip()]
+    if records and all(isinstance(record, list) for record in records):
+        batch = batch_from_rows(records)
+        if batch is not None:
+            return batch
+        return name_columns(pd.DataFrame(records))
+    return pd.DataFrame.from_records(records)
+
+input_decoders = {
+    "text/csv": decode_csv,
+    "application/x-npy": decode_npy,
+    "application/x-parquet": decode_parquet,
+    "application/jsonlines": decode_jsonlines,
+}
+
+def encode_npy(prediction):
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(prediction), allow_pickle=False)
+    return buffer.getvalue()
+
+def encode_parquet(prediction):
+    prediction = np.asarray(prediction)
+    df = pd.DataFrame(prediction, columns=[str(index) for index in range(prediction.shape[1])])
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+def encode_jsonlines(prediction):
+    return "".join(json.dumps(row) + "\n" for row in np.asarray(prediction).tolist())
+
+def array_to_csv(array):
+    """Encodes an array to CSV with the csv module, like the container toolkit."""
+    stream = StringIO()
+    writer = csv.writer(
+        stream, lineterminator="\n", delimiter=",", quotechar='"', doublequote=True, strict=True
+    )
+    writer.writerows(array)
+    return stream.getvalue()
+
+def encode_csv_chunks(prediction, rows_per_chunk=CSV_CHUNK_ROWS):
+    """Encodes a prediction to CSV, yielding one chunk of rows at a time.
+
+    The output is byte for byte the one of the toolkit's CSV encoder, which
+    writes float64 values with ``repr``. Integer and float64 arrays are
+    converted to Python numbers in bulk and formatted with ``map(repr)``,
+    without a per value trip through the csv module. Other types go through
+    the csv module.
+    """
+    array = np.asarray(prediction)
+    if array.ndim == 1:
+        array = array.reshape(-1, 1)
+
+    fast = array.ndim == 2 and array.shape[1] > 0 and (
+        array.dtype.kind in "iu" or array.dtype == np.float64
+    )
+    for start in range(0, len(array), rows_per_chunk):
+        block = array[start:start + rows_per_chunk]
+        if not fast:
+            yield array_to_csv(block)
+            continue
+        values = map(repr, block.ravel().tolist())
+        rows = map(",".join, zip(*[values] * block.shape[1]))
+        yield "\n".join(rows) + "\n"
+
+def encode_csv(prediction):
+    """Encodes a prediction to CSV, streaming it when it spans several chunks."""
+    if len(prediction) <= CSV_CHUNK_ROWS:
+        return "".join(encode_csv_chunks(prediction))
+    return _count_bytes("output_fn", encode_csv_chunks(prediction))
+
+def _count_bytes(stage, chunks):
+    nbytes = 0
+    for chunk in chunks:
+        nbytes += len(chunk)
+        yield chunk
+    metrics.count_bytes(stage, nbytes)
+
+output_encoders = {
+    "text/csv": encode_csv,
+    "application/x-npy": encode_npy,
+    "application/x-parquet": encode_parquet,
+    "application/jsonlines": encode_jsonlines,
+}
+
+@instrumented("input_fn", lambda args, result: (_rows(result), len(args[0])))
+def input_fn(input_data, content_type):
+    """Parse input data payload
+
+    Takes csv, npy, parquet or json lines input. Since we need to process both
+    labelled and unlabelled data we first determine whether the label column
+    is present by looking at how many columns were provided.
+
+    Well formed rows are decoded by parse_csv, which avoids the set up cost
+    of the pandas parser on the small requests of real-time traffic.
+    """
+    if metrics.sample_payload():
+        logger.info("input data %s with format %s", input_data, content_type)
+
+    if content_type in input_decoders:
+        return input_decoders[content_type](input_data)
     else:
         raise ValueError("{} not supported by script!".format(content_type))
 
+@instrumented("output_fn", lambda args, result: (_rows(args[0]), _content_length(result)))
 def output_fn(prediction, accept):
     """Format prediction output.
-       XGBoost only support text/csv and text/libsvm. Use text/csv here. 
+       XGBoost only supports text/csv, text/libsvm and recordio-protobuf, so
+       text/csv is used unless TRANSFORM_OUTPUT_CONTENT_TYPE selects one of
+       the binary or json lines formats, for a consumer other than XGBoost.
+       The accept type is ignored: it is the format the client asked the
+       pipeline for, which the last container answers in, not the format
+       between the containers.
+
+       Returns the body and its content type, which the container turns
+       into the response. Large CSV bodies are generators, so the response
+       is streamed in chunks instead of being built in memory.
     """
-    logger.info(f"output data {prediction}")
+    if metrics.sample_payload():
+        logger.info("output data %s", prediction)
 
-    return worker.Response(encoders.encode(prediction, XGBOOST_CONTENT_TYPE), XGBOOST_CONTENT_TYPE, mimetype=XGBOOST_CONTENT_TYPE)
+    content_type = OUTPUT_CONTENT_TYPE
+    return output_encoders[content_type](prediction), content_type
 
+@instrumented("predict_fn", lambda args, result: (_rows(result), 0))
 def predict_fn(input_data, model):
     """Preprocess input data
 
@@ -84,19 +737,56 @@ def predict_fn(input_data, model):
     The output is returned in the following order:
 
         rest of features either one hot encoded or standardized
+
+    When TRANSFORM_PREDICTION_CACHE_ROWS is set, the features of rows seen
+    before come from the prediction cache.
     """
-    features = model.transform(input_data)
+    if isinstance(input_data, RawBatch):
+        labels = input_data.label
+        if not isinstance(model, CompiledPreprocessor):
+            input_data = input_data.to_frame()
+    else:
+        labels = input_data[label_column] if label_column in input_data else None
+
+    if prediction_cache.serves(model):
+        features = prediction_cache.transform(model.transform, input_data)
+    else:
+        features = model.transform(input_data)
 
-    if label_column in input_data:
+    if labels is not None:
         # Return the label (as the first column) and the set of features.
-        return np.insert(features, 0, input_data[label_column], axis=1)
+        return np.insert(features, 0, labels, axis=1)
     else:
         # Return only the set of features
         return features
 
+def warm_up(model):
+    """Runs a synthetic row through parsing, prediction and encoding."""
+    row = ",".join(["M"] + ["0.5"] * len(numeric_feature_names))
+    prediction = predict_fn.__wrapped__(input_fn.__wrapped__(row, "text/csv"), model)
+    output_encoders[OUTPUT_CONTENT_TYPE](prediction)
+
+@instrumented("model_fn")
 def model_fn(model_dir):
     """Deserialize fitted model
+
+    Loads the flat kernel arrays when the artifact has them. Otherwise the
+    fitted preprocessor is memory mapped from model.joblib and compiled into
+    a CompiledPreprocessor, unless its layout is not the one written by
+    preprocess.py.
     """
-    preprocessor = joblib.load(os.path.join(model_dir, "model.joblib"))
-    return preprocessor
-  
\ No newline at end of file
+    kernel_dir = os.path.join(model_dir, "kernel")
+    if os.path.isdir(kernel_dir):
+        model = CompiledPreprocessor.load(kernel_dir)
+    else:
+        preprocessor = joblib.load(os.path.join(model_dir, "model.joblib"), mmap_mode="r")
+        try:
+            model = CompiledPreprocessor.compile(preprocessor)
+        except (AttributeError, KeyError, ValueError) as e:
+            logger.warning("Serving the preprocessor without compiling it: %s", e)
+            model = preprocessor
+
+    if WARMUP:
+        warm_up(model)
+    prediction_cache.bind(model)
+    return model
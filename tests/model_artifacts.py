@@ -0,0 +1,50 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+"""Pipeline artifacts fitted on synthetic data, shared by the serving tests."""
+import os
+import pickle
+import tarfile
+
+import numpy as np
+import pandas as pd
+import xgboost
+
+from preprocess import DataProcessor, feature_columns_names, label_column
+
+def fit_artifacts(base_dir, features=None):
+    """Writes the preprocessing and training model.tar.gz of a pipeline run."""
+    rng = np.random.default_rng(23)
+    df = pd.DataFrame(rng.random((500, 8)), columns=feature_columns_names[1:] + [label_column])
+    df.insert(0, "sex", rng.choice(["M", "F", "I"], 500))
+    df[label_column] = (df[label_column] * 20).round()
+    data_processor = DataProcessor(df)
+    data = data_processor.process()
+
+    preprocess_dir = os.path.join(base_dir, "preprocess")
+    os.makedirs(preprocess_dir)
+    data_processor.save_model(preprocess_dir)
+
+    X = data[:, 1:] if features is None else data[:, 1:features + 1]
+    booster = xgboost.train(
+        {"max_depth": 5, "eta": 0.2, "subsample": 0.7}, xgboost.DMatrix(X, label=data[:, 0]), 20
+    )
+    model_dir = os.path.join(base_dir, "model")
+    os.makedirs(model_dir)
+    with open(os.path.join(model_dir, "xgboost-model"), "wb") as f:
+        pickle.dump(booster, f)
+    with tarfile.open(os.path.join(model_dir, "model.tar.gz"), "w:gz") as tar:
+        tar.add(os.path.join(model_dir, "xgboost-model"), arcname="xgboost-model")
+    return preprocess_dir, model_dir
@@ -0,0 +1,108 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+import io
+import os
+import tarfile
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import xgboost
+
+import serve
+from batch_score import csv_chunks, run_main, score
+from model_artifacts import fit_artifacts
+from package_model import run_main as package
+from preprocess import feature_columns_names
+
+class TestBatchScore(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        base_dir = tempfile.mkdtemp()
+        fit_artifacts(base_dir)
+        package(["--base-dir", base_dir])
+        cls.model_path = os.path.join(base_dir, "fused", "model.tar.gz")
+        cls.model_dir = tempfile.mkdtemp()
+        with tarfile.open(cls.model_path) as tar:
+            tar.extractall(cls.model_dir)
+        cls.model = serve.model_fn(cls.model_dir)
+
+        rng = np.random.default_rng(31)
+        df = pd.DataFrame(rng.random((2000, 7)), columns=feature_columns_names[1:])
+        df.insert(0, "sex", rng.choice(["M", "F", "I"], 2000).astype(object))
+        df.loc[1500::7, "height"] = np.nan
+        df.loc[1500::11, "sex"] = np.nan
+        cls.frame = df
+        cls.expected = serve.predict_fn(df, cls.model)
+
+    def read_predictions(self, path):
+        with open(path) as f:
+            return np.array(f.read().split(), dtype=np.float32)
+
+    def test_csv_chunks_cover_whole_lines(self):
+        path = os.path.join(tempfile.mkdtemp(), "abalone.csv")
+        self.frame.to_csv(path, header=False, index=False)
+        with open(path, "rb") as f:
+            data = f.read()
+
+        chunks = list(csv_chunks(path, chunk_bytes=1000))
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual(b"".join(data[c.start:c.start + c.length] for c in chunks), data)
+        for chunk in chunks:
+            self.assertTrue(data[chunk.start:chunk.start + chunk.length].endswith(b"\n"))
+
+    def test_csv_predictions_in_input_order(self):
+        work_dir = tempfile.mkdtemp()
+        path = os.path.join(work_dir, "abalone.csv")
+        self.frame.to_csv(path, header=False, index=False)
+        # without the trailing line end, followed by a second file
+        with open(path, "rb+") as f:
+            f.truncate(os.path.getsize(path) - 1)
+        second = os.path.join(work_dir, "more.csv")
+        self.frame.head(10).to_csv(second, header=False, index=False)
+
+        for workers in [1, 2]:
+            output = os.path.join(work_dir, f"predictions-{workers}.csv")
+            run_main(
+                [
+                    "--model", self.model_path,
+                    "--input", path, second,
+                    "--output", output,
+                    "--workers", str(workers),
+                    "--chunk-bytes", "4096",
+                ]
+            )
+            with self.subTest(workers=workers):
+                np.testing.assert_array_equal(
+                    self.read_predictions(output), np.concatenate([self.expected, self.expected[:10]])
+                )
+
+    def test_parquet_row_groups(self):
+        path = os.path.join(tempfile.mkdtemp(), "abalone.parquet")
+        self.frame.to_parquet(path, index=False, row_group_size=300)
+        output = io.StringIO()
+        with patch.object(xgboost.Booster, "set_param", autospec=True) as set_param:
+            rows = score([path], self.model_dir, output, workers=1)
+
+        # a single worker predicts with all the cores
+        set_param.assert_not_called()
+
+        self.assertEqual(rows, len(self.frame))
+        np.testing.assert_array_equal(
+            np.array(output.getvalue().split(), dtype=np.float32), self.expected
+        )
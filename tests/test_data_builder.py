@@ -0,0 +1,300 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import boto3
+import numpy as np
+import pandas as pd
+from botocore.client import BaseClient
+from moto import mock_aws
+from preprocess import (
+    DataBuilder,
+    DataProcessor,
+    ManifestCache,
+    PreprocessingState,
+    fold_manifest,
+    run_main,
+    run_streaming,
+)
+
+BUCKET = "abalone-data"
+
+class TestDataBuilder(TestCase):
+    def setUp(self):
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+        self._mock = mock_aws()
+        self._mock.start()
+        self._s3 = boto3.client("s3")
+        self._s3.create_bucket(Bucket=BUCKET)
+        self._base_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self._mock.stop()
+
+    def _put_partitions(self, count):
+        entries = []
+        for index in range(count):
+            key = f"daily/{index:03d}.csv"
+            body = f"M,{index},0.3,1,0.3,2,1,0,{index}\nF,{index},0.2,2,0.2,1,3,0,{index}\n"
+            self._s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+            entries.append({"bucketName": BUCKET, "objectKey": key})
+        return json.dumps({"data": entries})
+
+    def test_build_keeps_manifest_order(self):
+        manifest = self._put_partitions(20)
+        df = DataBuilder(self._base_dir, manifest, max_workers=8).build()
+
+        self.assertEqual(len(df), 40)
+        self.assertEqual(df["length"].tolist(), [float(i // 2) for i in range(40)])
+        self.assertEqual(df["sex"].tolist()[:2], ["M", "F"])
+        self.assertEqual(os.listdir(os.path.join(self._base_dir, "data")), [])
+
+    def test_build_single_worker_matches_pool(self):
+        manifest = self._put_partitions(5)
+        serial = DataBuilder(self._base_dir, manifest, max_workers=1).build()
+        pooled = DataBuilder(self._base_dir, manifest, max_workers=4).build()
+
+        self.assertTrue(serial.equals(pooled))
+
+    def test_run_streaming_writes_every_row_once(self):
+        manifest = self._put_partitions(10)
+        run_streaming(DataBuilder(self._base_dir, manifest), self._base_dir, 3)
+
+        splits = [
+            pd.read_csv(os.path.join(self._base_dir, name, f"{name}.csv"), header=None)
+            for name in ["train", "validation", "test"]
+            if os.path.getsize(os.path.join(self._base_dir, name, f"{name}.csv"))
+        ]
+        output = pd.concat(splits).to_numpy()
+        self.assertEqual(output.shape, (20, 10))
+
+        expected = DataProcessor(DataBuilder(self._base_dir, manifest).build()).process()
+        np.testing.assert_allclose(
+            np.sort(output, axis=0), np.sort(expected, axis=0), rtol=1e-9, atol=1e-9
+        )
+        self.assertEqual(os.listdir(os.path.join(self._base_dir, "data")), [])
+
+    def _run_sharded(self, manifest, hosts, state_uri, argv=()):
+        for mode in ["statistics", "transform"]:
+            for rank in range(hosts):
+                run_main([
+                    "--data-manifest", manifest, "--base-dir", self._base_dir, "--mode", mode,
+                    "--host-rank", str(rank), "--host-count", str(hosts), "--state-uri", state_uri,
+                    *argv,
+                ])
+
+    def test_sharded_preprocessing_matches_single_host(self):
+        from evaluate import read_split
+
+        manifest = json.loads(self._put_partitions(7))
+        state_uri = os.path.join(self._base_dir, "state.joblib")
+        os.makedirs(os.path.join(self._base_dir, "model"))
+        self._run_sharded(json.dumps({"data": manifest["data"][:5]}), 3, state_uri)
+        # the second run only reads the two new entries and merges the state
+        self._run_sharded(json.dumps(manifest), 3, state_uri)
+
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self._base_dir, "train"))),
+            ["train-0.csv", "train-1.csv", "train-2.csv"],
+        )
+        self.assertTrue(os.path.exists(os.path.join(self._base_dir, "model", "model.tar.gz")))
+        self.assertEqual(PreprocessingState.load(state_uri).statistics.rows, 14)
+
+        output = []
+        for name in ["train", "validation", "test"]:
+            try:
+                output.append(np.column_stack(read_split(os.path.join(self._base_dir, name), name)))
+            except FileNotFoundError:
+                # a split can be empty with so few rows
+                pass
+        output = np.concatenate(output)
+        df = DataBuilder(self._base_dir, json.dumps(manifest)).build()
+        expected = DataProcessor(df).process()
+        np.testing.assert_allclose(
+            np.sort(output, axis=0), np.sort(expected, axis=0), rtol=1e-9, atol=1e-9
+        )
+
+    def test_all_mode_rejects_several_hosts(self):
+        manifest = self._put_partitions(2)
+        argv = ["--data-manifest", manifest, "--base-dir", self._base_dir]
+        with patch("preprocess.host_rank", return_value=(1, 2)), patch.object(
+            DataBuilder, "build_frames"
+        ) as build_frames:
+            with self.assertRaises(ValueError):
+                run_main(argv)
+            with self.assertRaises(ValueError):
+                run_main(argv + ["--host-rank", "0", "--host-count", "2"])
+
+        build_frames.assert_not_called()
+
+    def test_host_arguments_are_validated(self):
+        manifest = self._put_partitions(1)
+        argv = ["--data-manifest", manifest, "--base-dir", self._base_dir, "--mode", "statistics"]
+        for hosts in [
+            ["--host-rank", "1"],
+            ["--host-count", "2"],
+            ["--host-rank", "2", "--host-count", "2"],
+            ["--host-rank", "-1", "--host-count", "2"],
+        ]:
+            with self.subTest(hosts=hosts), patch("sys.stderr"):
+                with self.assertRaises(SystemExit):
+                    run_main(argv + hosts)
+
+    def _fold(self, manifest, state):
+        data_builder = DataBuilder(self._base_dir, manifest)
+        frames = data_builder.build_frames()
+        read = []
+        state = fold_manifest(
+            state, data_builder.entries(), lambda index: read.append(index) or [frames[index]]
+        )
+        return state, read
+
+    def test_incremental_fit_matches_full_fit(self):
+        manifest = json.loads(self._put_partitions(6))
+        history = json.dumps({"data": manifest["data"][:4]})
+        state, read = self._fold(history, PreprocessingState())
+        path = os.path.join(self._base_dir, PreprocessingState.file_name)
+        state.save(path)
+
+        state, read = self._fold(json.dumps(manifest), PreprocessingState.load(path))
+        self.assertEqual(read, [4, 5])
+
+        df = DataBuilder(self._base_dir, json.dumps(manifest)).build()
+        incremental = DataProcessor(statistics=state.statistics).transform(df)
+        expected = DataProcessor(df.copy()).process()
+        np.testing.assert_allclose(incremental, expected, rtol=1e-9, atol=1e-9)
+
+    def test_incremental_fit_rebuilds_on_changed_entry(self):
+        manifest = self._put_partitions(3)
+        state, _ = self._fold(manifest, PreprocessingState())
+
+        self._s3.put_object(Bucket=BUCKET, Key="daily/001.csv", Body="I,9,0.3,1,0.3,2,1,0,9\n")
+        state, read = self._fold(manifest, state)
+
+        self.assertEqual(read, [0, 1, 2])
+        self.assertEqual(state.statistics.rows, 5)
+
+    def test_cache_hit_skips_download(self):
+        manifest = self._put_partitions(3)
+        cache = ManifestCache(os.path.join(self._base_dir, "cache"))
+        first = DataBuilder(self._base_dir, manifest, cache=cache).build()
+
+        data_builder = DataBuilder(self._base_dir, manifest, cache=cache)
+        with patch.object(data_builder.s3_client, "download_file") as download_file:
+            second = data_builder.build()
+
+        download_file.assert_not_called()
+        self.assertTrue(first.equals(second))
+
+    def _api_calls(self, fn):
+        """Runs ``fn``, returning the operation names called by every S3 client."""
+        calls = []
+        make_api_call = BaseClient._make_api_call
+
+        def record(client, operation_name, api_params):
+            calls.append(operation_name)
+            return make_api_call(client, operation_name, api_params)
+
+        with patch.object(BaseClient, "_make_api_call", record):
+            fn()
+        return calls
+
+    def _count_get_object(self, fn):
+        return self._api_calls(fn).count("GetObject")
+
+    def test_cache_requests_each_object_once(self):
+        manifest = self._put_partitions(2)
+        cache = ManifestCache(os.path.join(self._base_dir, "cache"))
+
+        def build():
+            DataBuilder(self._base_dir, manifest, cache=cache).build()
+
+        self.assertEqual(sorted(self._api_calls(build)), ["GetObject", "GetObject", "HeadObject", "HeadObject"])
+        self.assertEqual(self._api_calls(build), ["HeadObject", "HeadObject"])
+
+    def test_cache_round_trips_frames_without_pickle(self):
+        self._s3.put_object(
+            Bucket=BUCKET, Key="daily/000.csv", Body="M,1,0.3,1,0.3,2,1,0,1\n,2,,2,0.2,1,3,0,2\n"
+        )
+        manifest = json.dumps({"data": [{"bucketName": BUCKET, "objectKey": "daily/000.csv"}]})
+        cache = ManifestCache(os.path.join(self._base_dir, "cache"))
+        first = DataBuilder(self._base_dir, manifest, cache=cache).build()
+        second = DataBuilder(self._base_dir, manifest, cache=cache).build()
+
+        (entry,) = os.listdir(os.path.join(self._base_dir, "cache"))
+        with np.load(os.path.join(self._base_dir, "cache", entry), allow_pickle=False) as data:
+            self.assertTrue(all(data[name].dtype != object for name in data.files))
+        pd.testing.assert_frame_equal(first, second)
+
+    def test_cache_hit_skips_chunked_downloads(self):
+        manifest = self._put_partitions(4)
+        cache_dir = os.path.join(self._base_dir, "cache")
+        os.makedirs(os.path.join(self._base_dir, "model"))
+        runs = {
+            "streaming": lambda: run_main([
+                "--data-manifest", manifest, "--base-dir", self._base_dir,
+                "--chunk-size", "3", "--cache-dir", cache_dir,
+            ]),
+            "sharded": lambda: self._run_sharded(
+                manifest, 2, os.path.join(self._base_dir, "state.joblib"), ["--cache-dir", cache_dir]
+            ),
+        }
+        for name, run in runs.items():
+            with self.subTest(name):
+                self.assertEqual(self._count_get_object(run), 4)
+                train_dir = os.path.join(self._base_dir, "train")
+                train = os.path.join(train_dir, sorted(os.listdir(train_dir))[0])
+                with open(train) as f:
+                    expected = f.read()
+
+                self.assertEqual(self._count_get_object(run), 0)
+                with open(train) as f:
+                    self.assertEqual(f.read(), expected)
+                self.assertEqual(os.listdir(os.path.join(self._base_dir, "data")), [])
+            shutil.rmtree(cache_dir)
+
+    def test_cache_misses_on_changed_object(self):
+        manifest = self._put_partitions(1)
+        cache = ManifestCache(os.path.join(self._base_dir, "cache"))
+        DataBuilder(self._base_dir, manifest, cache=cache).build()
+
+        self._s3.put_object(Bucket=BUCKET, Key="daily/000.csv", Body="I,9,0.3,1,0.3,2,1,0,9\n")
+        df = DataBuilder(self._base_dir, manifest, cache=cache).build()
+
+        self.assertEqual(df["sex"].tolist(), ["I"])
+
+    def test_cache_evicts_least_recently_used(self):
+        manifest = self._put_partitions(1)
+        df = DataBuilder(self._base_dir, manifest).build()
+        cache = ManifestCache(os.path.join(self._base_dir, "cache"))
+        cache.put(BUCKET, "key-0", "etag", df)
+        entry_size = os.path.getsize(cache._path(BUCKET, "key-0", "etag"))
+
+        cache = ManifestCache(os.path.join(self._base_dir, "cache"), max_bytes=2 * entry_size)
+        cache.put(BUCKET, "key-1", "etag", df)
+        for index in range(2):
+            os.utime(cache._path(BUCKET, f"key-{index}", "etag"), (index, index))
+        cache.get(BUCKET, "key-0", "etag")
+        cache.put(BUCKET, "key-2", "etag", df)
+
+        self.assertIsNotNone(cache.get(BUCKET, "key-0", "etag"))
+        self.assertIsNone(cache.get(BUCKET, "key-1", "etag"))
+        self.assertIsNotNone(cache.get(BUCKET, "key-2", "etag"))
@@ -0,0 +1,255 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import xgboost
+from evaluate import (
+    BootstrapMetrics,
+    InplacePredictor,
+    RegressionMetrics,
+    compare_models,
+    evaluate,
+    evaluate_models,
+    evaluate_progressively,
+    iter_split,
+    read_split,
+)
+from preprocess import open_split_writers, split_writers
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+class TestEvaluate(TestCase):
+    def test_read_split_round_trips_every_output_format(self):
+        rng = np.random.default_rng(3)
+        data = rng.normal(size=(50, 11))
+        data[:, 0] = rng.integers(1, 29, 50)
+        data[:, 8:] = np.eye(3)[rng.integers(0, 3, 50)]
+
+        for output_format in split_writers:
+            with self.subTest(output_format=output_format):
+                base_dir = tempfile.mkdtemp()
+                writers = open_split_writers(base_dir, output_format)
+                for writer in writers:
+                    writer.write(data[:20])
+                    writer.write(data[20:])
+                    writer.close()
+
+                y, X = read_split(f"{base_dir}/test")
+                X = X.toarray() if hasattr(X, "toarray") else np.asarray(X)
+                self.assertEqual(X.shape[0], 50)
+                np.testing.assert_array_equal(y, data[:, 0])
+                np.testing.assert_allclose(X, data[:, 1:X.shape[1] + 1], rtol=1e-6)
+
+    def test_empty_split_keeps_its_width(self):
+        for output_format in split_writers:
+            with self.subTest(output_format=output_format):
+                base_dir = tempfile.mkdtemp()
+                writers = open_split_writers(base_dir, output_format, columns=11)
+                for writer in writers:
+                    writer.close()
+
+                path = f"{base_dir}/test/test.{output_format}"
+                self.assertTrue(os.path.exists(path))
+                if output_format in ("parquet", "npy"):
+                    y, X = read_split(f"{base_dir}/test")
+                    self.assertEqual(y.shape, (0,))
+                    self.assertEqual(X.shape, (0, 10))
+                    self.assertEqual(list(iter_split(f"{base_dir}/test", 64)), [])
+
+    def test_streamed_metrics_match_full_pass(self):
+        rng = np.random.default_rng(5)
+        y = rng.integers(1, 29, 10000).astype(float)
+        predictions = y + rng.normal(scale=2, size=len(y))
+
+        metrics = RegressionMetrics()
+        for start in range(0, len(y), 777):
+            metrics.update(y[start:start + 777], predictions[start:start + 777])
+        report = metrics.report()
+
+        regression = report["regression_metrics"]
+        self.assertAlmostEqual(regression["mse"]["value"], mean_squared_error(y, predictions))
+        self.assertAlmostEqual(regression["mse"]["standard_deviation"], np.std(y - predictions))
+        self.assertAlmostEqual(regression["mae"]["value"], mean_absolute_error(y, predictions))
+        self.assertAlmostEqual(regression["r2"]["value"], r2_score(y, predictions))
+        self.assertEqual(report["test_rows"], len(y))
+        for name, q in [("p05", 0.05), ("p50", 0.5), ("p95", 0.95)]:
+            self.assertAlmostEqual(
+                report["residual_quantiles"][name], np.quantile(y - predictions, q), delta=0.05
+            )
+
+    def test_report_rejects_empty_test_split(self):
+        metrics = RegressionMetrics(BootstrapMetrics(10))
+        metrics.update(np.empty(0), np.empty(0))
+        with self.assertRaisesRegex(ValueError, "no rows evaluated"):
+            metrics.report()
+
+    def test_blocked_evaluation_matches_every_output_format(self):
+        rng = np.random.default_rng(7)
+        data = rng.normal(size=(300, 11))
+        data[:, 0] = rng.integers(1, 29, 300)
+        data[:, 8:] = np.eye(3)[rng.integers(0, 3, 300)]
+        model = xgboost.train(
+            {"objective": "reg:squarederror"},
+            xgboost.DMatrix(data[:, 1:], label=data[:, 0]),
+            num_boost_round=5,
+        )
+
+        for output_format in split_writers:
+            with self.subTest(output_format=output_format):
+                base_dir = tempfile.mkdtemp()
+                writers = open_split_writers(base_dir, output_format)
+                for writer in writers:
+                    writer.write(data)
+                    writer.close()
+
+                y, X = read_split(f"{base_dir}/test")
+                predictions = model.predict(xgboost.DMatrix(X))
+
+                predictor = InplacePredictor(model, nthread=2)
+                report = evaluate(predictor, iter_split(f"{base_dir}/test", 64)).report()
+                regression = report["regression_metrics"]
+                self.assertEqual(report["test_rows"], 300)
+                self.assertAlmostEqual(regression["mse"]["value"], mean_squared_error(y, predictions), places=4)
+                self.assertAlmostEqual(regression["r2"]["value"], r2_score(y, predictions), places=4)
+
+    def test_libsvm_training_matches_dense_predictions(self):
+        rng = np.random.default_rng(5)
+        data = rng.normal(size=(300, 11))
+        data[:, 0] = rng.integers(1, 29, 300)
+        data[::3, 1:4] = 0
+        data[:, 8:] = np.eye(3)[rng.integers(0, 3, 300)]
+        base_dir = tempfile.mkdtemp()
+        writers = open_split_writers(base_dir, "libsvm")
+        for writer in writers:
+            writer.write(data)
+            writer.close()
+
+        params = {"objective": "reg:squarederror", "tree_method": "exact"}
+        dense = xgboost.train(params, xgboost.DMatrix(data[:, 1:], label=data[:, 0]), num_boost_round=5)
+        libsvm = xgboost.train(
+            params, xgboost.DMatrix(f"{base_dir}/train/train.libsvm?format=libsvm"), num_boost_round=5
+        )
+
+        X = np.ascontiguousarray(data[:, 1:])
+        np.testing.assert_allclose(libsvm.inplace_predict(X), dense.inplace_predict(X), rtol=1e-6)
+
+    def test_inplace_predictor_matches_dmatrix_predictions(self):
+        rng = np.random.default_rng(11)
+        X = rng.normal(size=(1000, 10))
+        model = xgboost.train(
+            {"objective": "reg:squarederror"},
+            xgboost.DMatrix(X, label=rng.normal(size=1000)),
+            num_boost_round=10,
+        )
+        expected = model.predict(xgboost.DMatrix(X))
+
+        for workers in [1, 3]:
+            with self.subTest(workers=workers):
+                predictor = InplacePredictor(model, nthread=4, workers=workers, block_rows=128)
+                np.testing.assert_allclose(predictor.predict(X), expected, rtol=1e-6)
+                predictor.close()
+
+    def test_champion_and_challenger_share_the_test_blocks(self):
+        rng = np.random.default_rng(13)
+        X = rng.normal(size=(500, 10))
+        y = X[:, 0] * 3 + rng.normal(scale=0.1, size=500)
+        train = xgboost.DMatrix(X, label=y)
+        params = {"objective": "reg:squarederror"}
+        boosters = {
+            "champion": xgboost.train(params, train, num_boost_round=2),
+            "challenger": xgboost.train(params, train, num_boost_round=20),
+        }
+        blocks = [(y[start:start + 100], X[start:start + 100]) for start in range(0, 500, 100)]
+
+        predictors = {name: InplacePredictor(booster, nthread=1) for name, booster in boosters.items()}
+        report = compare_models(evaluate_models(predictors, iter(blocks)))
+
+        for name, booster in boosters.items():
+            expected = mean_squared_error(y, booster.predict(xgboost.DMatrix(X)))
+            self.assertAlmostEqual(report["models"][name]["regression_metrics"]["mse"]["value"], expected, places=5)
+        self.assertEqual(report["regression_metrics"], report["models"]["challenger"]["regression_metrics"])
+        improvement = report["champion_comparison"]["mse_improvement"]["value"]
+        self.assertGreater(improvement, 0)
+        self.assertAlmostEqual(
+            improvement,
+            report["models"]["champion"]["regression_metrics"]["mse"]["value"]
+            - report["regression_metrics"]["mse"]["value"],
+        )
+
+        report = compare_models(evaluate_models({"challenger": predictors["challenger"]}, iter(blocks)))
+        self.assertNotIn("champion_comparison", report)
+
+    def test_bootstrap_intervals_cover_metrics_and_ignore_batching(self):
+        rng = np.random.default_rng(17)
+        y = rng.integers(1, 29, 20000).astype(float)
+        predictions = y + rng.normal(scale=2, size=len(y))
+
+        reports = []
+        for max_bytes, threads in [(1 << 30, 1), (1 << 20, 3)]:
+            metrics = RegressionMetrics(BootstrapMetrics(200, seed=1, max_bytes=max_bytes, threads=threads))
+            for start in range(0, len(y), 5000):
+                metrics.update(y[start:start + 5000], predictions[start:start + 5000])
+            reports.append(metrics.report())
+
+        regression = reports[0]["regression_metrics"]
+        for name in ["mse", "mae", "r2"]:
+            interval = regression[name]["confidence_interval"]
+            other = reports[1]["regression_metrics"][name]["confidence_interval"]
+            np.testing.assert_allclose(
+                [interval["lower"], interval["upper"]], [other["lower"], other["upper"]], rtol=1e-5
+            )
+            self.assertLess(interval["lower"], regression[name]["value"])
+            self.assertGreater(interval["upper"], regression[name]["value"])
+
+        # the standard error of the mean of the squared residuals
+        squared = (y - predictions) ** 2
+        standard_error = np.std(squared) / np.sqrt(len(y))
+        width = regression["mse"]["confidence_interval"]["upper"] - regression["mse"]["confidence_interval"]["lower"]
+        self.assertAlmostEqual(width / (2 * 1.96 * standard_error), 1, delta=0.2)
+
+    def test_progressive_evaluation_stops_early_only_for_bad_models(self):
+        rng = np.random.default_rng(19)
+        data = rng.normal(size=(20000, 11))
+        data[:, 0] = data[:, 1] * 3 + rng.normal(scale=0.5, size=len(data))
+        base_dir = tempfile.mkdtemp()
+        writers = open_split_writers(base_dir, "npy")
+        for writer in writers:
+            writer.write(data)
+            writer.close()
+
+        train = xgboost.DMatrix(data[:, 1:], label=data[:, 0])
+        good = xgboost.train({"objective": "reg:squarederror"}, train, num_boost_round=20)
+        bad = xgboost.train({"objective": "reg:squarederror", "eta": 0.01}, train, num_boost_round=2)
+
+        def make_metrics():
+            return RegressionMetrics(BootstrapMetrics(200))
+
+        for booster, fraction in [(good, 1.0), (bad, 0.05)]:
+            with self.subTest(fraction=fraction):
+                metrics, evaluated = evaluate_progressively(
+                    {"challenger": InplacePredictor(booster, nthread=1)},
+                    f"{base_dir}/test",
+                    4096,
+                    make_metrics,
+                    mse_threshold=1.0,
+                )
+                self.assertEqual(evaluated, fraction)
+                self.assertAlmostEqual(metrics["challenger"].count / len(data), fraction, delta=0.01)
+                if fraction == 1.0:
+                    expected = mean_squared_error(data[:, 0], booster.predict(xgboost.DMatrix(data[:, 1:])))
+                    self.assertAlmostEqual(metrics["challenger"].mean_squared, expected, places=4)
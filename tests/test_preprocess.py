@@ -18,6 +18,9 @@ import pandas as pd
 import numpy as np
 from preprocess import (
     DataProcessor,
+    FeatureStatistics,
+    QuantileSketch,
+    SplitAssigner,
     feature_columns_names,
     label_column,
     feature_columns_dtype,
@@ -47,3 +50,47 @@ class TestPreProcess(TestCase):
         round_output = np.around(output_data, 2)
         np.testing.assert_array_equal(round_output, expected_output)
 
+
+    def test_statistics_fit_matches_in_memory_fit(self):
+        rng = np.random.default_rng(7)
+        input_df = pd.DataFrame(rng.random((500, 8)), columns=feature_columns_names[1:] + [label_column])
+        input_df.insert(0, "sex", rng.choice(["M", "F", "I"], 500))
+        input_df.loc[::17, "length"] = np.nan
+        input_df.loc[::23, "sex"] = np.nan
+
+        statistics = FeatureStatistics()
+        for start in range(0, len(input_df), 64):
+            statistics.update(input_df.iloc[start:start + 64])
+
+        streamed = DataProcessor(statistics=statistics).transform(input_df)
+        expected = DataProcessor(input_df.copy()).process()
+        np.testing.assert_allclose(streamed, expected, rtol=1e-9, atol=1e-9)
+
+    def test_quantile_sketch_merge_is_approximate_median(self):
+        values = np.random.default_rng(11).normal(size=100_000)
+        sketches = [QuantileSketch(size=256) for _ in range(4)]
+        for index, part in enumerate(np.array_split(values, 4)):
+            sketches[index].update(part)
+        merged = sketches[0]
+        for sketch in sketches[1:]:
+            merged.merge(sketch)
+
+        self.assertEqual(merged.count, len(values))
+        self.assertAlmostEqual(merged.quantile(0.5), np.median(values), delta=0.02)
+
+    def test_split_assignment_is_stable(self):
+        rng = np.random.default_rng(5)
+        input_df = pd.DataFrame(rng.random((10_000, 8)), columns=feature_columns_names[1:] + [label_column])
+        input_df.insert(0, "sex", rng.choice(["M", "F", "I"], 10_000))
+
+        assignments = SplitAssigner(seed=1).assign(input_df)
+        chunked = np.concatenate(
+            [SplitAssigner(seed=1).assign(input_df.iloc[start:start + 999]) for start in range(0, 10_000, 999)]
+        )
+        order = rng.permutation(10_000)
+        shuffled = SplitAssigner(seed=1).assign(input_df.iloc[order])
+
+        np.testing.assert_array_equal(assignments, chunked)
+        np.testing.assert_array_equal(assignments[order], shuffled)
+        np.testing.assert_allclose(np.bincount(assignments) / 10_000, [0.7, 0.15, 0.15], atol=0.02)
+        self.assertFalse(np.array_equal(assignments, SplitAssigner(seed=2).assign(input_df)))
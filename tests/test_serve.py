@@ -0,0 +1,161 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+import io
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tarfile
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import xgboost
+
+import serve
+import transform
+from model_artifacts import fit_artifacts
+from package_model import package_model, run_main
+from preprocess import feature_columns_names, label_column
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "ml_pipeline"))
+
+from pipeline_config import fused_source_dir  # noqa: E402
+
+def two_container_predict(preprocessor, booster, payload, content_type):
+    """Serves a request like the transform container followed by the XGBoost container."""
+    features = transform.predict_fn(transform.input_fn(payload, content_type), preprocessor)
+    body, _ = transform.output_fn(features, "text/csv")
+    # the XGBoost container parses the CSV values as floats into a DMatrix
+    rows = [row.split(",") for row in body.split("\n") if row]
+    return booster.predict(xgboost.DMatrix(np.array(rows).astype(np.float64)))
+
+class TestServe(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        base_dir = tempfile.mkdtemp()
+        preprocess_dir, model_dir = fit_artifacts(base_dir)
+        run_main(["--base-dir", base_dir])
+
+        cls.fused_dir = tempfile.mkdtemp()
+        with tarfile.open(os.path.join(base_dir, "fused", "model.tar.gz")) as tar:
+            tar.extractall(cls.fused_dir)
+        cls.model = serve.model_fn(cls.fused_dir)
+        cls.preprocessor = transform.model_fn(preprocess_dir)
+        with open(os.path.join(model_dir, "xgboost-model"), "rb") as f:
+            cls.booster = pickle.load(f)
+
+        rng = np.random.default_rng(29)
+        df = pd.DataFrame(rng.random((300, 7)), columns=feature_columns_names[1:])
+        df.insert(0, "sex", rng.choice(["M", "F", "I", "X"], 300))
+        cls.frame = df
+
+    def test_artifact_layout(self):
+        self.assertEqual(
+            sorted(os.listdir(self.fused_dir)), ["kernel", "model.joblib", "xgboost-model"]
+        )
+        self.assertIsInstance(self.model.preprocessor, transform.CompiledPreprocessor)
+
+    def test_predictions_match_two_container_pipeline(self):
+        missing = self.frame.head(20).copy()
+        missing.loc[::3, "height"] = np.nan
+        missing.loc[::4, "sex"] = np.nan
+        buffer = io.BytesIO()
+        np.save(buffer, self.frame.to_records(index=False, column_dtypes={"sex": "U1"}))
+        payloads = [
+            (self.frame.to_csv(header=False, index=False), "text/csv"),
+            (self.frame.head(1).to_csv(header=False, index=False), "text/csv"),
+            (missing.to_csv(header=False, index=False), "text/csv"),
+            (buffer.getvalue(), "application/x-npy"),
+            (
+                "".join(json.dumps(row) + "\n" for row in self.frame.to_numpy().tolist()),
+                "application/jsonlines",
+            ),
+        ]
+        for payload, content_type in payloads:
+            with self.subTest(content_type=content_type, rows=len(payload)):
+                np.testing.assert_array_equal(
+                    serve.predict_fn(serve.input_fn(payload, content_type), self.model),
+                    two_container_predict(self.preprocessor, self.booster, payload, content_type),
+                )
+
+    def test_labelled_rows_ignore_the_label(self):
+        labelled = self.frame.assign(**{label_column: 10.0})
+        np.testing.assert_array_equal(
+            serve.predict_fn(serve.input_fn(labelled.to_csv(header=False, index=False), "text/csv"), self.model),
+            serve.predict_fn(serve.input_fn(self.frame.to_csv(header=False, index=False), "text/csv"), self.model),
+        )
+
+    def test_csv_response_round_trips(self):
+        prediction = serve.predict_fn(
+            serve.input_fn(self.frame.to_csv(header=False, index=False), "text/csv"), self.model
+        )
+        body, content_type = serve.output_fn(prediction, "text/csv")
+        self.assertEqual(content_type, "text/csv")
+        np.testing.assert_array_equal(np.array(body.split(","), dtype=np.float32), prediction)
+
+    def test_output_fn_honors_accept(self):
+        prediction = np.random.default_rng(37).normal(size=4).astype(np.float32)
+        for accept in serve.output_encoders:
+            with self.subTest(accept=accept):
+                body, content_type = serve.output_fn(prediction, accept)
+                self.assertEqual(content_type, accept)
+                self.assertEqual(body, serve.output_encoders[accept](prediction))
+
+        for accept in ["application/json", "*/*", None]:
+            with self.subTest(accept=accept):
+                self.assertEqual(serve.output_fn(prediction, accept)[1], "text/csv")
+
+    def test_fused_source_dir_ships_only_the_serving_modules(self):
+        source_dir = fused_source_dir()
+
+        self.assertEqual(sorted(os.listdir(source_dir)), ["serve.py", "transform.py"])
+        self.assertNotIn("requirements.txt", os.listdir(source_dir))
+        # the entry point imports without the rest of src/
+        subprocess.run(
+            [sys.executable, "-c", "import serve"],
+            cwd=source_dir,
+            env=dict(os.environ, PYTHONPATH=source_dir),
+            check=True,
+        )
+
+    def test_package_rejects_mismatched_model(self):
+        base_dir = tempfile.mkdtemp()
+        preprocess_dir, model_dir = fit_artifacts(base_dir, features=5)
+        with self.assertRaises(ValueError):
+            package_model(
+                os.path.join(preprocess_dir, "model.tar.gz"),
+                os.path.join(model_dir, "model.tar.gz"),
+                os.path.join(base_dir, "model.tar.gz"),
+            )
+
+    def test_prediction_cache_serves_repeated_rows(self):
+        cache = transform.PredictionCache(max_rows=100)
+        payload = self.frame.head(50).to_csv(header=False, index=False)
+        with patch.object(transform, "prediction_cache", cache):
+            model = serve.model_fn(self.fused_dir)
+            first = serve.predict_fn(serve.input_fn(payload, "text/csv"), model)
+            # rows 25 to 49 hit, the next 25 miss
+            payload = self.frame.iloc[25:75].to_csv(header=False, index=False)
+            second = serve.predict_fn(serve.input_fn(payload, "text/csv"), model)
+
+        self.assertEqual((cache.hits, cache.misses), (25, 75))
+        np.testing.assert_array_equal(first, serve.predict_fn(self.frame.head(50), self.model))
+        np.testing.assert_array_equal(second, serve.predict_fn(self.frame.iloc[25:75], self.model))
+        self.assertEqual(second.dtype, np.float32)
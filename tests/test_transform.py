@@ -0,0 +1,303 @@
+# Copyright 2021 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                                                              *
+
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import joblib
+import numpy as np
+import pandas as pd
+from preprocess import (
+    DataProcessor,
+    feature_columns_names,
+    label_column,
+    feature_columns_dtype,
+    label_column_dtype,
+)
+import transform
+from transform import (
+    CompiledPreprocessor,
+    PredictionCache,
+    RawBatch,
+    StageMetrics,
+    encode_csv_chunks,
+    input_fn,
+    input_decoders,
+    metrics,
+    output_encoders,
+    output_fn,
+    model_fn,
+    parse_csv,
+    predict_fn,
+    read_csv_frame,
+)
+
+def fit_model_dir():
+    rng = np.random.default_rng(13)
+    df = pd.DataFrame(rng.random((200, 8)), columns=feature_columns_names[1:] + [label_column])
+    df.insert(0, "sex", rng.choice(["M", "F", "I"], 200))
+    df = df.astype(DataProcessor.merge_two_dicts(feature_columns_dtype, label_column_dtype))
+    model_dir = tempfile.mkdtemp()
+    DataProcessor(df).save_model(model_dir)
+    return model_dir
+
+class TestTransform(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.model_dir = fit_model_dir()
+        cls.model = model_fn(cls.model_dir)
+        cls.preprocessor = joblib.load(os.path.join(cls.model_dir, "model.joblib"))
+
+    def test_fast_parser_matches_pandas(self):
+        payloads = [
+            "M,0.455,0.365,0.095,0.514,0.2245,0.101,0.15",
+            "M,0.455,0.365,0.095,0.514,0.2245,0.101,0.15,15\n",
+            "F,0.53,0.42,0.135,0.677,0.2565,0.1415,0.21\nX,1,2,3,4,5,6,7\n",
+        ]
+        for payload in payloads:
+            with self.subTest(payload=payload):
+                batch = input_fn(payload, "text/csv")
+                self.assertIsInstance(batch, RawBatch)
+                np.testing.assert_array_equal(
+                    predict_fn(batch, self.model), predict_fn(read_csv_frame(payload), self.model)
+                )
+
+    def test_irregular_input_falls_back_to_pandas(self):
+        payloads = [
+            "M,0.455,,0.095,0.514,0.2245,0.101,0.15",
+            ",0.455,0.365,0.095,0.514,0.2245,0.101,0.15",
+            '"M",0.455,0.365,0.095,0.514,0.2245,0.101,0.15',
+            "M,0.455,0.365,0.095,0.514,0.2245,0.101\nM,0.455,0.365,0.095,0.514,0.2245,0.101",
+        ]
+        for payload in payloads:
+            with self.subTest(payload=payload):
+                self.assertIsNone(parse_csv(payload))
+                self.assertIsInstance(input_fn(payload, "text/csv"), pd.DataFrame)
+
+    def test_compiled_preprocessor_matches_column_transformer(self):
+        self.assertIsInstance(self.model, CompiledPreprocessor)
+        rng = np.random.default_rng(17)
+        df = pd.DataFrame(rng.normal(size=(500, 7)), columns=feature_columns_names[1:])
+        df.insert(0, "sex", rng.choice(["M", "F", "I", "X"], 500).astype(object))
+        df.loc[::7, "height"] = np.nan
+        df.loc[::11, "sex"] = np.nan
+
+        np.testing.assert_array_equal(self.model.transform(df), self.preprocessor.transform(df))
+
+    def test_compiled_preprocessor_encodes_missing_category(self):
+        rng = np.random.default_rng(19)
+        df = pd.DataFrame(rng.random((100, 8)), columns=feature_columns_names[1:] + [label_column])
+        df.insert(0, "sex", rng.choice(["M", "F"], 100).astype(object))
+        df.loc[::5, "sex"] = np.nan
+        model_dir = tempfile.mkdtemp()
+        DataProcessor(df).save_model(model_dir)
+        model = model_fn(model_dir)
+        preprocessor = joblib.load(os.path.join(model_dir, "model.joblib"))
+
+        payload = "M,1,2,3,4,5,6,7\nI,1,2,3,4,5,6,7"
+        frame = read_csv_frame(payload)
+        frame.loc[1, "sex"] = np.nan
+        np.testing.assert_array_equal(model.transform(frame), preprocessor.transform(frame))
+        np.testing.assert_array_equal(
+            predict_fn(parse_csv(payload), model), preprocessor.transform(read_csv_frame(payload))
+        )
+
+    def test_model_fn_compiles_joblib_artifact_without_kernel(self):
+        model_dir = tempfile.mkdtemp()
+        shutil.copy(os.path.join(self.model_dir, "model.joblib"), model_dir)
+        model = model_fn(model_dir)
+
+        self.assertIsNotNone(model.preprocessor)
+        self.assertIsNone(self.model.preprocessor)
+        batch = parse_csv("F,0.53,0.42,0.135,0.677,0.2565,0.1415,0.21\nX,1,2,3,4,5,6,7")
+        np.testing.assert_array_equal(predict_fn(batch, model), predict_fn(batch, self.model))
+
+    def test_stage_metrics_emit_structured_lines(self):
+        stage_metrics = StageMetrics(interval=3600, payload_log_rate=0)
+        for seconds in [0.001] * 98 + [0.5, 1.0]:
+            stage_metrics.record("predict_fn", seconds, rows=2, nbytes=10)
+        stage_metrics.record("output_fn", 0.002, error=True)
+
+        with self.assertLogs(level="INFO") as logs:
+            stage_metrics.maybe_emit(force=True)
+        lines = {line["stage"]: line for line in (json.loads(log.split(":", 2)[2]) for log in logs.output)}
+
+        self.assertEqual(lines["predict_fn"]["count"], 100)
+        self.assertEqual(lines["predict_fn"]["rows"], 200)
+        self.assertEqual(lines["predict_fn"]["bytes"], 1000)
+        self.assertLess(lines["predict_fn"]["p50_ms"], 1.3)
+        self.assertGreaterEqual(lines["predict_fn"]["p99_ms"], 500)
+        self.assertEqual(lines["predict_fn"]["max_ms"], 1000)
+        self.assertEqual(lines["output_fn"]["errors"], 1)
+        self.assertFalse(stage_metrics.sample_payload())
+        self.assertEqual(stage_metrics.histograms, {})
+
+    def test_instrumented_records_rows_and_bytes(self):
+        payload = "M,0.455,0.365,0.095,0.514,0.2245,0.101,0.15\nF,1,2,3,4,5,6,7"
+        metrics.maybe_emit(force=True)
+        input_fn(payload, "text/csv")
+        with self.assertRaises(ValueError):
+            input_fn(payload, "application/unknown")
+
+        self.assertEqual(metrics.histograms["input_fn"].count, 2)
+        self.assertEqual(metrics.rows["input_fn"], 2)
+        self.assertEqual(metrics.bytes["input_fn"], len(payload))
+        self.assertEqual(metrics.errors["input_fn"], 1)
+
+    def test_binary_and_json_lines_inputs_match_csv(self):
+        payload = "M,0.455,0.365,0.095,0.514,0.2245,0.101,0.15,15\nI,0.53,0.42,0.135,0.677,0.2565,0.1415,0.21,9"
+        frame = read_csv_frame(payload)
+        expected = predict_fn(frame, self.model)
+
+        records = np.array(
+            [tuple(row) for row in frame.itertuples(index=False)],
+            dtype=[("sex", "U1")] + [(name, "f8") for name in feature_columns_names[1:] + [label_column]],
+        )
+        npy = io.BytesIO()
+        np.save(npy, records)
+        strings = io.BytesIO()
+        np.save(strings, frame.astype(str).to_numpy().astype("U16"))
+        parquet = io.BytesIO()
+        frame.to_parquet(parquet, index=False)
+        json_lists = "\n".join(json.dumps(row) for row in frame.values.tolist())
+        json_objects = "\n".join(json.dumps(row) for row in frame.to_dict(orient="records"))
+
+        payloads = [
+            ("application/x-npy", npy.getvalue()),
+            ("application/x-npy", strings.getvalue()),
+            ("application/x-parquet", parquet.getvalue()),
+            ("application/jsonlines", json_lists),
+            ("application/jsonlines", json_objects.encode("utf-8")),
+        ]
+        for content_type, data in payloads:
+            with self.subTest(content_type=content_type):
+                np.testing.assert_array_equal(predict_fn(input_fn(data, content_type), self.model), expected)
+
+    def test_npy_records_are_decoded_without_copy(self):
+        records = np.zeros(3, dtype=[("sex", "U1")] + [(name, "f8") for name in feature_columns_names[1:]])
+        records["sex"] = ["M", "F", "I"]
+        records["height"] = [1.0, 2.0, 3.0]
+        npy = io.BytesIO()
+        np.save(npy, records)
+        data = npy.getvalue()
+
+        batch = input_decoders["application/x-npy"](data)
+        np.testing.assert_array_equal(batch.numeric[:, 2], [1.0, 2.0, 3.0])
+        self.assertTrue(np.shares_memory(batch.numeric, np.frombuffer(data, dtype=np.uint8)))
+
+    def test_binary_and_json_lines_outputs_round_trip(self):
+        prediction = np.random.default_rng(23).normal(size=(4, 11))
+        decoders = {
+            "application/x-npy": lambda body: np.load(io.BytesIO(body)),
+            "application/x-parquet": lambda body: pd.read_parquet(io.BytesIO(body)).to_numpy(),
+            "application/jsonlines": lambda body: np.array([json.loads(line) for line in body.splitlines()]),
+        }
+        for content_type, decode in decoders.items():
+            with self.subTest(content_type=content_type):
+                np.testing.assert_array_equal(decode(output_encoders[content_type](prediction)), prediction)
+
+    def test_output_fn_ignores_accept(self):
+        prediction = np.random.default_rng(37).normal(size=(4, 11))
+        for accept in list(output_encoders) + ["application/json", None]:
+            with self.subTest(accept=accept):
+                body, content_type = output_fn(prediction, accept)
+                self.assertEqual(content_type, transform.OUTPUT_CONTENT_TYPE)
+                self.assertEqual(body, output_encoders[transform.OUTPUT_CONTENT_TYPE](prediction))
+
+    def test_csv_encoder_matches_toolkit_encoder(self):
+        rng = np.random.default_rng(29)
+        prediction = rng.normal(scale=1e6, size=(1001, 11)) * rng.choice([1e-12, 1, 1e12], (1001, 11))
+        prediction[0, :6] = [np.nan, np.inf, -np.inf, -0.0, 0.1, 1e16]
+
+        # The toolkit runs csv.writer over the rows, which writes float64
+        # values with repr, as numpy 1.x returns Python's float repr.
+        expected = io.StringIO()
+        csv.writer(expected, lineterminator="\n").writerows(prediction.tolist())
+
+        for rows_per_chunk in [1, 7, 10_000]:
+            with self.subTest(rows_per_chunk=rows_per_chunk):
+                chunks = list(encode_csv_chunks(prediction, rows_per_chunk))
+                self.assertEqual(len(chunks), -(-1001 // rows_per_chunk))
+                self.assertEqual("".join(chunks), expected.getvalue())
+
+        self.assertEqual("".join(encode_csv_chunks(np.arange(3))), "0\n1\n2\n")
+        self.assertEqual("".join(encode_csv_chunks(np.float32([[0.1, 2]]))), "0.1,2.0\n")
+
+    def test_output_fn_streams_large_responses(self):
+        prediction = np.random.default_rng(31).normal(size=(25_000, 11))
+        body, content_type = output_fn(prediction, "text/csv")
+
+        self.assertEqual(content_type, "text/csv")
+        self.assertNotIsInstance(body, str)
+        self.assertEqual("".join(body), "".join(encode_csv_chunks(prediction)))
+        small, _ = output_fn(prediction[:10], "text/csv")
+        self.assertIsInstance(small, str)
+
+    def test_prediction_cache_matches_uncached_features(self):
+        cache = PredictionCache(max_rows=1000)
+        cache.bind(self.model)
+        payload = "M,0.455,0.365,0.095,0.514,0.2245,0.101,0.15\nF,1,2,3,4,5,6,7\nI,0,0,0,0,0,0,0"
+        batch = parse_csv(payload)
+        with patch.object(transform, "prediction_cache", cache):
+            first = predict_fn(batch, self.model)
+            # a partial hit with a repeated new row, a negative zero and missing values
+            payload += "\nF,1,2,3,4,5,6,8\nF,1,2,3,4,5,6,8\nI,-0.0,0,0,0,0,0,0"
+            second = predict_fn(parse_csv(payload), self.model)
+            missing = "M,0.455,,0.095,0.514,0.2245,0.101,0.15\n,1,2,3,4,5,6,7"
+            frame = predict_fn(read_csv_frame(missing), self.model)
+            frame_again = predict_fn(read_csv_frame(missing), self.model)
+
+        np.testing.assert_array_equal(first, self.model.transform(batch))
+        np.testing.assert_array_equal(second, self.model.transform(parse_csv(payload)))
+        np.testing.assert_array_equal(frame, self.model.transform(read_csv_frame(missing)))
+        np.testing.assert_array_equal(frame_again, frame)
+        # the rows of the first batch, the repeated row, the negative zero and the missing values hit
+        self.assertEqual((cache.hits, cache.misses), (7, 6))
+
+    def test_prediction_cache_evicts_least_recently_used_rows(self):
+        cache = PredictionCache(max_rows=2)
+        cache.bind(self.model)
+        rows = {name: parse_csv(f"M,{value},1,1,1,1,1,1") for name, value in zip("abc", [1, 2, 3])}
+        for name in "abac":
+            cache.transform(self.model.transform, rows[name])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+        # b was the least recently used row, so c took its place
+        cache.transform(self.model.transform, rows["a"])
+        cache.transform(self.model.transform, rows["b"])
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+        self.assertEqual(cache.stats()["rows"], 2)
+
+    def test_model_fn_invalidates_prediction_cache(self):
+        cache = PredictionCache(max_rows=100)
+        batch = parse_csv("M,0.455,0.365,0.095,0.514,0.2245,0.101,0.15")
+        with patch.object(transform, "prediction_cache", cache):
+            model = model_fn(self.model_dir)
+            predict_fn(batch, model)
+            predict_fn(batch, model)
+            self.assertEqual((cache.version, cache.hits, cache.misses), (1, 1, 1))
+
+            reloaded = model_fn(self.model_dir)
+            # the previous model is no longer served from the cache
+            predict_fn(batch, model)
+            predict_fn(batch, reloaded)
+
+        self.assertEqual((cache.version, cache.hits, cache.misses), (2, 1, 2))